@@ -0,0 +1,170 @@
+"""Compare query plans and timings of hot lookups with and without the
+model.py indexes.
+
+Builds the schema twice (as declared, and with every secondary index and
+unique constraint stripped), fills both with synthetic rows and prints the
+plan and mean time of each lookup the request paths make.
+
+    python benchmarks/query_plans.py [--rows N] [--database-uri URI]
+
+The default is a scratch SQLite file; pass a Postgres URI for an empty
+scratch database to see Postgres plans (EXPLAIN ANALYZE). Databases that
+already have tables are refused, since the schema is dropped afterwards."""
+
+import argparse, os, sys, tempfile, time
+from sqlalchemy import (MetaData, UniqueConstraint, create_engine, inspect,
+                        text)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(
+                                                os.path.abspath(__file__))))
+
+from model import db
+
+# (description, SQL, parameters) for each lookup on a request path
+QUERIES = [
+    ('login by email', 
+        'SELECT * FROM users WHERE email = :email', 
+        {'email': 'user7777@example.com'}),
+    ('unit alias lookup', 
+        'SELECT * FROM formatted_unit_names WHERE unit_name = :unit_name', 
+        {'unit_name': 'unit7777'}),
+    ('unit conversion lookup', 
+        'SELECT * FROM unit_conversions WHERE base_unit = :base_unit', 
+        {'base_unit': 'unit7777'}),
+    ('diet preferences of user', 
+        'SELECT * FROM diet_preferences WHERE user_id = :user_id', 
+        {'user_id': 7777}),
+    ('exclusions of user', 
+        'SELECT * FROM ingredient_exclusions WHERE user_id = :user_id', 
+        {'user_id': 7777}),
+    ('diets by class', 
+        'SELECT * FROM diets WHERE edamam_class = :edamam_class', 
+        {'edamam_class': 'Diet'}),
+]
+
+
+def unindexed_metadata():
+    """Copy of the model schema without secondary indexes or unique
+    constraints"""
+
+    metadata = MetaData()
+    for table in db.Model.metadata.sorted_tables:
+        copy = table.tometadata(metadata)
+        copy.indexes.clear()
+        copy.constraints = {constraint for constraint in copy.constraints 
+                                if not isinstance(constraint, UniqueConstraint)}
+
+    return metadata
+
+
+def fill(engine, metadata, rows):
+    """Insert synthetic rows into every looked-up table"""
+
+    tables = metadata.tables
+    with engine.begin() as conn:
+        conn.execute(tables['users'].insert(), 
+                        [{'user_id': idx, 'email': f'user{idx}@example.com', 
+                        'password': 'x'} for idx in range(rows)])
+        conn.execute(tables['formatted_unit_names'].insert(), 
+                        [{'unit_name': f'unit{idx}', 
+                        'formatted_name': f'unit{idx % 50}', 
+                        'meas_type': 'volume'} for idx in range(rows)])
+        conn.execute(tables['unit_conversions'].insert(), 
+                        [{'base_unit': f'unit{idx}', 'meas_type': 'volume', 
+                        'std_unit': 'cup', 'mult_factor': 1.0} 
+                                                    for idx in range(rows)])
+        conn.execute(tables['diets'].insert(), 
+                        [{'diet_id': idx, 'diet_name': f'diet{idx}', 
+                        'edamam_class': 'Health' if idx % 100 else 'Diet'} 
+                                                    for idx in range(rows)])
+        conn.execute(tables['diet_preferences'].insert(), 
+                        [{'user_id': idx, 'diet_id': idx % 10, 
+                        'strictness': 5} for idx in range(rows)])
+        conn.execute(tables['ingredient_exclusions'].insert(), 
+                        [{'user_id': idx, 'ingred_name': 'cilantro'} 
+                                                    for idx in range(rows)])
+
+
+def explain(conn, sql, params):
+    """Query plan for sql as a list of lines"""
+
+    if conn.engine.dialect.name == 'sqlite':
+        rows = conn.execute(text('EXPLAIN QUERY PLAN ' + sql), params)
+        return [row[-1] for row in rows]
+
+    rows = conn.execute(text('EXPLAIN ANALYZE ' + sql), params)
+    return [row[0] for row in rows]
+
+
+def time_query(conn, sql, params, repeat):
+    """Mean seconds per execution of sql"""
+
+    query = text(sql)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        conn.execute(query, params).fetchall()
+
+    return (time.perf_counter() - start) / repeat
+
+
+def measure(engine, metadata, rows, repeat):
+    """Plans and timings of QUERIES against a freshly filled schema"""
+
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+    fill(engine, metadata, rows)
+
+    results = []
+    with engine.connect() as conn:
+        for name, sql, params in QUERIES:
+            results.append((explain(conn, sql, params), 
+                            time_query(conn, sql, params, repeat)))
+    metadata.drop_all(engine)
+
+    return results
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--database-uri')
+    args = parser.parse_args()
+
+    scratch = None
+    uri = args.database_uri
+    if uri is None:
+        handle, scratch = tempfile.mkstemp(suffix='.sqlite')
+        os.close(handle)
+        uri = 'sqlite:///' + scratch
+
+    engine = create_engine(uri)
+    existing = inspect(engine).get_table_names()
+    if existing:
+        engine.dispose()
+        parser.error(f"{uri} already has tables ({', '.join(existing)}); "
+                        "pass an empty scratch database")
+
+    try:
+        before = measure(engine, unindexed_metadata(), args.rows, args.repeat)
+        after = measure(engine, db.Model.metadata, args.rows, args.repeat)
+    finally:
+        engine.dispose()
+        if scratch:
+            os.remove(scratch)
+
+    for (name, sql, params), (plan_before, secs_before), \
+                    (plan_after, secs_after) in zip(QUERIES, before, after):
+        print(f"{name}: {sql}")
+        print(f"  before ({secs_before * 1e6:.1f} us/query)")
+        for line in plan_before:
+            print(f"    {line}")
+        print(f"  after ({secs_after * 1e6:.1f} us/query)")
+        for line in plan_after:
+            print(f"    {line}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
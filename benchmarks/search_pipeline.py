@@ -0,0 +1,245 @@
+"""Offline benchmark of the recipe search pipeline using recorded fixtures.
+
+Replays test_resources/static_edamam_data.pickle and
+static_parsed_ingredients.pickle through extract_recipes,
+get_qualifying_recipes, check_ingred_qty and the search routes (via the
+Flask test client) with the API calls patched out. Unit tables are seeded
+into an in-memory SQLite database, so no Postgres or network is needed.
+
+    python benchmarks/search_pipeline.py [--iterations N] [--save-baseline]
+                                         [--baseline FILE] [--tolerance 0.5]
+
+Reports p50/p95/p99 latency, throughput and allocated memory per operation.
+Results are compared with the baseline file (benchmarks/baseline.json by
+default) and the exit status is 1 if median latency or peak allocated
+memory grew by more than the tolerance; the tail percentiles are reported
+but too noisy on shared machines to gate on. --save-baseline records a
+new baseline; re-record it when moving to different hardware."""
+
+import argparse, json, os, pickle, sys, tempfile, time, tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+# credentials are never sent; the API calls are patched below
+for name in ('APIKey', 'search_id', 'search_key'):
+    os.environ.setdefault(name, 'benchmark')
+
+from server import app
+from model import db
+import seed
+from utilities import recipeTools, ingredientTools, requestTracking, queryLog
+from utilities.queryLog import QueryLog
+from utilities.recipeCorpus import RecipeCorpus
+from utilities.responseCache import ResponseCache
+
+DEFAULT_BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+
+# changes smaller than these are treated as run-to-run noise
+NOISE_FLOOR = {'p50_ms': 0.5, 'peak_kb': 16}
+
+SEARCH = {'search_field': 'almond flour', 'min_qty': '0.25',
+            'max_qty': '2', 'unit': 'cup'}
+
+# module attributes setup() replaces, restored by teardown()
+PATCHED = [(recipeTools, 'call_recipe_api'), 
+            (ingredientTools, 'call_ingred_api'),
+            (recipeTools, 'recipe_corpus'), (ingredientTools, 'parse_cache'),
+            (queryLog, 'query_log'), (requestTracking, 'QUOTA_DB')]
+
+_originals = []
+
+
+def load_fixture(name):
+    """Unpickle a recorded API response from test_resources"""
+
+    with open(os.path.join('test_resources', name), 'rb') as file:
+        return pickle.load(file)
+
+
+def setup(scratch_dir):
+    """Seed unit tables in memory and patch out the upstream APIs and the
+    persistent caches and logs"""
+
+    recipe_data = load_fixture('static_edamam_data.pickle')
+    parsed_data = load_fixture('static_parsed_ingredients.pickle')
+
+    def _fixture_recipe_api(query, diet, health, num_recipes=5,
+                            excluded=None, start=0, warn=None):
+        return recipe_data
+
+    def _fixture_ingred_api(ingredients):
+        return parsed_data
+
+    _originals[:] = [(module, name, getattr(module, name)) 
+                                                for module, name in PATCHED]
+    recipeTools.call_recipe_api = _fixture_recipe_api
+    ingredientTools.call_ingred_api = _fixture_ingred_api
+    recipeTools.recipe_corpus = RecipeCorpus(':memory:')
+    ingredientTools.parse_cache = ResponseCache(':memory:')
+    # benchmark searches mustn't reach the log warm_cache.py ranks
+    queryLog.query_log = QueryLog(':memory:')
+    requestTracking.QUOTA_DB = os.path.join(scratch_dir, 'quota.sqlite')
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['TESTING'] = True
+    db.app = app
+    db.init_app(app)
+    db.create_all()
+    seed.load_diets()
+    seed.load_name_conventions()
+    seed.load_unit_conversions()
+
+    return recipe_data
+
+
+def teardown():
+    """Restore what setup() patched"""
+
+    for module, name, value in _originals:
+        setattr(module, name, value)
+    _originals.clear()
+
+
+def scenarios(recipe_data):
+    """(name, operation) pairs to measure"""
+
+    client = app.test_client()
+    recipes = recipeTools.extract_recipes(recipe_data)
+    relevant = recipeTools.parse_relevant_ingred('almond flour', recipes)
+    parsed_ingred_dict = relevant[2]
+
+    def extract():
+        recipeTools.extract_recipes(recipe_data)
+
+    def qualify():
+        # narrowing may flash a message, which needs a request
+        with app.test_request_context():
+            recipeTools.get_qualifying_recipes(recipes, ['almond flour'],
+                                                ['0.25'], ['2'], ['cup'])
+
+    def check_qty():
+        ingredientTools.check_ingred_qty(parsed_ingred_dict, '0.25', '2',
+                                            'cup')
+
+    def standard_route():
+        client.get('/standard_results',
+                    query_string={'search_field': 'almond flour'})
+
+    def ingredient_route():
+        client.get('/ingredient_results', query_string=SEARCH)
+
+    def streamed_route():
+        client.get('/stream/ingredient_results', query_string=SEARCH).data
+
+    return [('extract_recipes', extract),
+            ('get_qualifying_recipes', qualify),
+            ('check_ingred_qty', check_qty),
+            ('route /standard_results', standard_route),
+            ('route /ingredient_results', ingredient_route),
+            ('route /stream/ingredient_results', streamed_route)]
+
+
+def percentile(ordered, fraction):
+    """Value at fraction of the way through sorted samples"""
+
+    return ordered[int(fraction*(len(ordered) - 1))]
+
+
+def measure(operation, iterations, warmup=5):
+    """Latency percentiles, throughput and allocations of operation"""
+
+    for _ in range(warmup):
+        operation()
+
+    samples = []
+    total_start = time.perf_counter()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        operation()
+        samples.append(time.perf_counter() - start)
+    total = time.perf_counter() - total_start
+
+    # memory in a separate pass; tracing slows every allocation
+    alloc_runs = max(1, iterations // 10)
+    tracemalloc.start()
+    baseline_size = tracemalloc.get_traced_memory()[0]
+    for _ in range(alloc_runs):
+        operation()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    ordered = sorted(samples)
+
+    return {'p50_ms': percentile(ordered, 0.50) * 1000,
+            'p95_ms': percentile(ordered, 0.95) * 1000,
+            'p99_ms': percentile(ordered, 0.99) * 1000,
+            'ops_per_sec': iterations / total,
+            'peak_kb': (peak - baseline_size) / 1024,
+            'retained_kb_per_op': (retained - baseline_size) / alloc_runs
+                                                                    / 1024}
+
+
+def compare(results, baseline, tolerance):
+    """Names of metrics that regressed beyond tolerance"""
+
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for metric, noise in NOISE_FLOOR.items():
+            if result[metric] > max(base[metric] * (1 + tolerance), 
+                                    base[metric] + noise):
+                regressions.append(f"{name} {metric}: {base[metric]:.2f} -> "
+                                    f"{result[metric]:.2f}")
+
+    return regressions
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--baseline', metavar='FILE', default=DEFAULT_BASELINE)
+    parser.add_argument('--tolerance', type=float, default=0.5)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        recipe_data = setup(scratch_dir)
+        try:
+            with app.app_context():
+                for name, operation in scenarios(recipe_data):
+                    results[name] = measure(operation, args.iterations)
+        finally:
+            teardown()
+
+    print(f"{'operation':34} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+            f"{'ops/s':>8} {'peak KB':>8} {'kept KB':>8}")
+    for name, result in results.items():
+        print(f"{name:34} {result['p50_ms']:8.2f} {result['p95_ms']:8.2f} "
+                f"{result['p99_ms']:8.2f} {result['ops_per_sec']:8.0f} "
+                f"{result['peak_kb']:8.0f} "
+                f"{result['retained_kb_per_op']:8.1f}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+        print("Saved baseline to", args.baseline)
+
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        if regressions:
+            sys.exit(1)
+        print("No regressions against", args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+"""Gunicorn settings for serving the app in production
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Searches spend most of their time waiting on Edamam and Spoonacular, so
+each worker process runs a pool of threads (gthread) and serves that many
+searches in flight at once."""
+
+import multiprocessing, os
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_WORKERS', multiprocessing.cpu_count()))
+threads = int(os.environ.get('WEB_THREADS', 16))
+
+# a search may spend 3x ROUTE_SLO_SECONDS upstream (the deep search)
+timeout = int(os.environ.get('WEB_TIMEOUT', 30))
+keepalive = 5
@@ -0,0 +1,51 @@
+"""Alembic environment for the recipe database"""
+
+import os, sys
+from logging.config import fileConfig
+from alembic import context
+from sqlalchemy import engine_from_config, pool
+
+# make model importable when alembic runs from the project root
+sys.path.insert(0, os.path.dirname(os.path.dirname(
+                                                os.path.abspath(__file__))))
+
+from model import db
+
+config = context.config
+fileConfig(config.config_file_name)
+
+if os.environ.get('DATABASE_URL'):
+    config.set_main_option('sqlalchemy.url', os.environ['DATABASE_URL'])
+
+target_metadata = db.Model.metadata
+
+
+def run_migrations_offline():
+    """Emit migration SQL without connecting to the database"""
+
+    context.configure(url=config.get_main_option('sqlalchemy.url'),
+                        target_metadata=target_metadata, literal_binds=True)
+
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    """Run migrations against the configured database"""
+
+    section = config.get_section(config.config_ini_section)
+    connectable = engine_from_config(section, prefix='sqlalchemy.',
+                                        poolclass=pool.NullPool)
+
+    with connectable.connect() as connection:
+        context.configure(connection=connection, 
+                            target_metadata=target_metadata)
+
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,41 @@
+"""Add indexes and unique constraints on lookup columns
+
+Databases created with db.create_all() before this revision can be
+upgraded directly once duplicate emails and unit aliases are removed.
+Databases created from the current model.py already have these and only
+need 'alembic stamp head'.
+
+Revision ID: 5d3e1f2a7c90
+Revises:
+Create Date: 2026-10-18 09:00:00
+"""
+
+from alembic import op
+
+revision = '5d3e1f2a7c90'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_unique_constraint('users_email_key', 'users', ['email'])
+    op.create_unique_constraint('formatted_unit_names_unit_name_key', 
+                                'formatted_unit_names', ['unit_name'])
+    op.create_index('ix_unit_conversions_base_unit', 'unit_conversions', 
+                    ['base_unit'])
+    op.create_index('ix_diet_preferences_user_id', 'diet_preferences', 
+                    ['user_id'])
+    op.create_index('ix_ingredient_exclusions_user_id', 
+                    'ingredient_exclusions', ['user_id'])
+    op.create_index('ix_diets_edamam_class', 'diets', ['edamam_class'])
+
+
+def downgrade():
+    op.drop_index('ix_diets_edamam_class', 'diets')
+    op.drop_index('ix_ingredient_exclusions_user_id', 'ingredient_exclusions')
+    op.drop_index('ix_diet_preferences_user_id', 'diet_preferences')
+    op.drop_index('ix_unit_conversions_base_unit', 'unit_conversions')
+    op.drop_constraint('formatted_unit_names_unit_name_key', 
+                        'formatted_unit_names', type_='unique')
+    op.drop_constraint('users_email_key', 'users', type_='unique')
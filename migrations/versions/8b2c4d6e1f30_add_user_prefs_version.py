@@ -0,0 +1,26 @@
+"""Add a preferences version to users
+
+Every change to a user's diets or ingredient exclusions bumps it, so each
+app process can tell its cached copy of the preferences is stale.
+
+Revision ID: 8b2c4d6e1f30
+Revises: 5d3e1f2a7c90
+Create Date: 2026-10-18 18:00:00
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = '8b2c4d6e1f30'
+down_revision = '5d3e1f2a7c90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('prefs_version', sa.Integer(), 
+                                        nullable=False, server_default='0'))
+
+
+def downgrade():
+    op.drop_column('users', 'prefs_version')
@@ -11,8 +11,12 @@ class User(db.Model):
     __tablename__ = "users"
 
     user_id = db.Column(db.Integer, autoincrement=True, primary_key=True)
-    email = db.Column(db.String(100), nullable=True)
+    email = db.Column(db.String(100), nullable=True, unique=True)
     password = db.Column(db.String(128), nullable=True)
+    # bumped with every change to the user's diets or exclusions, so each
+    # process can tell its cached copy is stale
+    prefs_version = db.Column(db.Integer, nullable=False, default=0, 
+                                server_default='0')
 
     # rating = db.relationship("Rating")
     
@@ -27,7 +31,7 @@ class UnitConversion(db.Model):
 
     __tablename__ = "unit_conversions"
     record_id = db.Column(db.Integer, autoincrement=True, primary_key=True)
-    base_unit = db.Column(db.String(32), nullable=False)
+    base_unit = db.Column(db.String(32), nullable=False, index=True)
     meas_type = db.Column(db.String(32), nullable=False)
     std_unit = db.Column(db.String(32), nullable=False)
     mult_factor = db.Column(db.Float(5), nullable=False)
@@ -42,7 +46,7 @@ class FormattedUnit(db.Model):
 
     __tablename__ = "formatted_unit_names"
     record_id = db.Column(db.Integer, autoincrement=True, primary_key=True)
-    unit_name = db.Column(db.String(32), nullable=False)
+    unit_name = db.Column(db.String(32), nullable=False, unique=True)
     formatted_name = db.Column(db.String(32), nullable=False)
     meas_type = db.Column(db.String(32), nullable=False)
     
@@ -58,7 +62,8 @@ class ExcludedIngredient(db.Model):
 
     ingredient_exclusion_id = db.Column(db.Integer, autoincrement=True, 
                                         primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'), 
+                        index=True)
     ingred_name = db.Column(db.String(60))
     user = db.relationship('User', backref=db.backref('excluded_ingreds'))
 
@@ -74,7 +79,7 @@ class DietType(db.Model):
 
     diet_id = db.Column(db.Integer, autoincrement=True, primary_key=True)
     diet_name = db.Column(db.String(30))
-    edamam_class = db.Column(db.String(16))
+    edamam_class = db.Column(db.String(16), index=True)
     
     def __repr__(self):
 
@@ -87,7 +92,8 @@ class DietPreference(db.Model):
     __tablename__ = "diet_preferences"
 
     diet_pref_id = db.Column(db.Integer, autoincrement=True, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'), 
+                        index=True)
     diet_id = db.Column(db.Integer, db.ForeignKey('diets.diet_id'))
     strictness = db.Column(db.Integer, nullable=True)
     
@@ -1,35 +1,24 @@
 """Utility file to seed recipe database"""
 
 from datetime import datetime
-from sqlalchemy import func
+import sys, time
+from sqlalchemy import func, select, and_, bindparam
 from model import connect_to_db, db, DietType, UnitConversion, FormattedUnit
 from server import app
+from utilities import unitConversion, dietCatalog
 
 
-def load_diets():
+def load_diets(upsert=False):
     """Load diets from u.diet into database."""
 
     print("Diets")
 
-    # Delete all rows in table, so if we need to run this a second time,
-    # we won't be trying to add duplicate users
-    DietType.query.delete()
+    bulk_load(DietType, "seed_data/u.diets", 
+                ['diet_id', 'diet_name', 'edamam_class'], 
+                key=['diet_id'], upsert=upsert)
 
-    # Read u.diet file and insert data
-    for row in open("seed_data/u.diets"):
-        row = row.rstrip()
-        diet_id, diet_name, classification = row.split("|")
-
-        diet = DietType(diet_id=diet_id,
-                    diet_name=diet_name,
-                    edamam_class=classification)
-
-
-        # We need to add to the session or it won't ever be stored
-        db.session.add(diet)
-
-    # Once we're done, we should commit our work
-    db.session.commit()
+    # rebuild in-memory diet catalog from the reseeded rows
+    dietCatalog.reload_catalog()
 
 
 
@@ -107,55 +96,119 @@ def load_diets():
 #     db.session.commit()
 
 
-def load_unit_conversions():
+def load_unit_conversions(upsert=False):
     """Load unit conversions from u.unit_conversions into database."""
 
     print("Unit Conversion Table")
 
-    # Delete all rows in existing table to start fresh
-    UnitConversion.query.delete()
+    bulk_load(UnitConversion, "seed_data/u.unit_conversions", 
+                ['base_unit', 'meas_type', 'std_unit', 'mult_factor'], 
+                key=['base_unit'], upsert=upsert)
+
+    # rebuild in-memory conversion table from the reseeded rows
+    unitConversion.refresh_table()
+
 
-    # Read u.volume_units file and insert data
-    for row in open("seed_data/u.unit_conversions"):
-        row = row.rstrip()
-        base_unit, meas_type, std_unit, mult_factor = row.split("|")
 
-        conversion = UnitConversion(base_unit=base_unit, meas_type=meas_type, 
-                                    std_unit=std_unit, mult_factor=mult_factor)
+def load_name_conventions(upsert=False):
+    """Load unit name conventions from u.unit_crosswalks"""
 
+    print("Unit Formatting Table")
 
-        # We need to add to the session or it won't ever be stored
-        db.session.add(conversion)
+    # TODO: think about how to handle weight ounces vs. fluid ounces
+    bulk_load(FormattedUnit, "seed_data/u.unit_formatting", 
+                ['unit_name', 'formatted_name', 'meas_type'], 
+                key=['unit_name'], upsert=upsert)
 
-    # Once we're done, we should commit our work
-    db.session.commit()
+    # rebuild in-memory conversion table from the reseeded rows
+    unitConversion.refresh_table()
 
 
+##############################################################################
+# Bulk loading
 
-def load_name_conventions():
-    """Load unit name conventions from u.unit_crosswalks"""
+# rows sent to the database per executemany
+CHUNK_SIZE = 1000
 
-    print("Unit Formatting Table")
 
-    # Delete all rows in existing table to start fresh
-    FormattedUnit.query.delete()
+def read_rows(filename, columns, chunk_size=CHUNK_SIZE):
+    """Stream a pipe-delimited seed file as lists of column dicts"""
 
-    # Read u.unit_formatting file and insert data
-    # TODO: think about how to handle weight ounces vs. fluid ounces
-    for row in open("seed_data/u.unit_formatting"):
-        row = row.rstrip()
-        unit_name, formatted_name, meas_type = row.split("|")
+    chunk = []
+    with open(filename) as file:
+        for row in file:
+            row = row.rstrip()
+            if not row:
+                continue
 
-        convention = FormattedUnit(unit_name=unit_name, 
-                                    formatted_name = formatted_name, 
-                                    meas_type= meas_type)
+            chunk.append(dict(zip(columns, row.split("|"))))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
 
+    if chunk:
+        yield chunk
 
-        # We need to add to the session or it won't ever be stored
-        db.session.add(convention)
 
-    # Once we're done, we should commit our work
-    db.session.commit()
+def bulk_load(model, filename, columns, key=None, upsert=False, 
+                chunk_size=CHUNK_SIZE):
+    """Load a seed file into model's table with Core executemany inserts in
+    one transaction.
+
+    By default the table is emptied first. With upsert, rows whose key
+    columns match an existing row update it and the rest are inserted."""
+
+    table = model.__table__
+    start = time.perf_counter()
+    count = 0
+
+    with db.engine.begin() as conn:
+        if upsert:
+            key_columns = [table.c[name] for name in key]
+            existing = {tuple(row) for row in conn.execute(
+                                                        select(key_columns))}
+            update = table.update().where(and_(*[column == bindparam(
+                                                        'key_' + column.name)
+                                            for column in key_columns]))
+        else:
+            conn.execute(table.delete())
+
+        for chunk in read_rows(filename, columns, chunk_size):
+            if upsert:
+                inserts, updates = [], []
+                for row in chunk:
+                    row_key = tuple(_key_value(table.c[name], row[name]) 
+                                                            for name in key)
+                    if row_key in existing:
+                        updates.append(dict(row, **{'key_' + name: row[name] 
+                                                            for name in key}))
+                    else:
+                        existing.add(row_key)
+                        inserts.append(row)
+            else:
+                inserts, updates = chunk, []
+
+            # inserts first so a repeated key in one chunk ends up updated
+            if inserts:
+                conn.execute(table.insert(), inserts)
+            if updates:
+                conn.execute(update, updates)
+            count += len(chunk)
+
+    elapsed = time.perf_counter() - start
+    print(f"  {count} rows in {elapsed:.3f}s "
+            f"({count / max(elapsed, 1e-9):.0f} rows/sec)")
+
+    return count
+
+
+def _key_value(column, value):
+    """Key value from the file typed like values read back from column"""
+
+    try:
+        return column.type.python_type(value)
+    except (NotImplementedError, ValueError):
+        return value
 
 
 if __name__ == "__main__":
@@ -163,8 +216,12 @@ if __name__ == "__main__":
 
     # In case tables haven't been created, create them
     db.create_all()
-    load_diets()
+
+    # update rows in place instead of reloading the tables
+    upsert = '--upsert' in sys.argv
+
+    load_diets(upsert)
     # load_volume_units()
     # load_mass_units()
-    load_name_conventions()
-    load_unit_conversions()
+    load_name_conventions(upsert)
+    load_unit_conversions(upsert)
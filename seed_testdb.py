@@ -1,57 +1,31 @@
 """Utility file to seed recipe database"""
 
+import sys
 from datetime import datetime
 from sqlalchemy import func
 from model import connect_to_db, db, DietType, UnitConversion, FormattedUnit, User, DietPreference
 from server import app
-from seed import load_diets, load_name_conventions, load_unit_conversions
+from seed import (load_diets, load_name_conventions, load_unit_conversions,
+                    bulk_load)
 
 
-def load_users():
+def load_users(upsert=False):
     """Load diets from u.diet into database."""
 
     print("Test Users Table")
 
-    # Delete all rows in table, so if we need to run this a second time,
-    # we won't be trying to add duplicate users
-    User.query.delete()
+    bulk_load(User, "seed_data/u.test_users", ['email', 'password'], 
+                key=['email'], upsert=upsert)
 
-    # Read u.diet file and insert data
-    for row in open("seed_data/u.test_users"):
-        row = row.rstrip()
-        email, pw = row.split("|")
 
-        user = User(email = email, password = pw)
-
-        # We need to add to the session or it won't ever be stored
-        db.session.add(user)
-
-    # Once we're done, we should commit our work
-    db.session.commit()
-
-
-def load_user_diets():
+def load_user_diets(upsert=False):
     """Load diets from u.diet into database."""
 
     print("Diet Preferences Table")
 
-    # Delete all rows in table, so if we need to run this a second time,
-    # we won't be trying to add duplicate users
-    DietPreference.query.delete()
-
-    # Read u.diet file and insert data
-    for row in open("seed_data/u.test_userdiets"):
-        row = row.rstrip()
-        user_id, diet_id, strictness = row.split("|")
-
-        preference = DietPreference(user_id = user_id, diet_id = diet_id, 
-                                    strictness = strictness)
-
-        # We need to add to the session or it won't ever be stored
-        db.session.add(preference)
-
-    # Once we're done, we should commit our work
-    db.session.commit()
+    bulk_load(DietPreference, "seed_data/u.test_userdiets", 
+                ['user_id', 'diet_id', 'strictness'], 
+                key=['user_id', 'diet_id'], upsert=upsert)
 
 
 # def load_user_ingred():
@@ -83,8 +57,12 @@ if __name__ == "__main__":
 
     # In case tables haven't been created, create them
     db.create_all()
-    load_diets()
-    load_name_conventions()
-    load_unit_conversions()
-    load_users()
-    load_user_diets()
\ No newline at end of file
+
+    # update rows in place instead of reloading the tables
+    upsert = '--upsert' in sys.argv
+
+    load_diets(upsert)
+    load_name_conventions(upsert)
+    load_unit_conversions(upsert)
+    load_users(upsert)
+    load_user_diets(upsert)
\ No newline at end of file
@@ -1,9 +1,13 @@
 from flask_debugtoolbar import DebugToolbarExtension
 from jinja2 import StrictUndefined
-import os, bcrypt
+import os, time
 from utilities import recipeTools, userInteraction, requestTracking
+from utilities import passwordHashing, metrics, profiling
+from utilities import dietCatalog, resilience, queryLog
 from model import *
-from flask import Flask, render_template, request, flash, redirect, session
+from flask import (Flask, render_template, request, flash, redirect, session,
+                    Response, stream_with_context, get_flashed_messages,
+                    url_for, g, before_render_template, template_rendered)
 
 app = Flask(__name__)
 app.secret_key = "ABC"
@@ -11,6 +15,65 @@ app.secret_key = "ABC"
 # Jinja to raise errors for undefined vars
 app.jinja_env.undefined = StrictUndefined
 
+# sample request stacks when PROFILE_SAMPLE_EVERY or PROFILE_SECRET is set
+if profiling.enabled():
+    app.wsgi_app = profiling.SamplingProfiler(app.wsgi_app, app.url_map)
+
+
+@app.before_request
+def start_request_metrics():
+    """Decide whether this request's stages are timed"""
+
+    metrics.start_request()
+
+
+# latency objectives (seconds) of routes allowed more than ROUTE_SLO_SECONDS
+ROUTE_SLOS = {'find_recipes_deep_with_ingred_limits': 
+                                                3 * resilience.SLO_SECONDS}
+
+
+@app.before_request
+def start_upstream_budget():
+    """Cap this request's upstream calls at a share of its route's SLO"""
+
+    resilience.start_budget(ROUTE_SLOS.get(request.endpoint, 
+                                            resilience.SLO_SECONDS))
+
+
+@app.teardown_request
+def end_upstream_budget(exception):
+    """Lift the budget so it doesn't leak into the thread's next job"""
+
+    resilience.end_budget()
+
+
+@app.teardown_request
+def record_request_metrics(exception):
+    """Record duration and query count of the finished request"""
+
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.end_request(route)
+
+
+@before_render_template.connect_via(app)
+def start_render_timer(sender, template, context, **extra):
+    g.render_start = time.perf_counter()
+
+
+@template_rendered.connect_via(app)
+def record_render_time(sender, template, context, **extra):
+    if 'render_start' in g:
+        metrics.observe_stage('render_template', 
+                                time.perf_counter() - g.render_start)
+
+
+@app.route("/metrics")
+def show_metrics():
+    """Metrics in Prometheus text format"""
+
+    return Response(metrics.render(), 
+                    mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 
 @app.route("/")
 def homepage():
@@ -33,8 +96,13 @@ def add_user():
 
     # add user to db
     else:
-        hashed_pw = bcrypt.hashpw(pw.encode('utf-8'), bcrypt.gensalt())
-        user = User(email=email_to_check, password=hashed_pw.decode('utf-8'))
+        try:
+            hashed_pw = passwordHashing.hash_password(pw)
+        except passwordHashing.HashQueueFull:
+            flash("We're busy right now. Please try registering again shortly.")
+            return redirect("/registration")
+
+        user = User(email=email_to_check, password=hashed_pw)
         db.session.add(user)
         db.session.commit()
 
@@ -54,8 +122,19 @@ def check_login():
     user = User.query.filter(User.email==email_to_check).first()
     hashed_pw = user.password
 
-    if bcrypt.checkpw(pw.encode('utf-8'), hashed_pw.encode('utf-8')):
-        validated = True
+    try:
+        validated = passwordHashing.check_password(pw, hashed_pw)
+    except passwordHashing.HashQueueFull:
+        flash("We're busy right now. Please try logging in again shortly.")
+        return redirect("/login")
+
+    # upgrade hashes made with an older cost factor
+    if validated and passwordHashing.needs_rehash(hashed_pw):
+        try:
+            user.password = passwordHashing.hash_password(pw)
+            db.session.commit()
+        except passwordHashing.HashQueueFull:
+            pass
 
     # log in user with valid credentials
     if validated:
@@ -73,24 +152,26 @@ def check_login():
 def show_user_details(user_id):
     """User detail page"""
 
-    user = User.query.get(int(user_id))
-    diets = DietType.query.filter(DietType.edamam_class=="Diet").all()
-    health = DietType.query.filter(DietType.edamam_class=="Health").all()
+    # saved preferences come with the user instead of a query per row
+    user = User.query.options(
+                db.joinedload(User.diet_prefs).joinedload(
+                                                    DietPreference.diet_type),
+                db.joinedload(User.excluded_ingreds)).get(int(user_id))
+    catalog = dietCatalog.get_catalog()
 
 
-    return render_template("user_info.html", user=user, diets = diets, 
-                            healths = health)
+    return render_template("user_info.html", user=user, 
+                            diets = catalog.diets, healths = catalog.healths)
 
 
 @app.route('/select_diets')
 def show_diet_selection_page():
     """Dietary option selection page"""
 
-    diets = DietType.query.filter(DietType.edamam_class=="Diet").all()
-    health = DietType.query.filter(DietType.edamam_class=="Health").all()
+    catalog = dietCatalog.get_catalog()
 
-    return render_template("diet_selection.html", diets = diets, 
-                            healths = health)
+    return render_template("diet_selection.html", diets = catalog.diets, 
+                            healths = catalog.healths)
 
 
 @app.route('/update_diet', methods=['POST'])
@@ -150,6 +231,9 @@ def find_recipes():
     diet, health, excluded = userInteraction.set_food_preferences(session)
     recipes = recipeTools.get_recipes(query, diet, health, num_recipes, 
                                             excluded)
+    if recipes:
+        queryLog.query_log.record(query, diet, health, excluded, 
+                                    num_recipes)
 
     return render_template("search_results.html", recipes=recipes)
 
@@ -176,6 +260,9 @@ def find_recipes_with_ingred_limits():
 
         recipes = recipeTools.get_recipes(queries, diet, health, num_recipes, 
                                             excluded)
+        if recipes:
+            queryLog.query_log.record(queries, diet, health, excluded, 
+                                        num_recipes, ingredient=True)
         qualifying = recipeTools.get_qualifying_recipes(recipes, queries, mins, 
                                                         maxs, units)
 
@@ -186,6 +273,98 @@ def find_recipes_with_ingred_limits():
         return redirect("/recipe_search")
 
 
+@app.route("/stream/ingredient_results", methods=['GET'])
+def stream_recipes_with_ingred_limits():
+    """Recipe Search with ingredient qty checks, sending the page shell at
+    once and each stage and recipe card as it is ready"""
+
+    # check for API calls remaining
+    requests_left = requestTracking.check_api_call_budget()
+
+    if requests_left:
+        diet, health, excluded = userInteraction.set_food_preferences(session)
+        
+        queries = request.args.getlist('search_field')
+        mins = request.args.getlist('min_qty')
+        maxs = request.args.getlist('max_qty')
+        units = request.args.getlist('unit')
+
+        num_recipes = 40
+
+        def log_search(recipes):
+            if recipes:
+                queryLog.query_log.record(queries, diet, health, excluded, 
+                                            num_recipes, ingredient=True)
+
+        # pop pending messages before the session cookie is sent
+        get_flashed_messages()
+
+        events = recipeTools.stream_qualifying_recipes(queries, diet, health, 
+                                                        num_recipes, excluded,
+                                                        mins, maxs, units,
+                                                        on_fetched=log_search)
+
+        return Response(stream_with_context(stream_template(
+                            "search_results_stream.html", events=events)))
+
+    else:
+        flash("No API calls remaining, perhaps try a regular recipe request")
+        return redirect("/recipe_search")
+
+
+@app.route("/deep/ingredient_results", methods=['GET'])
+def find_recipes_deep_with_ingred_limits():
+    """Recipe Search with ingredient qty checks, paging further into the
+    results until enough recipes meet every constraint"""
+
+    # check for API calls remaining
+    requests_left = requestTracking.check_api_call_budget()
+
+    if requests_left:
+        diet, health, excluded = userInteraction.set_food_preferences(session)
+        
+        queries = request.args.getlist('search_field')
+        mins = request.args.getlist('min_qty')
+        maxs = request.args.getlist('max_qty')
+        units = request.args.getlist('unit')
+        cursor = request.args.get('cursor')
+        qualifying, next_cursor = recipeTools.find_qualifying_page(queries, 
+                                                    diet, health, excluded, 
+                                                    mins, maxs, units, 
+                                                    cursor=cursor)
+
+        # later pages aren't warmed, so only a first page with results is
+        # logged; a failed first page leaves the cursor at 0
+        if cursor is None and (qualifying or 
+                                recipeTools.decode_cursor(next_cursor) > 0):
+            queryLog.query_log.record(queries, diet, health, excluded, 
+                                        recipeTools.PAGE_SIZE, 
+                                        ingredient=True)
+
+        if next_cursor is None:
+            return render_template("search_results.html", recipes=qualifying)
+
+        next_args = request.args.to_dict(flat=False)
+        next_args['cursor'] = next_cursor
+
+        return render_template("search_results.html", recipes=qualifying,
+                                next_url=url_for(
+                                    'find_recipes_deep_with_ingred_limits', 
+                                    **next_args))
+
+    else:
+        flash("No API calls remaining, perhaps try a regular recipe request")
+        return redirect("/recipe_search")
+
+
+def stream_template(template_name, **context):
+    """Render template as a stream of chunks instead of one string"""
+
+    app.update_template_context(context)
+    template = app.jinja_env.get_template(template_name)
+
+    return template.stream(context)
+
 
 if __name__ == "__main__":
     app.debug = False
@@ -194,7 +373,9 @@ if __name__ == "__main__":
     app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 
     connect_to_db(app)
+    # diet options are static seed data, read once at startup
+    dietCatalog.get_catalog()
     DebugToolbarExtension(app)
     
     app.run(host="0.0.0.0")
-    
\ No newline at end of file
+    
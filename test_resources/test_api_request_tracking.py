@@ -1,6 +1,6 @@
-import pickle, unittest
+import os, pickle, tempfile, unittest
 from utilities import requestTracking
-from datetime import datetime
+from datetime import datetime, timedelta
 
 
 class RequestTrackingUnitTests(unittest.TestCase):
@@ -61,6 +61,119 @@ class RequestTrackingUnitTests(unittest.TestCase):
         assert call_info['call_update_date'] == now.date()
 
 
+class QuotaStoreUnitTests(unittest.TestCase):
+    """Test the shared SQLite quota store"""
+
+    def setUp(self):
+        """Use a fresh quota database for every test"""
+
+        handle, self.path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(handle)
+        os.remove(self.path)
+
+
+    def tearDown(self):
+        """Remove quota database files"""
+
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+
+    def test_store_allows_api_call(self):
+        """Test that API call allowed when API call limits not exhausted"""
+
+        store = requestTracking.QuotaStore(self.path,
+                                'test_resources/api_limits_reset.pickle')
+        assert store.has_budget()==True
+
+
+    def test_store_refreshes_daily(self):
+        """Test that daily API call count reset on next day"""
+
+        store = requestTracking.QuotaStore(self.path,
+                                'test_resources/new_day_check.pickle')
+        assert store.has_budget()==True
+        assert (store.state()['qty_calls_remaining'] 
+                                            == requestTracking.CALL_LIMIT)
+
+
+    def test_store_prevents_excess_calls(self):
+        """Test that API call not allowed when API call limit reached"""
+
+        # set budget with no calls remaining today
+        store = requestTracking.QuotaStore(self.path, None)
+        today = datetime.utcnow().date()
+        store.set_remaining(today, 0, 0)
+
+        assert store.has_budget()==False
+
+
+    def test_reserve_calls(self):
+        """Test that reservations can't overdraw the daily budget"""
+
+        store = requestTracking.QuotaStore(self.path, None)
+        store.set_remaining(datetime.utcnow().date(), 4, 100)
+
+        assert store.reserve(3)==True
+        assert store.reserve(3)==False
+        store.release(2)
+        assert store.reserve(3)==True
+        assert store.state()['qty_calls_remaining'] == 0
+
+
+    def test_update_store(self):
+        """Test that call count is updated from the response header"""
+
+        # load test header response
+        filename = 'test_resources/header_response.pickle'
+
+        test_header_file = open(filename, 'rb')
+        header = pickle.load(test_header_file)
+        test_header_file.close()
+
+        # update header date
+        now = datetime.utcnow()
+        new_date = now.strftime('%a, %d %b %Y %X')+' GMT'
+        header['Date'] = new_date
+
+        requestTracking.update_API_calls_remaining(header, path=self.path)
+        call_info = requestTracking.get_store(self.path).state()
+
+        # check that store was updated
+        assert call_info['call_update_date'] == now.date()
+        assert call_info['qty_calls_remaining'] == 9
+
+
+
+    def test_header_keeps_reservations(self):
+        """Test that header counts from earlier calls don't undo calls
+        reserved since, and that a new day's counts replace the old"""
+
+        store = requestTracking.QuotaStore(self.path, None)
+        today = datetime.utcnow().date()
+        store.set_remaining(today, 10, 100)
+        assert store.reserve(3)==True
+
+        # a response sent before the reservations reports 9 calls left
+        store.set_remaining(today, 9, 90)
+        assert store.state()['qty_calls_remaining'] == 7
+        assert store.state()['qty_results_remaining'] == 90
+
+        store.set_remaining(today + timedelta(days=1), 50, 500)
+        assert store.state()['qty_calls_remaining'] == 50
+
+
+    def test_pickle_files_deprecated(self):
+        """Test that passing pickle tracker files still works but warns"""
+
+        with self.assertWarns(DeprecationWarning):
+            allowed = requestTracking.check_api_call_budget(
+                                    'test_resources/api_limits_reset.pickle',
+                                    'test_resources/dummy.pickle')
+        assert allowed==True
+
+
 if __name__ == "__main__":
 
-    unittest.main()
\ No newline at end of file
+    unittest.main()
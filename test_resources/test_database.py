@@ -1,8 +1,9 @@
 import unittest
 from flask import session
+from sqlalchemy import event
 from server import app
-from model import connect_to_db, db
-from utilities import userInteraction
+from model import connect_to_db, db, ExcludedIngredient, DietType
+from utilities import userInteraction, dietCatalog
 
 
 class TestDatabaseInteractions(unittest.TestCase):
@@ -52,4 +53,130 @@ class TestDatabaseInteractions(unittest.TestCase):
                                     data={'ingredient-text':'cilantro, salt'},
                                     follow_redirects = True)
 
-        self.assertIn(b'ingredient exclusions have been updated', result.data)
\ No newline at end of file
+        self.assertIn(b'ingredient exclusions have been updated', result.data)
+
+
+    def test_preferences_cached(self):
+        """Test preferences load in one query, then come from the cache
+        with no queries within the TTL, one version check after it, and
+        are reloaded once updated"""
+
+        statements = []
+        def _count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        ttl = userInteraction.PREFERENCE_TTL
+        userInteraction.invalidate_food_preferences(1)
+        event.listen(db.engine, 'before_cursor_execute', _count)
+        try:
+            first = userInteraction.get_food_preferences(1)
+            loads = len(statements)
+            cached = userInteraction.get_food_preferences(1)
+            hits = len(statements) - loads
+            userInteraction.PREFERENCE_TTL = 0
+            checked = userInteraction.get_food_preferences(1)
+            checks = len(statements) - loads - hits
+            userInteraction.update_diet_preference(1, [1, 5])
+            statements.clear()
+            reloaded = userInteraction.get_food_preferences(1)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', _count)
+            userInteraction.PREFERENCE_TTL = ttl
+
+        assert loads == 1 and hits == 0 and cached is first
+        assert checks == 1 and checked is first
+        assert len(statements) == 1 and reloaded is not first
+        assert (reloaded.diet, reloaded.health) == ('balanced', 'vegan')
+
+
+    def test_update_during_load(self):
+        """Test a load overtaken by an update doesn't cache the old
+        preferences"""
+
+        load = userInteraction.load_food_preferences
+        def _load_then_update(user_id):
+            stale = load(user_id)
+            userInteraction.update_ingredient_exclusions(user_id, 'cilantro')
+            return stale
+
+        userInteraction.update_ingredient_exclusions(1, 'salt')
+        userInteraction.invalidate_food_preferences(1)
+        userInteraction.load_food_preferences = _load_then_update
+        try:
+            stale = userInteraction.get_food_preferences(1)
+        finally:
+            userInteraction.load_food_preferences = load
+
+        assert stale.excluded == ('salt',)
+        assert 1 not in userInteraction._preference_cache
+        assert userInteraction.get_food_preferences(1).excluded == (
+                                                                'cilantro',)
+
+
+    def test_version_checked_across_processes(self):
+        """Test a change saved by another process is seen once the cached
+        copy's TTL runs out"""
+
+        userInteraction.update_ingredient_exclusions(1, 'salt')
+        assert userInteraction.get_food_preferences(1).excluded == ('salt',)
+
+        # another process commits without touching this process's cache
+        ExcludedIngredient.query.filter_by(user_id=1).delete()
+        db.session.add(ExcludedIngredient(user_id=1, ingred_name='cumin'))
+        userInteraction.bump_prefs_version(1)
+        db.session.commit()
+
+        assert userInteraction.get_food_preferences(1).excluded == ('salt',)
+        ttl = userInteraction.PREFERENCE_TTL
+        userInteraction.PREFERENCE_TTL = 0
+        try:
+            assert userInteraction.get_food_preferences(1).excluded == (
+                                                                'cumin',)
+        finally:
+            userInteraction.PREFERENCE_TTL = ttl
+
+
+    def test_catalog_sees_reseed(self):
+        """Test the diet catalog reloads once another process changes the
+        diets table"""
+
+        catalog = dietCatalog.reload_catalog()
+        assert dietCatalog.get_catalog() is catalog
+
+        diet = DietType(diet_name='paleo', edamam_class='Health')
+        db.session.add(diet)
+        db.session.commit()
+        diet_id = diet.diet_id
+        try:
+            # within the check interval the loaded catalog is kept
+            assert dietCatalog.get_catalog() is catalog
+
+            dietCatalog._last_checked -= dietCatalog.REFRESH_INTERVAL
+            reloaded = dietCatalog.get_catalog()
+        finally:
+            db.session.delete(diet)
+            db.session.commit()
+            dietCatalog.reload_catalog()
+
+        assert reloaded.get(diet_id).diet_name == 'paleo'
+
+
+    def test_catalog_sees_edit_in_place(self):
+        """Test the diet catalog reloads when a row is renamed under the
+        same id, as a reseed or upsert does"""
+
+        catalog = dietCatalog.reload_catalog()
+        diet = DietType.query.get(1)
+        name = diet.diet_name
+        diet.diet_name = 'balanced-renamed'
+        db.session.commit()
+        try:
+            dietCatalog._last_checked -= dietCatalog.REFRESH_INTERVAL
+            reloaded = dietCatalog.get_catalog()
+        finally:
+            diet.diet_name = name
+            db.session.commit()
+            dietCatalog.reload_catalog()
+
+        assert catalog.get(1).diet_name == name
+        assert reloaded.get(1).diet_name == 'balanced-renamed'
@@ -1,6 +1,10 @@
-import unittest, pickle
+import unittest, pickle, os, runpy, tempfile, threading, time
+from unittest import mock
 from server import app
-from utilities import recipeTools, ingredientTools
+from utilities import recipeTools, ingredientTools, requestTracking, queryLog
+from utilities.responseCache import ResponseCache
+from utilities.queryLog import QueryLog
+from utilities.recipeCorpus import RecipeCorpus
 from model import connect_to_db, User
 
 class FlaskTestsWithoutLogin(unittest.TestCase):
@@ -17,7 +21,7 @@ class FlaskTestsWithoutLogin(unittest.TestCase):
         connect_to_db(app, 'test_db')
 
         def _mock_call_recipe_api(query, diet, health, num_recipes, 
-                                    excluded=None):
+                                    excluded=None, start=0, warn=None):
             """Mock function to circumvent API"""
 
             file = open('test_resources/static_edamam_data.pickle', 'rb')
@@ -39,6 +43,27 @@ class FlaskTestsWithoutLogin(unittest.TestCase):
         recipeTools.call_recipe_api = _mock_call_recipe_api
         ingredientTools.call_ingred_api = _mock_call_ingred_api
 
+        # keep mock parses out of the persistent ingredient cache
+        ingredientTools.parse_cache = ResponseCache(':memory:')
+        recipeTools.recipe_corpus = RecipeCorpus(':memory:')
+        queryLog.query_log = QueryLog(':memory:')
+
+        # keep tests from spending the real API budget
+        handle, self.quota_db = tempfile.mkstemp(suffix='.sqlite')
+        os.close(handle)
+        self.quota_patch = mock.patch.object(requestTracking, 'QUOTA_DB', 
+                                                self.quota_db)
+        self.quota_patch.start()
+
+
+    def tearDown(self):
+        """Restore the real quota database"""
+
+        self.quota_patch.stop()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.quota_db + suffix):
+                os.remove(self.quota_db + suffix)
+
 
     def test_user_registration(self):
         """Test existing users cannot register twice"""
@@ -89,6 +114,51 @@ class FlaskTestsWithoutLogin(unittest.TestCase):
                                     follow_redirects = True)
         self.assertIn(b'Almond Flour Muffins', result.data)
 
+        # searches are logged for the cache warmer
+        assert [search.query for search in 
+                        queryLog.query_log.top(10, since=0)] == ['test']
+
+
+    def test_empty_search_not_logged(self):
+        """Test that searches returning nothing aren't logged for warming"""
+
+        recipeTools.call_recipe_api = lambda *args, **kwargs: {'hits': []}
+        self.client.get("/standard_results", 
+                        query_string={'search_field':'nothing'})
+
+        assert queryLog.query_log.top(10, since=0) == []
+
+
+    def test_concurrent_searches(self):
+        """Test one process serves several slow searches at once on the
+        threaded worker configuration"""
+
+        config = runpy.run_path('gunicorn.conf.py')
+        assert config['worker_class'] == 'gthread' and config['threads'] > 1
+
+        search = recipeTools.call_recipe_api
+        def _slow_call_recipe_api(*args, **kwargs):
+            time.sleep(0.2)
+            return search(*args, **kwargs)
+        recipeTools.call_recipe_api = _slow_call_recipe_api
+
+        statuses = []
+        def _search(idx):
+            result = app.test_client().get("/standard_results", 
+                                    query_string={'search_field':'q%d' % idx})
+            statuses.append(result.status_code)
+
+        start = time.perf_counter()
+        workers = [threading.Thread(target=_search, args=(idx,)) 
+                                                        for idx in range(8)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        assert statuses == [200]*8
+        assert time.perf_counter() - start < 8*0.2/2
+
 
     def test_ingredient_search(self):
         """Test recipe search ingredient limits"""
@@ -102,6 +172,75 @@ class FlaskTestsWithoutLogin(unittest.TestCase):
         self.assertNotIn(b'Almond-Flour Crab Cakes With Lemon Aioli', result.data)
 
 
+    def test_streamed_ingredient_search(self):
+        """Test streamed recipe search with ingredient limits"""
+
+        result = self.client.get("/stream/ingredient_results", 
+                                    query_string={'search_field':'almond flour', 
+                                    'min_qty':'0.25','max_qty':'2', 
+                                    'unit':'cup'})
+        self.assertIn(b'Checked almond flour quantities', result.data)
+        self.assertIn(b'Almond Flour Fudge Brownies', result.data)
+        self.assertNotIn(b'Almond-Flour Crab Cakes With Lemon Aioli', result.data)
+
+
+    def test_streamed_searches_share_call(self):
+        """Test identical streamed searches in flight share one API call"""
+
+        search = recipeTools.call_recipe_api
+        calls = []
+        def _slow_call_recipe_api(*args, **kwargs):
+            calls.append(args)
+            time.sleep(0.2)
+            return search(*args, **kwargs)
+        recipeTools.call_recipe_api = _slow_call_recipe_api
+
+        pages = []
+        def _search():
+            result = app.test_client().get("/stream/ingredient_results", 
+                                    query_string={'search_field':'almond flour',
+                                    'min_qty':'0.25','max_qty':'2', 
+                                    'unit':'cup'})
+            pages.append(result.data)
+
+        workers = [threading.Thread(target=_search) for _ in range(2)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        assert len(calls) == 1
+        assert all(b'Almond Flour Fudge Brownies' in page for page in pages)
+
+
+    def test_deep_ingredient_search(self):
+        """Test paged recipe search with ingredient limits"""
+
+        result = self.client.get("/deep/ingredient_results", 
+                                    query_string={'search_field':'almond flour', 
+                                    'min_qty':'0.25','max_qty':'2', 
+                                    'unit':'cup'}, 
+                                    follow_redirects = True)
+        self.assertIn(b'Almond Flour Fudge Brownies', result.data)
+        self.assertNotIn(b'Almond-Flour Crab Cakes With Lemon Aioli', result.data)
+
+
+    def test_metrics_endpoint(self):
+        """Test stage timings are exported after a search"""
+
+        self.client.get("/ingredient_results", 
+                        query_string={'search_field':'almond flour', 
+                        'min_qty':'0.25','max_qty':'2', 'unit':'cup'})
+        result = self.client.get("/metrics")
+
+        self.assertIn(b'recipe_app_requests_total{route="/ingredient_results"}', 
+                        result.data)
+        self.assertIn(b'recipe_app_stage_seconds_count{stage="extract_recipes"}', 
+                        result.data)
+        self.assertIn(b'recipe_app_stage_seconds_count{stage="check_ingred_qty"}', 
+                        result.data)
+
+
 class FlaskTestsWithLogin(unittest.TestCase):
     """Test tracking of API calls"""
 
@@ -129,6 +268,21 @@ class FlaskTestsWithLogin(unittest.TestCase):
         self.assertIn(b'You are now logged out', result.data)
 
 
+    def test_diet_selection(self):
+        """Test diet options are listed from the diet catalog"""
+
+        result = self.client.get("/select_diets")
+        self.assertIn(b'low-carb', result.data)
+        self.assertIn(b'peanut-free', result.data)
+
+
+    def test_user_details(self):
+        """Test user page lists saved diet preferences"""
+
+        result = self.client.get("/users/1")
+        self.assertIn(b'vegan', result.data)
+
+
 
 if __name__ == "__main__":
 
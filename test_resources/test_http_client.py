@@ -0,0 +1,95 @@
+import os, tempfile, unittest
+from unittest import mock
+import requests
+from utilities import httpClient, ingredientTools, requestTracking, resilience
+
+
+class HttpClientUnitTests(unittest.TestCase):
+    """Test which upstream requests are retried"""
+
+    def test_retry_policy(self):
+        """Test that only GETs are retried, and never on 429"""
+
+        policy = httpClient.session.get_adapter('https://api.edamam.com'
+                                                                ).max_retries
+        assert policy.is_retry('GET', 503)
+        assert not policy.is_retry('GET', 429)
+        assert not policy.is_retry('POST', 503)
+
+        single = httpClient.single_attempt_session.get_adapter(
+                                        'https://rapidapi.com').max_retries
+        assert single.total == 0 and not single.is_retry('POST', 503)
+
+
+    def test_posts_use_single_attempt_session(self):
+        """Test that metered POSTs skip the retrying session"""
+
+        used = []
+        class _Session(object):
+            def __init__(self, name):
+                self.name = name
+            def request(self, method, url, **kwargs):
+                used.append(self.name)
+                response = requests.Response()
+                response._content = b'[]'
+                return response
+
+        original = (httpClient.session, httpClient.single_attempt_session)
+        httpClient.session = _Session('retrying')
+        httpClient.single_attempt_session = _Session('single')
+        try:
+            httpClient.get('https://api.edamam.com/search')
+            httpClient.post('https://rapidapi.com/parseIngredients')
+        finally:
+            httpClient.session, httpClient.single_attempt_session = original
+
+        assert used == ['retrying', 'single']
+
+
+    def test_connect_retries_reserve_calls(self):
+        """Test that each Spoonacular attempt reserves its own call, that
+        failed attempts give it back and that other errors aren't retried"""
+
+        attempts = []
+        def _flaky_call_ingred_api(ingredients):
+            attempts.append(ingredients)
+            if len(attempts) == 1:
+                raise requests.ConnectionError('connection refused')
+            if len(attempts) == 2:
+                return [{'original': ingredients}]
+            raise requests.ReadTimeout('read timed out')
+
+        original = (ingredientTools.call_ingred_api, 
+                    ingredientTools.CONNECT_BACKOFF, 
+                    ingredientTools.spoonacular)
+        ingredientTools.call_ingred_api = _flaky_call_ingred_api
+        ingredientTools.CONNECT_BACKOFF = 0
+        ingredientTools.spoonacular = resilience.CircuitBreaker('test')
+        handle, quota_db = tempfile.mkstemp(suffix='.sqlite')
+        os.close(handle)
+        store = requestTracking.get_store(quota_db)
+        try:
+            with mock.patch.object(requestTracking, 'QUOTA_DB', quota_db):
+                before = store.state()['qty_calls_remaining']
+                data = ingredientTools._call_within_budget('salt to taste')
+                spent = before - store.state()['qty_calls_remaining']
+
+                failed = ingredientTools._call_within_budget(
+                                                        'pepper to taste')
+                spent_failing = (before 
+                                    - store.state()['qty_calls_remaining'] 
+                                    - spent)
+        finally:
+            (ingredientTools.call_ingred_api, ingredientTools.CONNECT_BACKOFF,
+                ingredientTools.spoonacular) = original
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(quota_db + suffix):
+                    os.remove(quota_db + suffix)
+
+        assert data == [{'original': 'salt to taste'}] and spent == 1
+        assert failed is None and spent_failing == 0 and len(attempts) == 3
+
+
+if __name__ == "__main__":
+
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+from utilities import httpClient, metrics
+from utilities.responseCache import ResponseCache
+
+
+class MetricsUnitTests(unittest.TestCase):
+    """Test the Prometheus text export"""
+
+    def test_full_precision(self):
+        """Test large counters and small sums are exported exactly"""
+
+        counter = metrics.Counter('test_total', 'Test counter', 'route')
+        counter.inc('search', 1234567)
+        assert (list(counter.lines())[-1]
+                    == 'test_total{route="search"} 1234567')
+
+        histogram = metrics.Histogram('test_seconds', 'Test histogram',
+                                        'route')
+        histogram.observe('search', 1234.5678)
+        histogram.observe('search', 0.0001234)
+        sums = [line for line in histogram.lines() if '_sum' in line]
+        assert sums == ['test_seconds_sum{route="search"} '
+                            + repr(1234.5678 + 0.0001234)]
+
+
+    def test_stats_exported(self):
+        """Test upstream latency and cache lookups reach the export"""
+
+        httpClient.record_latency('api.example.com', 0.02)
+        cache = ResponseCache(':memory:', table='metrics_test')
+        cache.get('missing')
+
+        exported = metrics.render()
+        assert ('recipe_app_upstream_seconds_count{host="api.example.com"}'
+                    in exported)
+        assert ('recipe_app_cache_lookups_total'
+                    '{cache="metrics_test",result="miss"} 1' in exported)
+        assert '# TYPE recipe_app_password_hash_seconds histogram' in exported
+
+
+if __name__ == "__main__":
+
+    unittest.main()
@@ -0,0 +1,60 @@
+import threading, unittest
+from utilities import metrics, passwordHashing
+
+
+class PasswordHashingUnitTests(unittest.TestCase):
+    """Test password hashing on the worker pool"""
+
+    def setUp(self):
+        """Use the cheapest cost factor"""
+
+        self.rounds = passwordHashing.BCRYPT_ROUNDS
+        passwordHashing.BCRYPT_ROUNDS = 4
+
+
+    def tearDown(self):
+        """Restore the configured cost factor"""
+
+        passwordHashing.BCRYPT_ROUNDS = self.rounds
+
+
+    def test_hash_and_check(self):
+        """Test hashes verify and timings are recorded"""
+
+        hashed = passwordHashing.hash_password('hello')
+
+        assert passwordHashing.check_password('hello', hashed)
+        assert not passwordHashing.check_password('wrongpw', hashed)
+        assert not passwordHashing.check_password('hello', 'hello')
+        timings = metrics.password_hash_seconds.totals
+        assert timings['hash'] >= 1 and timings['check'] >= 3
+        assert timings['queue_wait'] >= 4
+
+
+    def test_needs_rehash(self):
+        """Test hashes with another cost factor are flagged"""
+
+        hashed = passwordHashing.hash_password('hello')
+        assert not passwordHashing.needs_rehash(hashed)
+
+        passwordHashing.BCRYPT_ROUNDS = 5
+        assert passwordHashing.needs_rehash(hashed)
+        assert passwordHashing.needs_rehash('hello')
+
+
+    def test_queue_limit(self):
+        """Test work beyond the queue depth is refused"""
+
+        slots = passwordHashing._slots
+        passwordHashing._slots = threading.BoundedSemaphore(1)
+        passwordHashing._slots.acquire()
+        try:
+            with self.assertRaises(passwordHashing.HashQueueFull):
+                passwordHashing.hash_password('hello')
+        finally:
+            passwordHashing._slots = slots
+
+
+if __name__ == "__main__":
+
+    unittest.main()
@@ -0,0 +1,102 @@
+import os, shutil, tempfile, time, unittest
+from werkzeug.routing import Map, Rule
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+from utilities import profiling
+
+
+def _slow_app(environ, start_response):
+    """WSGI app that takes long enough to be sampled"""
+
+    time.sleep(0.05)
+    return Response('done')(environ, start_response)
+
+
+class ProfilingUnitTests(unittest.TestCase):
+    """Test sampled request profiling"""
+
+    def setUp(self):
+        """Profile into a temporary directory"""
+
+        self.output_dir = tempfile.mkdtemp()
+        self.url_map = Map([Rule('/recipes/<recipe_id>', endpoint='recipe')])
+
+
+    def tearDown(self):
+        """Remove written profiles"""
+
+        shutil.rmtree(self.output_dir)
+
+
+    def profiles(self):
+        """Paths of written profiles relative to the output directory"""
+
+        return sorted(os.path.relpath(os.path.join(directory, name), 
+                                        self.output_dir)
+                        for directory, _, files in os.walk(self.output_dir)
+                        for name in files)
+
+
+    def request(self, client, path, **kwargs):
+        """Send request and close the response, as a server would"""
+
+        client.get(path, **kwargs).close()
+
+
+    def test_sampled_requests(self):
+        """Test every Nth request is profiled, grouped by route"""
+
+        middleware = profiling.SamplingProfiler(_slow_app, self.url_map, 
+                                                sample_every=2, 
+                                                output_dir=self.output_dir,
+                                                interval=0.001)
+        client = Client(middleware, Response)
+        for recipe_id in range(4):
+            self.request(client, f'/recipes/{recipe_id}')
+
+        profiles = self.profiles()
+        assert len(profiles) == 2
+        assert all(path.startswith('recipes_recipe_id') for path in profiles)
+
+        with open(os.path.join(self.output_dir, profiles[0])) as file:
+            assert '_slow_app' in file.read()
+
+
+    def test_signed_header(self):
+        """Test only validly signed, unexpired tokens turn profiling on"""
+
+        middleware = profiling.SamplingProfiler(_slow_app, self.url_map, 
+                                                sample_every=0, 
+                                                secret='s3cret',
+                                                output_dir=self.output_dir,
+                                                interval=0.001)
+        client = Client(middleware, Response)
+        self.request(client, '/recipes/1', headers={'X-Profile-Token': 
+                                    profiling.make_token('wrong')})
+        self.request(client, '/recipes/1', headers={'X-Profile-Token': 
+                                    profiling.make_token('s3cret', ttl=-1)})
+        assert self.profiles() == []
+
+        self.request(client, '/recipes/1', headers={'X-Profile-Token': 
+                                    profiling.make_token('s3cret')})
+        assert len(self.profiles()) == 1
+
+
+    def test_rotation(self):
+        """Test only the newest profiles are kept"""
+
+        middleware = profiling.SamplingProfiler(_slow_app, self.url_map, 
+                                                sample_every=1, 
+                                                output_dir=self.output_dir,
+                                                interval=0.001, max_files=2)
+        client = Client(middleware, Response)
+        for _ in range(4):
+            self.request(client, '/nowhere')
+
+        assert len(self.profiles()) == 2
+        assert all(path.startswith('unmatched') for path in self.profiles())
+
+
+if __name__ == "__main__":
+
+    unittest.main()
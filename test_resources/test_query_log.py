@@ -0,0 +1,135 @@
+import os, pickle, tempfile, time, unittest
+from unittest import mock
+import warm_cache
+from utilities import recipeTools, ingredientTools, requestTracking
+from utilities.queryLog import QueryLog
+from utilities.recipeCorpus import RecipeCorpus
+from utilities.responseCache import ResponseCache
+
+
+class QueryLogUnitTests(unittest.TestCase):
+    """Test the search log and the cache warmer reading it"""
+
+    def setUp(self):
+        """Log searches in memory and replay the static API responses"""
+
+        self.log = QueryLog(':memory:')
+        self.original = (recipeTools.call_recipe_api, 
+                            ingredientTools.call_ingred_api,
+                            recipeTools.recipe_corpus, 
+                            ingredientTools.parse_cache)
+
+        file = open('test_resources/static_edamam_data.pickle', 'rb')
+        recipe_data = pickle.load(file)
+        file.close()
+        file = open('test_resources/static_parsed_ingredients.pickle', 'rb')
+        parsed_data = pickle.load(file)
+        file.close()
+
+        self.searches = []
+        def _mock_call_recipe_api(*args, **kwargs):
+            self.searches.append(args)
+            return recipe_data
+
+        def _mock_call_ingred_api(ingredients):
+            return parsed_data
+
+        recipeTools.call_recipe_api = _mock_call_recipe_api
+        ingredientTools.call_ingred_api = _mock_call_ingred_api
+        recipeTools.recipe_corpus = RecipeCorpus(':memory:')
+        ingredientTools.parse_cache = ResponseCache(':memory:')
+
+        # keep tests from spending the real API budget
+        handle, self.quota_db = tempfile.mkstemp(suffix='.sqlite')
+        os.close(handle)
+        self.quota_patch = mock.patch.object(requestTracking, 'QUOTA_DB', 
+                                                self.quota_db)
+        self.quota_patch.start()
+
+
+    def tearDown(self):
+        """Restore the real API calls and caches"""
+
+        (recipeTools.call_recipe_api, ingredientTools.call_ingred_api,
+            recipeTools.recipe_corpus, ingredientTools.parse_cache) = \
+                                                                self.original
+        self.quota_patch.stop()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.quota_db + suffix):
+                os.remove(self.quota_db + suffix)
+
+
+    def test_top_searches(self):
+        """Test searches are grouped, ranked by count and pruned by age"""
+
+        for _ in range(3):
+            self.log.record(['Almond flour', ' eggs'], None, 'peanut-free', 
+                            None, 40, ingredient=True)
+        self.log.record('chicken', 'low-carb', None, ['celery'], 20)
+        self.log.record('', None, None, None, 20)
+
+        top = self.log.top(10, since=0)
+        assert [(search.query, search.count) for search in top] == \
+                                    [('almond flour,eggs', 3), ('chicken', 1)]
+        assert top[0].ingredient and top[1].excluded == ['celery']
+        assert len(self.log.top(1, since=0)) == 1
+
+        self.log.prune(time.time() + 1)
+        assert self.log.top(10, since=0) == []
+
+
+    def test_writes_are_batched(self):
+        """Test that searches are queued and written together"""
+
+        log = QueryLog(':memory:', flush_interval=60)
+        for query in ['chicken', 'beef', 'chicken']:
+            log.record(query, None, None, None, 20)
+
+        count = log._connection().execute('SELECT count(*) FROM searches')
+        assert count.fetchone()[0] == 0
+
+        assert [(search.query, search.count) 
+                for search in log.top(10, since=0)] == [('chicken', 2), 
+                                                        ('beef', 1)]
+
+
+    def test_warmed_key_matches_route(self):
+        """Test that replaying a logged search uses the route's cache key"""
+
+        searches = [(['Almond flour', ' eggs'], None, 'peanut-free', 
+                        ['celery '], 40),
+                    ('chicken, rice', 'low-carb', None, None, 20)]
+        for search in searches:
+            self.log.record(*search)
+            logged = self.log.top(1, since=0)[0]
+            self.log.prune(time.time() + 1)
+
+            replayed = recipeTools.recipe_search_payload(logged.query, 
+                                    logged.diet, logged.health, 
+                                    logged.num_recipes, logged.excluded)
+            assert replayed[0] == recipeTools.recipe_search_payload(
+                                    search[0], search[1], search[2], 
+                                    search[4], search[3])[0]
+
+
+    def test_warm_searches(self):
+        """Test popular searches are fetched and parsed within the share of
+        the API budget"""
+
+        self.log.record(['almond flour', 'eggs'], None, None, None, 40, 
+                        ingredient=True)
+        self.log.record('chicken', None, None, None, 20)
+        warmed = warm_cache.warm_searches(self.log.top(10, since=0))
+
+        assert sorted(search[0] for search in self.searches) == \
+                                                ['almond flour,eggs', 'chicken']
+        assert all(recipes for search, recipes in warmed)
+
+        assert warm_cache.preparse(warmed, share=0) == 0
+        remaining = requestTracking.get_store().state()['qty_calls_remaining']
+        assert warm_cache.preparse(warmed, share=1/remaining) <= 1
+
+
+if __name__ == "__main__":
+
+    unittest.main()
@@ -0,0 +1,119 @@
+import os, pickle, tempfile, time, unittest
+from utilities import recipeTools, resilience
+from utilities.responseCache import ResponseCache
+from utilities.recipeCorpus import RecipeCorpus
+
+
+class RecipeCorpusUnitTests(unittest.TestCase):
+    """Test the local recipe search index"""
+
+    def setUp(self):
+        """Index the static recipe search results"""
+
+        file = open('test_resources/static_edamam_data.pickle', 'rb')
+        self.data = pickle.load(file)
+        file.close()
+
+        self.corpus = RecipeCorpus(':memory:')
+        self.corpus.ingest(recipeTools.iter_recipes(self.data))
+
+
+    def test_ingest_is_idempotent(self):
+        """Test that seeing a recipe again updates it in place"""
+
+        count = self.corpus.count()
+        self.corpus.ingest(self.corpus.search('almond flour', limit=5))
+        assert self.corpus.count() == count
+
+
+    def test_search_ranking(self):
+        """Test that matches come back best first"""
+
+        recipes = self.corpus.search('almond flour', limit=50)
+        assert len(recipes) == self.corpus.count()
+        assert 'almond' in recipes[0].title.lower()
+
+        assert self.corpus.search('no such ingredient') == []
+
+
+    def test_search_filters(self):
+        """Test that diet, health and excluded filters are honoured"""
+
+        low_carb = self.corpus.search('almond flour', diet='low-carb', 
+                                        limit=50)
+        assert low_carb
+        assert all('Low-Carb' in recipe.diet_labels for recipe in low_carb)
+
+        vegan = self.corpus.search('almond flour', health='vegan', limit=50)
+        assert all('Vegan' in recipe.health_labels for recipe in vegan)
+
+        no_eggs = self.corpus.search('almond flour', excluded=['egg'], 
+                                        limit=50)
+        assert no_eggs
+        assert not any('egg' in ' '.join(recipe.ingredients).lower() 
+                                                    for recipe in no_eggs)
+
+
+    def test_prune(self):
+        """Test that the oldest recipes beyond the size cap are dropped"""
+
+        count = self.corpus.count()
+        self.corpus.max_recipes = count - 2
+        self.corpus.prune()
+        assert self.corpus.count() == count - 2
+        assert len(self.corpus.search('almond flour', limit=50)) <= count - 2
+
+        self.corpus.prune(now=time.time() + self.corpus.max_age + 1)
+        assert self.corpus.count() == 0
+        assert self.corpus.search('almond flour') == []
+
+
+    def test_indexed_off_request_path(self):
+        """Test that fetched searches are indexed in the background and
+        extraction alone doesn't write to the corpus"""
+
+        handle, path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(handle)
+        original = (recipeTools.recipe_corpus, recipeTools.recipe_cache)
+        recipeTools.recipe_corpus = RecipeCorpus(path)
+        recipeTools.recipe_cache = ResponseCache(':memory:')
+        try:
+            recipeTools.extract_recipes(self.data)
+            assert recipeTools.recipe_corpus.count() == 0
+
+            recipeTools.cache_recipe_data('key', self.data)
+            resilience.wait_for_refreshes()
+            assert recipeTools.recipe_corpus.count() == self.corpus.count()
+        finally:
+            recipeTools.recipe_corpus, recipeTools.recipe_cache = original
+            os.remove(path)
+
+
+    def test_local_first_search(self):
+        """Test that local results skip the API and low recall falls back"""
+
+        calls = []
+        def _mock_call_recipe_api(*args, **kwargs):
+            calls.append(args)
+            return {'hits':[]}
+
+        original_api = recipeTools.call_recipe_api
+        original_corpus = recipeTools.recipe_corpus
+        recipeTools.call_recipe_api = _mock_call_recipe_api
+        recipeTools.recipe_corpus = self.corpus
+        try:
+            local = recipeTools.get_recipes('almond flour', None, None, 5, 
+                                            None, local_first=True)
+            fallback = recipeTools.get_recipes('saffron', None, None, 5, 
+                                                None, local_first=True)
+        finally:
+            recipeTools.call_recipe_api = original_api
+            recipeTools.recipe_corpus = original_corpus
+
+        assert len(local) == 5 and len(calls) == 1
+        assert fallback == []
+
+
+if __name__ == "__main__":
+
+    unittest.main()
@@ -1,9 +1,33 @@
-import unittest
-from utilities import recipeTools, ingredientTools
+import os, tempfile, unittest
+from unittest import mock
+from utilities import recipeTools, ingredientTools, unitConversion
+from utilities import requestTracking
+from utilities import ingredientParser
+from utilities.responseCache import ResponseCache
 
 class IngredToolsUnitTests(unittest.TestCase):
     """Test that ingredient Tools work correctly"""
 
+    def setUp(self):
+        """Reserve API calls from a scratch quota database"""
+
+        # keep tests from spending the real API budget
+        handle, self.quota_db = tempfile.mkstemp(suffix='.sqlite')
+        os.close(handle)
+        self.quota_patch = mock.patch.object(requestTracking, 'QUOTA_DB', 
+                                                self.quota_db)
+        self.quota_patch.start()
+
+
+    def tearDown(self):
+        """Restore the real quota database"""
+
+        self.quota_patch.stop()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.quota_db + suffix):
+                os.remove(self.quota_db + suffix)
+
+
     def test_qty_conversion(self):
         """Test unit conversion"""
 
@@ -19,6 +43,89 @@ class IngredToolsUnitTests(unittest.TestCase):
         assert converted == 'gram'
 
 
+    def test_conversion_table_lookup(self):
+        """Test conversion table lookups without database access"""
+
+        table = unitConversion.ConversionTable(
+                                [('cups', 'cup', 'volume'),
+                                ('T', 'tablespoon', 'volume'),
+                                ('t', 'teaspoon', 'volume')],
+                                [('cup', 'volume', 'teaspoon', '48'),
+                                ('tablespoon', 'volume', 'teaspoon', '3')])
+
+        assert table.convert(2, 'CUPS.') == (96, 'teaspoon')
+        assert table.standardize('T') == 'tablespoon'
+        self.assertRaises(KeyError, table.convert, 1, 't')
+
+
+    def test_qty_batch_checking(self):
+        """Test checking several quantity limits in one pass"""
+
+        parsed = [{'original':'2 cups flour', 'amount':2, 'unitLong':'cups'},
+                {'original':'1 pound butter', 'amount':1, 'unitLong':'pound'},
+                {'original':'a pinch', 'amount':None, 'unitLong':'pinch'}]
+        mask = ingredientTools.check_ingred_qty_batch(parsed, 
+                                                    [(1, 3, 'cup'),
+                                                    (0.5, 2, 'pound')])
+
+        assert mask.tolist() == [[True, False, False], [False, True, False]]
+
+
+    def test_parse_only_unseen_lines(self):
+        """Test that only new lines the local parser can't handle are sent"""
+
+        sent = []
+        def _mock_call_ingred_api(ingredients):
+            sent.append(ingredients)
+            return [{'original':line, 'amount':1, 'unitLong':'cup', 
+                    'name':'flour'} for line in ingredients.split('\n')]
+
+        original_api = ingredientTools.call_ingred_api
+        original_cache = ingredientTools.parse_cache
+        ingredientTools.call_ingred_api = _mock_call_ingred_api
+        ingredientTools.parse_cache = ResponseCache(':memory:')
+        try:
+            ingredientTools.parse_ingredients(['salt to taste', 
+                                                'flour for dusting'])
+            parsed = ingredientTools.parse_ingredients(['pepper to taste', 
+                                                        'salt to taste',
+                                                        '1 cup oats'])
+        finally:
+            ingredientTools.call_ingred_api = original_api
+            ingredientTools.parse_cache = original_cache
+
+        assert sent == ['salt to taste\nflour for dusting', 'pepper to taste']
+        assert [ingred['original'] for ingred in parsed] == ['pepper to taste', 
+                                                            'salt to taste',
+                                                            '1 cup oats']
+
+
+    def test_memo_is_case_sensitive(self):
+        """Test that 'T' (tablespoon) and 't' (teaspoon) lines are memoized
+        separately"""
+
+        def _mock_call_ingred_api(ingredients):
+            return [{'original':line, 'amount':1, 'name':'sugar',
+                    'unitLong':'tablespoon' if ' T ' in line else 'teaspoon'}
+                    for line in ingredients.split('\n')]
+
+        original_api = ingredientTools.call_ingred_api
+        original_cache = ingredientTools.parse_cache
+        ingredientTools.call_ingred_api = _mock_call_ingred_api
+        ingredientTools.parse_cache = ResponseCache(':memory:')
+        try:
+            lines = ['1 T plus 1 tsp sugar', '1 t plus 1 tsp sugar']
+            first = ingredientTools.parse_ingredients(lines[:1])
+            second = ingredientTools.parse_ingredients(lines[1:])
+        finally:
+            ingredientTools.call_ingred_api = original_api
+            ingredientTools.parse_cache = original_cache
+
+        assert first[0]['unitLong'] == 'tablespoon'
+        assert second[0]['unitLong'] == 'teaspoon'
+        assert second[0]['original'] == '1 t plus 1 tsp sugar'
+
+
     # def test_qty_checking(self):
     #     """Test unit conversion"""
 
@@ -29,6 +136,191 @@ class IngredToolsUnitTests(unittest.TestCase):
     #     assert result == -1
 
 
+class RecipeToolsUnitTests(unittest.TestCase):
+    """Test recipe extraction and filtering helpers"""
+
+    def test_relevant_ingredient_lookup(self):
+        """Test that every line matching the ingredient is returned"""
+
+        recipes = [{'ingredients':['1 cup almond flour', 'salt']},
+                    {'ingredients':['2 eggs', '1 cup flour, almond meal']},
+                    {'ingredients':['1/2 cup Almond Flour', '2 tbsp almond flours']}]
+        relevant, lines = recipeTools.get_relevant_recipes_and_ingred(
+                                                    'almond flour', recipes)
+
+        assert relevant == [recipes[0], recipes[2]]
+        assert lines == [['1 cup almond flour'], 
+                        ['1/2 cup Almond Flour', '2 tbsp almond flours']]
+
+
+    def test_recipe_extraction(self):
+        """Test compact recipes keep dict-style access and parse lazily"""
+
+        data = {'hits':[{'recipe':{'label':'Muffins', 'image':'muffin.jpg',
+                                    'url':'muffins.com', 
+                                    'ingredients':[{'text':'2 cups flour'}]}}]}
+        recipe = recipeTools.extract_recipes(data)[0]
+
+        assert recipe['title'] == 'Muffins' and recipe.url == 'muffins.com'
+        assert str(recipe['ingredients'][0]) == '2 cups flour'
+        assert recipe.lines[0].amount == 2
+        assert recipe.lines[0].unit == 'cup'
+
+
+    def test_filtering_reuses_line_parses(self):
+        """Test lines the local parser handles are parsed once, on the
+        recipe, and only the rest are sent on"""
+
+        data = {'hits':[{'recipe':{'label':'Muffins', 'image':'', 
+                                    'url':'muffins.com', 
+                                    'ingredients':[{'text':'2 cups flour'},
+                                        {'text':'flour for dusting'}]}}]}
+        recipes = recipeTools.extract_recipes(data)
+        sent = []
+
+        def _mock_parse_ingredients(lines, local=True):
+            sent.append((lines, local))
+            return [None for line in lines]
+
+        parse_ingredients = ingredientTools.parse_ingredients
+        ingredientTools.parse_ingredients = _mock_parse_ingredients
+        try:
+            relevant, lines, parsed = recipeTools.parse_relevant_ingred(
+                                                            'flour', recipes)
+        finally:
+            ingredientTools.parse_ingredients = parse_ingredients
+
+        assert lines == [['2 cups flour', 'flour for dusting']]
+        assert parsed == [recipes[0].lines[0].parsed]
+        assert sent == [(['flour for dusting'], False)]
+
+
+    def test_search_cursor(self):
+        """Test cursors round trip and bad cursors restart the search"""
+
+        cursor = recipeTools.encode_cursor(40)
+
+        assert recipeTools.decode_cursor(cursor) == 40
+        assert recipeTools.decode_cursor(None) == 0
+        assert recipeTools.decode_cursor('not a cursor') == 0
+
+
+    def test_paged_search(self):
+        """Test pages are fetched lazily and resumed from the cursor"""
+
+        hits = [{'recipe':{'label':'Recipe %d' % idx, 'image':'', 
+                            'url':'recipes.com/%d' % idx, 'ingredients':[]}}
+                                                        for idx in range(30)]
+        calls = []
+
+        def _mock_call_recipe_api(query, diet, health, num_recipes, 
+                                    excluded=None, start=0):
+            calls.append((start, num_recipes))
+            return {'hits':hits[start:num_recipes], 
+                    'more':num_recipes < len(hits)}
+
+        call_recipe_api = recipeTools.call_recipe_api
+        recipeTools.call_recipe_api = _mock_call_recipe_api
+        try:
+            first, cursor = recipeTools.find_qualifying_page([], None, None, 
+                                            None, [], [], [], want=10, 
+                                            page_size=10)
+            rest, end = recipeTools.find_qualifying_page([], None, None, 
+                                            None, [], [], [], want=50, 
+                                            cursor=cursor, page_size=10)
+        finally:
+            recipeTools.call_recipe_api = call_recipe_api
+
+        assert [recipe.title for recipe in first] == ['Recipe %d' % idx 
+                                                        for idx in range(10)]
+        assert len(rest) == 20 and end is None
+        assert calls == [(0, 10), (10, 20), (20, 30)]
+
+
+    def test_paged_search_retries_failed_page(self):
+        """Test an unavailable upstream leaves the cursor on the failed page"""
+
+        def _mock_call_recipe_api(query, diet, health, num_recipes, 
+                                    excluded=None, start=0):
+            return recipeTools.empty_search(unavailable=True)
+
+        call_recipe_api = recipeTools.call_recipe_api
+        recipeTools.call_recipe_api = _mock_call_recipe_api
+        try:
+            cursor = recipeTools.encode_cursor(20)
+            qualifying, retry = recipeTools.find_qualifying_page([], None, 
+                                            None, None, [], [], [], 
+                                            cursor=cursor, page_size=10)
+        finally:
+            recipeTools.call_recipe_api = call_recipe_api
+
+        assert qualifying == [] and retry == cursor
+
+
+    def test_constraints_parsed_selectively(self):
+        """Test only lines that can change the result are parsed"""
+
+        hits = [{'recipe':{'label':'Recipe %d' % idx, 'image':'', 
+                            'url':'recipes.com/%d' % idx, 
+                            'ingredients':[{'text':'flour, 1 cup'}] 
+                                + ([{'text':'saffron, 1 cup'}] if idx < 2 
+                                                                else [])}}
+                                                        for idx in range(10)]
+        recipes = recipeTools.extract_recipes({'hits':hits})
+        batches = []
+
+        def _mock_parse_ingredients(lines, local=True):
+            batches.append(lines)
+            return [{'original':line, 'amount':1, 'unitLong':'cup', 
+                    'name':line.split()[-1]} for line in lines]
+
+        parse_ingredients = ingredientTools.parse_ingredients
+        ingredientTools.parse_ingredients = _mock_parse_ingredients
+        try:
+            # saffron matches too few recipes for a best match to use it
+            best_match = list(recipeTools.check_constraints(recipes, 
+                                        ['saffron', 'flour'], ['0', '0'], 
+                                        ['2', '2'], ['cup', 'cup'], 
+                                        recipeTools.BEST_MATCH_MIN))
+            unparsed = list(batches)
+
+            # the rarer saffron goes first, then flour only where it fits
+            qualifying = recipeTools.filter_recipes(recipes, 
+                                        ['flour', 'saffron'], ['0', '0'], 
+                                        ['2', '2'], ['cup', 'cup'])
+        finally:
+            ingredientTools.parse_ingredients = parse_ingredients
+
+        assert best_match == [] and unparsed == []
+        assert qualifying == recipes[:2]
+        assert batches == [['saffron, 1 cup']*2, ['flour, 1 cup']*2]
+
+
+class IngredParserUnitTests(unittest.TestCase):
+    """Test local parsing of ingredient lines"""
+
+    def test_quantity_formats(self):
+        """Test fractions, mixed numbers, unicode fractions and ranges"""
+
+        lines = ['2/3 cup almond flour', '1 1/2 Cups sugar', 
+                '2 ½ cups almond flour', '1-2 tbsp. olive oil', '200g flour']
+        parsed = ingredientParser.parse_lines(lines)
+
+        assert [ingred['amount'] for ingred in parsed] == [2/3, 1.5, 2.5, 
+                                                            1.5, 200]
+        assert [ingred['unitLong'] for ingred in parsed] == ['cup', 'cup', 
+                                                    'cup', 'tablespoon', 'gram']
+        assert parsed[0]['name'] == 'almond flour'
+
+
+    def test_unhandled_lines(self):
+        """Test that lines without a simple quantity are left to the API"""
+
+        assert ingredientParser.parse_line('salt to taste') is None
+        assert ingredientParser.parse_line(
+                            '1/2 cup plus 1 tablespoon almond flour') is None
+
+
 if __name__ == "__main__":
 
     unittest.main()
@@ -0,0 +1,172 @@
+import os, tempfile, time, unittest
+import requests
+from utilities import recipeTools, resilience
+from utilities.resilience import (CircuitBreaker, UpstreamUnavailable,
+                                    CircuitOpen, BudgetExhausted)
+from utilities.responseCache import ResponseCache
+from utilities.recipeCorpus import RecipeCorpus
+
+# the route tests replace call_recipe_api with a mock
+call_recipe_api = recipeTools.call_recipe_api
+
+
+class CircuitBreakerUnitTests(unittest.TestCase):
+    """Test the upstream circuit breaker and timeout budgets"""
+
+    def _fail(self):
+        raise requests.ConnectionError('upstream down')
+
+
+    def test_breaker_opens_and_recovers(self):
+        """Test the breaker fails fast when open and closes after a
+        successful trial call"""
+
+        breaker = CircuitBreaker('test', failure_threshold=2,
+                                    reset_timeout=0.05)
+        for _ in range(2):
+            self.assertRaises(UpstreamUnavailable, breaker.call, self._fail)
+        assert breaker.state == resilience.OPEN
+        self.assertRaises(CircuitOpen, breaker.call, lambda: 'called')
+
+        time.sleep(0.06)
+        assert breaker.state == resilience.HALF_OPEN
+        self.assertRaises(UpstreamUnavailable, breaker.call, self._fail)
+        assert breaker.state == resilience.OPEN
+
+        time.sleep(0.06)
+        assert breaker.call(lambda: 'called') == 'called'
+        assert breaker.state == resilience.CLOSED and breaker.failures == 0
+
+
+    def test_budget(self):
+        """Test timeouts shrink to the time left and an exhausted budget
+        isn't blamed on the upstream"""
+
+        assert resilience.call_timeout((3, 10)) == (3, 10)
+
+        resilience.start_budget(1)
+        try:
+            connect, read = resilience.call_timeout((3, 10))
+            assert read <= resilience.UPSTREAM_SHARE and connect == read
+
+            resilience.start_budget(0)
+            breaker = CircuitBreaker('test', failure_threshold=1)
+            self.assertRaises(BudgetExhausted, breaker.call,
+                                resilience.call_timeout)
+            assert breaker.state == resilience.CLOSED
+        finally:
+            resilience.end_budget()
+
+
+class RecipeFallbackUnitTests(unittest.TestCase):
+    """Test recipe searches while Edamam is slow or failing"""
+
+    def setUp(self):
+        """Use a scratch cache and a fresh breaker"""
+
+        self.original = (recipeTools.recipe_cache, recipeTools.edamam,
+                            recipeTools.request_recipe_search, 
+                            recipeTools.recipe_corpus)
+        recipeTools.recipe_corpus = RecipeCorpus(':memory:')
+
+        # a file, so the refresh thread sees the same entries
+        handle, self.path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(handle)
+        recipeTools.recipe_cache = ResponseCache(self.path, ttl=0,
+                                                    stale_ttl=60)
+        recipeTools.edamam = CircuitBreaker('edamam', failure_threshold=1)
+
+
+    def tearDown(self):
+        """Restore the real cache and breaker"""
+
+        (recipeTools.recipe_cache, recipeTools.edamam,
+            recipeTools.request_recipe_search, 
+            recipeTools.recipe_corpus) = self.original
+        os.remove(self.path)
+
+
+    def test_failure_returns_empty_search(self):
+        """Test an upstream error gives no recipes instead of an error"""
+
+        def _error_response(payload):
+            return recipeTools.check_recipe_data({'status': 'error',
+                                        'message': 'Usage limits exceeded'})
+        recipeTools.request_recipe_search = _error_response
+
+        data = call_recipe_api('chicken', None, None)
+        assert data['hits'] == []
+        assert list(recipeTools.iter_recipes(data)) == []
+        assert recipeTools.edamam.state == resilience.OPEN
+
+
+    def test_client_error_keeps_breaker_closed(self):
+        """Test a rejected search gives no recipes without opening the
+        breaker or being cached"""
+
+        def _rejected_response(payload):
+            response = requests.Response()
+            response.status_code = 400
+            response._content = b'{"message": "invalid diet"}'
+            resilience.check_status('edamam', response)
+        recipeTools.request_recipe_search = _rejected_response
+
+        data = call_recipe_api('chicken', None, None)
+        assert data['hits'] == []
+        assert recipeTools.edamam.state == resilience.CLOSED
+
+        cache_key, payload = recipeTools.recipe_search_payload('chicken',
+                                                        None, None, 5, None)
+        assert recipeTools.recipe_cache.lookup(cache_key)[0] is None
+
+
+    def test_credential_errors_reported_separately(self):
+        """Test refused keys aren't blamed on the search and their notice
+        reaches a streamed page"""
+
+        def _unauthorized_response(payload):
+            response = requests.Response()
+            response.status_code = 401
+            response._content = b'{"message": "invalid app_key"}'
+            resilience.check_status('edamam', response)
+        recipeTools.request_recipe_search = _unauthorized_response
+
+        notices = []
+        data = call_recipe_api('chicken', None, None, warn=notices.append)
+        assert data['hits'] == [] and data['unavailable']
+        assert recipeTools.edamam.state == resilience.CLOSED
+        assert len(notices) == 1 and 'search terms' not in notices[0]
+
+        mocked = recipeTools.call_recipe_api
+        recipeTools.call_recipe_api = call_recipe_api
+        try:
+            events = list(recipeTools.stream_qualifying_recipes(['chicken'], 
+                                            None, None, 5, None, [], [], []))
+        finally:
+            recipeTools.call_recipe_api = mocked
+        assert ('stage', notices[0]) in events
+
+
+    def test_stale_while_revalidate(self):
+        """Test an expired search is served at once and refreshed behind"""
+
+        cache_key, payload = recipeTools.recipe_search_payload('chicken',
+                                                        None, None, 5, None)
+        recipeTools.recipe_cache.set(cache_key, {'hits': [], 'count': 1})
+
+        def _fresh_response(payload):
+            return {'hits': [], 'count': 2}
+        recipeTools.request_recipe_search = _fresh_response
+
+        assert call_recipe_api('chicken', None, None)['count'] == 1
+
+        for _ in range(50):
+            if recipeTools.recipe_cache.lookup(cache_key)[0]['count'] == 2:
+                break
+            time.sleep(0.01)
+        assert recipeTools.recipe_cache.lookup(cache_key)[0]['count'] == 2
+
+
+if __name__ == "__main__":
+
+    unittest.main()
@@ -0,0 +1,57 @@
+import os, tempfile, unittest
+from utilities.responseCache import ResponseCache
+
+
+class ResponseCacheUnitTests(unittest.TestCase):
+    """Test caching of upstream API responses"""
+
+    def setUp(self):
+        """Create a cache backed by a temporary file"""
+
+        handle, self.path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(handle)
+        self.cache = ResponseCache(self.path, max_entries=2)
+
+
+    def tearDown(self):
+        """Remove temporary cache file"""
+
+        os.remove(self.path)
+
+
+    def test_key_normalization(self):
+        """Test that equivalent payloads share a cache key"""
+
+        key = self.cache.make_key({'q':'Chicken ', 'excluded':['b', 'a']})
+        same_key = self.cache.make_key({'excluded':['a', 'B'], 'q':'chicken'})
+        assert key == same_key
+
+
+    def test_cache_survives_restart(self):
+        """Test that entries evicted from memory are read back from disk"""
+
+        for idx in range(3):
+            self.cache.set(str(idx), {'hits':[idx]})
+        assert self.cache.get('0') == {'hits':[0]}
+
+        restarted = ResponseCache(self.path)
+        assert restarted.get('2') == {'hits':[2]}
+        assert restarted.get('missing') is None
+        assert restarted.stats()['disk_hits'] == 1
+
+
+    def test_stale_entries(self):
+        """Test expired entries are served as stale within stale_ttl"""
+
+        cache = ResponseCache(self.path, ttl=0, stale_ttl=60)
+        cache.set('search', {'hits':[1]})
+
+        assert cache.get('search') is None
+        assert cache.lookup('search') == ({'hits':[1]}, False)
+        assert cache.lookup('missing') == (None, False)
+        assert cache.stats()['stale_hits'] == 2
+
+
+if __name__ == "__main__":
+
+    unittest.main()
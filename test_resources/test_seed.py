@@ -0,0 +1,111 @@
+import os, shutil, tempfile, unittest
+from server import app
+from model import connect_to_db, db, DietType, UnitConversion
+from utilities import dietCatalog, unitConversion
+import seed
+
+CONVERSION_COLUMNS = ['base_unit', 'meas_type', 'std_unit', 'mult_factor']
+
+
+class SeedUnitTests(unittest.TestCase):
+    """Test bulk loading and upserting of seed files"""
+
+    def setUp(self):
+        """Connect to the test database and use a scratch seed directory"""
+
+        app.config['TESTING'] = True
+        connect_to_db(app, 'test_db')
+        self.seed_dir = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        """Reload the real seed files and caches"""
+
+        shutil.rmtree(self.seed_dir)
+        seed.bulk_load(DietType, "seed_data/u.diets", 
+                        ['diet_id', 'diet_name', 'edamam_class'], 
+                        key=['diet_id'], upsert=True)
+        seed.load_unit_conversions()
+        dietCatalog.reload_catalog()
+
+
+    def seed_file(self, name, rows):
+        """Write pipe-delimited rows to a scratch seed file"""
+
+        path = os.path.join(self.seed_dir, name)
+        with open(path, 'w') as file:
+            file.write('\n'.join('|'.join(row) for row in rows) + '\n')
+
+        return path
+
+
+    def test_bulk_load(self):
+        """Test a full load replaces the table, reading in chunks"""
+
+        path = self.seed_file('u.unit_conversions', 
+                                [('teaspoon', 'volume', 'teaspoon', '1'),
+                                ('cup', 'volume', 'teaspoon', '48'),
+                                ('gram', 'mass', 'gram', '1')])
+
+        count = seed.bulk_load(UnitConversion, path, CONVERSION_COLUMNS, 
+                                key=['base_unit'], chunk_size=2)
+        rows = db.session.query(UnitConversion.base_unit, 
+                                UnitConversion.mult_factor).order_by(
+                                    UnitConversion.record_id).all()
+
+        assert count == 3
+        assert rows == [('teaspoon', 1), ('cup', 48), ('gram', 1)]
+
+
+    def test_upsert_invalidates_caches(self):
+        """Test an upsert edits rows in place, inserts new ones and is
+        picked up by processes holding the conversion table and catalog"""
+
+        path = self.seed_file('u.unit_conversions', 
+                                [('teaspoon', 'volume', 'teaspoon', '1'),
+                                ('cup', 'volume', 'teaspoon', '48')])
+        seed.bulk_load(UnitConversion, path, CONVERSION_COLUMNS, 
+                        key=['base_unit'])
+        cup_id = UnitConversion.query.filter_by(base_unit='cup').one(
+                                                                ).record_id
+        table = unitConversion.refresh_table()
+        catalog = dietCatalog.reload_catalog()
+
+        # as another process would: no explicit refresh after the upsert
+        path = self.seed_file('u.unit_conversions', 
+                                [('cup', 'volume', 'teaspoon', '50'),
+                                ('pint', 'volume', 'teaspoon', '96')])
+        seed.bulk_load(UnitConversion, path, CONVERSION_COLUMNS, 
+                        key=['base_unit'], upsert=True)
+        path = self.seed_file('u.diets', [('1', 'balanced-upserted', 'Diet')])
+        seed.bulk_load(DietType, path, 
+                        ['diet_id', 'diet_name', 'edamam_class'], 
+                        key=['diet_id'], upsert=True)
+        db.session.expire_all()
+
+        cup = UnitConversion.query.filter_by(base_unit='cup').one()
+        assert cup.record_id == cup_id and cup.mult_factor == 50
+        assert UnitConversion.query.count() == 3
+
+        unitConversion._last_checked -= unitConversion.REFRESH_INTERVAL
+        dietCatalog._last_checked -= dietCatalog.REFRESH_INTERVAL
+        assert table.convert(1, 'cup') == (48, 'teaspoon')
+        assert unitConversion.get_table().convert(1, 'cup') == (50, 
+                                                                'teaspoon')
+        assert catalog.get(1).diet_name == 'balanced'
+        assert dietCatalog.get_catalog().get(1).diet_name == (
+                                                        'balanced-upserted')
+
+
+    def test_key_value(self):
+        """Test file keys are typed like the column they are matched on"""
+
+        assert seed._key_value(DietType.__table__.c.diet_id, '3') == 3
+        assert seed._key_value(DietType.__table__.c.diet_id, 'x') == 'x'
+        assert seed._key_value(UnitConversion.__table__.c.base_unit, 
+                                'cup') == 'cup'
+
+
+if __name__ == "__main__":
+
+    unittest.main()
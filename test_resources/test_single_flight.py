@@ -0,0 +1,64 @@
+import threading, time, unittest
+from utilities.singleFlight import SingleFlight
+
+
+class SingleFlightUnitTests(unittest.TestCase):
+    """Test coalescing of identical in-flight calls"""
+
+    def test_threads_share_call(self):
+        """Test concurrent threads with one key make a single call"""
+
+        flight = SingleFlight()
+        calls = []
+        def _slow_search(query):
+            calls.append(query)
+            time.sleep(0.1)
+            return [query]
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+                        flight.do('chicken', _slow_search, 'chicken')))
+                                                        for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert calls == ['chicken']
+        assert len(results) == 5 and all(result is results[0] 
+                                                    for result in results)
+
+        # finished calls aren't reused
+        flight.do('chicken', _slow_search, 'chicken')
+        assert len(calls) == 2
+
+
+    def test_errors_shared(self):
+        """Test waiters see the error raised by the shared call"""
+
+        flight = SingleFlight()
+        started = threading.Event()
+        def _failing_search():
+            started.set()
+            time.sleep(0.05)
+            raise KeyError('hits')
+
+        errors = []
+        def _search():
+            try:
+                flight.do('key', _failing_search)
+            except KeyError as error:
+                errors.append(error)
+
+        leader = threading.Thread(target=_search)
+        leader.start()
+        started.wait()
+        _search()
+        leader.join()
+
+        assert len(errors) == 2 and flight.shared == 1
+
+
+if __name__ == "__main__":
+
+    unittest.main()
@@ -3,6 +3,16 @@ from test_resources.test_flask_routes import *
 from test_resources.test_api_request_tracking import * 
 from test_resources.test_recipe_processing import * 
 from test_resources.test_database import *
+from test_resources.test_response_cache import *
+from test_resources.test_recipe_corpus import *
+from test_resources.test_password_hashing import *
+from test_resources.test_profiling import *
+from test_resources.test_single_flight import *
+from test_resources.test_resilience import *
+from test_resources.test_query_log import *
+from test_resources.test_http_client import *
+from test_resources.test_metrics import *
+from test_resources.test_seed import *
 
 
 if __name__ == "__main__":
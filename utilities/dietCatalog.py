@@ -0,0 +1,96 @@
+"""Process-wide catalog of the diet and health options in the diets table"""
+
+import hashlib, threading, time
+from collections import namedtuple
+from model import db, DietType
+
+# seconds between checks for a reseeded diets table
+REFRESH_INTERVAL = 300
+
+DietOption = namedtuple('DietOption', ['diet_id', 'diet_name', 
+                                        'edamam_class'])
+
+_lock = threading.Lock()
+_catalog = None
+_last_checked = 0
+
+
+class DietCatalog(object):
+    """Diet options by id and the option lists shown on diet forms"""
+
+    def __init__(self, options, fingerprint=None):
+
+        self.fingerprint = fingerprint
+        self.by_id = {option.diet_id: option for option in options}
+        self.diets = tuple(option for option in options 
+                                        if option.edamam_class == 'Diet')
+        self.healths = tuple(option for option in options 
+                                        if option.edamam_class == 'Health')
+
+    def get(self, diet_id):
+        """Option for diet_id, None if unknown"""
+
+        return self.by_id.get(diet_id)
+
+
+def _read_options():
+    """Every diet type, in one query"""
+
+    rows = db.session.query(DietType.diet_id, DietType.diet_name,
+                            DietType.edamam_class).order_by(DietType.diet_id)
+
+    return [DietOption(*row) for row in rows]
+
+
+def _fingerprint(options):
+    """Hash of the diet rows; seeds and upserts that keep ids still change
+    names or classes"""
+
+    return hashlib.sha256(repr(options).encode('utf-8')).hexdigest()
+
+
+def _load_catalog(options=None):
+    """Build the catalog from options, reading them if not given"""
+
+    if options is None:
+        options = _read_options()
+
+    return DietCatalog(options, _fingerprint(options))
+
+
+def get_catalog():
+    """Return the loaded catalog, loading it on first use and reloading it
+    when the diets table has been reseeded"""
+
+    global _catalog, _last_checked
+
+    catalog = _catalog
+    now = time.monotonic()
+    if catalog is not None and now - _last_checked < REFRESH_INTERVAL:
+        return catalog
+
+    with _lock:
+        if _catalog is None:
+            _catalog = _load_catalog()
+
+        # another process may have reseeded or edited the diets table
+        elif now - _last_checked >= REFRESH_INTERVAL:
+            options = _read_options()
+            if _fingerprint(options) != _catalog.fingerprint:
+                _catalog = _load_catalog(options)
+
+        _last_checked = now
+
+        return _catalog
+
+
+def reload_catalog():
+    """Rebuild the catalog, e.g. after seed.py reloads the diets table"""
+
+    global _catalog, _last_checked
+
+    with _lock:
+        _catalog = _load_catalog()
+        _last_checked = time.monotonic()
+
+    return _catalog
@@ -0,0 +1,89 @@
+"""Shared, pooled HTTP client for outbound API calls"""
+
+import time
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from utilities import metrics
+
+# (connect, read) timeouts in seconds
+DEFAULT_TIMEOUT = (3.05, 10)
+
+# keep-alive connections per host; extra callers wait for a free one
+MAX_PER_HOST = 10
+
+# server errors worth retrying; a 429 against a daily quota won't recover
+RETRY_STATUSES = (500, 502, 503, 504)
+
+# only idempotent, unmetered requests are retried here; metered APIs
+# (Spoonacular POSTs) charge every attempt, so their callers retry
+RETRY_METHODS = frozenset(['GET'])
+
+
+def _retry_policy():
+    """Retry GETs on connection errors and 5xx with exponential backoff"""
+
+    options = dict(total=3, backoff_factor=0.3,
+                    status_forcelist=RETRY_STATUSES, raise_on_status=False,
+                    respect_retry_after_header=True)
+    methods = RETRY_METHODS
+
+    try:
+        return Retry(allowed_methods=methods, **options)
+    except TypeError:
+        # urllib3 < 1.26 names this option differently
+        return Retry(method_whitelist=methods, **options)
+
+
+def _make_session(max_retries):
+    """Session whose connection pools are shared by all API calls"""
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_PER_HOST,
+                            pool_block=True, max_retries=max_retries)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    return session
+
+
+session = _make_session(_retry_policy())
+
+# one attempt per request, not even connect retries
+single_attempt_session = _make_session(Retry(0, read=False))
+
+
+def request(method, url, timeout=DEFAULT_TIMEOUT, **kwargs):
+    """Send request through the shared session and record its latency;
+    only RETRY_METHODS are retried"""
+
+    host = urlsplit(url).netloc
+    client = session if method in RETRY_METHODS else single_attempt_session
+    start = time.perf_counter()
+    try:
+        response = client.request(method, url, timeout=timeout, **kwargs)
+    finally:
+        record_latency(host, time.perf_counter() - start)
+
+    metrics.record_upstream_bytes(host, len(response.content))
+
+    return response
+
+
+def get(url, **kwargs):
+    """GET through the shared session"""
+
+    return request('GET', url, **kwargs)
+
+
+def post(url, **kwargs):
+    """POST through the shared session"""
+
+    return request('POST', url, **kwargs)
+
+
+def record_latency(host, seconds):
+    """Export call latency for host on /metrics"""
+
+    metrics.upstream_seconds.observe(host, seconds)
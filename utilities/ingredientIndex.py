@@ -0,0 +1,101 @@
+"""Inverted index from ingredient tokens to recipe ingredient lines"""
+
+import re, sys
+from collections import defaultdict
+
+_token_pattern = re.compile(r'[a-z0-9]+')
+
+
+def normalize_token(token):
+    """Fold simple plurals so 'almonds' and 'almond' share postings"""
+
+    if len(token) > 4 and token.endswith('ies'):
+        return token[:-3] + 'y'
+    if len(token) > 4 and token.endswith('oes'):
+        return token[:-2]
+    if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+
+    return token
+
+
+def tokenize(text):
+    """Lowercase, split on non-alphanumerics and normalize each token"""
+
+    return [sys.intern(normalize_token(token))
+                            for token in _token_pattern.findall(text.lower())]
+
+
+class IngredientIndex(object):
+    """Token -> (recipe position, line position) postings over recipes
+
+    Postings are packed as recipe position << 16 | line position."""
+
+    def __init__(self, recipes):
+
+        self.line_tokens = []
+        self.postings = defaultdict(list)
+
+        for recipe_idx, recipe in enumerate(recipes):
+            recipe_tokens = []
+            for line_idx, line in enumerate(recipe['ingredients']):
+                tokens = tuple(tokenize(str(line)))
+                recipe_tokens.append(tokens)
+                posting = recipe_idx << 16 | line_idx
+                for token in set(tokens):
+                    self.postings[token].append(posting)
+            self.line_tokens.append(recipe_tokens)
+
+    def lookup(self, query):
+        """Return {recipe position: [matching line positions]} for query
+
+        A line matches when it contains the query's tokens in order."""
+
+        query_tokens = tuple(tokenize(query))
+        if not query_tokens:
+            return {}
+
+        # intersect the shortest posting lists first
+        postings = sorted((self.postings.get(token, ())
+                            for token in set(query_tokens)), key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates.intersection_update(posting)
+            if not candidates:
+                return {}
+
+        matches = defaultdict(list)
+        for posting in sorted(candidates):
+            recipe_idx, line_idx = posting >> 16, posting & 0xFFFF
+            if len(query_tokens) == 1 or _contains_phrase(
+                    self.line_tokens[recipe_idx][line_idx], query_tokens):
+                matches[recipe_idx].append(line_idx)
+
+        return matches
+
+
+def _contains_phrase(tokens, phrase):
+    """Whether phrase appears as a contiguous run in tokens"""
+
+    size = len(phrase)
+    for start in range(len(tokens) - size + 1):
+        if tokens[start:start + size] == phrase:
+            return True
+
+    return False
+
+
+class RecipeList(list):
+    """List of extracted recipes that builds its index once, on first use"""
+
+    def __init__(self, recipes=()):
+
+        super().__init__(recipes)
+        self._ingredient_index = None
+
+    @property
+    def ingredient_index(self):
+        if self._ingredient_index is None:
+            self._ingredient_index = IngredientIndex(self)
+
+        return self._ingredient_index
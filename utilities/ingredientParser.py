@@ -0,0 +1,140 @@
+"""Local rule-based parser for recipe ingredient lines"""
+
+import os, re, unicodedata
+
+UNIT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            os.pardir, 'seed_data', 'u.unit_formatting')
+
+# size words that may sit between the quantity and the unit
+MODIFIERS = ['heaping', 'heaped', 'level', 'scant', 'rounded', 'generous',
+                'large', 'medium', 'small']
+
+VULGAR_FRACTIONS = '½⅓⅔¼¾⅕⅖⅗⅘⅙⅚⅛⅜⅝⅞'
+
+
+def load_unit_aliases(filename=UNIT_FILE):
+    """Read alias -> formatted unit name pairs from the unit seed file"""
+
+    aliases = {}
+    for row in open(filename):
+        row = row.rstrip()
+        if not row:
+            continue
+        unit_name, formatted_name, meas_type = row.split("|")
+        aliases[unit_name] = formatted_name
+
+    return aliases
+
+
+def _build_pattern(aliases):
+    """Compile the ingredient line grammar for the given unit aliases"""
+
+    # 'T' is tablespoon and 't' teaspoon, everything else ignores case
+    case_sensitive = [alias for alias in aliases if alias in ('T', 't')]
+    other = [alias for alias in aliases if alias not in case_sensitive]
+
+    def alternation(names):
+        names = sorted(names, key=len, reverse=True)
+        return '|'.join(re.escape(name) for name in names)
+
+    unit = rf'(?:{alternation(case_sensitive)}|(?i:{alternation(other)}))'
+
+    number = r'\d+(?:\.\d+)?'
+    fraction = r'\d+\s*/\s*\d+'
+    vulgar = f'[{VULGAR_FRACTIONS}]'
+    amount = (rf'(?:{number}\s+{fraction}|{number}\s*{vulgar}|{fraction}'
+                rf'|{vulgar}|{number})')
+    modifier = '|'.join(MODIFIERS)
+
+    return re.compile(rf'''
+        ^\s*(?P<low>{amount})
+        (?:\s*(?:-|–|to|or)\s*(?P<high>{amount}))?
+        \s*(?:(?i:{modifier})\s+)?
+        (?:(?P<unit>{unit})(?![A-Za-z])\.?)?
+        \s*(?:(?i:of)\s+)?
+        (?P<name>.*)$''', re.VERBOSE)
+
+
+def _to_number(text):
+    """Convert '1', '1.5', '1/2', '1 1/2', '1½' or '½' to a float"""
+
+    try:
+        return float(text)
+    except ValueError:
+        pass
+
+    text = text.strip()
+    total = 0.0
+
+    if text[-1] in VULGAR_FRACTIONS:
+        total += unicodedata.numeric(text[-1])
+        text = text[:-1].strip()
+        if not text:
+            return total
+
+    # whole numbers and fractions, e.g. '1 1/2' -> 1 + 0.5
+    for part in SLASH_PATTERN.sub('/', text).split():
+        if '/' in part:
+            numerator, denominator = part.split('/')
+            total += float(numerator)/float(denominator)
+        else:
+            total += float(part)
+
+    return total
+
+
+def _clean_name(name):
+    """Strip parenthetical notes and punctuation from ingredient name"""
+
+    if '(' in name:
+        name = PARENS_PATTERN.sub(' ', name)
+    name = name.split(',', 1)[0]
+
+    return ' '.join(name.split()).strip(' .;:-*').lower()
+
+
+ALIASES = load_unit_aliases()
+LINE_PATTERN = _build_pattern(ALIASES)
+COMPOUND_PATTERN = re.compile(rf'(?i)(?:plus|and)\s+[\d{VULGAR_FRACTIONS}]')
+SLASH_PATTERN = re.compile(r'\s*/\s*')
+PARENS_PATTERN = re.compile(r'\([^)]*\)')
+
+
+def parse_line(line):
+    """Parse one ingredient line to Spoonacular's record shape
+
+    Returns None for lines the rules can't handle, e.g. lines without a
+    leading quantity or with compound quantities ('1 cup plus 2 tbsp')."""
+
+    match = LINE_PATTERN.match(line)
+    if match is None:
+        return None
+
+    name = match.group('name')
+    if COMPOUND_PATTERN.match(name):
+        return None
+
+    try:
+        amount = _to_number(match.group('low'))
+        # ranges use the midpoint
+        if match.group('high'):
+            amount = (amount + _to_number(match.group('high')))/2
+    except (ValueError, ZeroDivisionError):
+        return None
+
+    unit = match.group('unit')
+    if unit is None:
+        unit_long = ''
+    else:
+        # 'fluid_ounce' loses its underscore when units are standardized
+        formatted = ALIASES.get(unit, ALIASES.get(unit.lower(), unit))
+        unit_long = formatted.replace('_', ' ')
+
+    return {'original': line, 'amount': amount, 'unitLong': unit_long,
+            'name': _clean_name(name)}
+
+
+def parse_lines(lines):
+    """Parse many ingredient lines, None where a line isn't handled"""
+
+    return [parse_line(line) for line in lines]
@@ -1,94 +1,205 @@
 # import en_core_web_sm
-import string, os, requests
-from model import UnitConversion, FormattedUnit
+import hashlib, os, time
+import numpy as np
+import requests
 from utilities import requestTracking as rtrack
+from utilities import httpClient, metrics, resilience
+from utilities import unitConversion as uconv
+from utilities import ingredientParser
+from utilities.responseCache import ResponseCache
+from utilities.singleFlight import SingleFlight
 
 spoonacular_key = os.environ['APIKey']
+
+# parsed records for raw ingredient lines, kept for a month
+parse_cache = ResponseCache(os.environ.get('INGREDIENT_CACHE',
+                                            'ingredient_cache.sqlite'),
+                            table='parsed_ingredients', ttl=30*24*60*60,
+                            max_entries=5000, max_disk_entries=200000)
 # nlp = en_core_web_sm.load() # loading spacy nlp model for english
 
+# concurrent identical batches share one Spoonacular call
+parse_flight = SingleFlight()
 
-def standardize_unit(original_unit):
-    """Standardize unit for comparison"""
+spoonacular = resilience.breakers['spoonacular']
 
-    # get rid of extra characters
-    translator = str.maketrans('','',string.punctuation)
-    unit = original_unit.translate(translator).strip()
+# retries of a parse that couldn't connect, each with its own reserved call
+CONNECT_RETRIES = 2
+CONNECT_BACKOFF = 0.3
 
-    # lowercase unless it is T, t, or c
-    if unit.lower != 't':
-        unit = unit.lower()
-        obj = FormattedUnit.query.filter(FormattedUnit.unit_name==unit).one()
-        unit = obj.formatted_name
 
-    return unit
+def standardize_unit(original_unit):
+    """Standardize unit for comparison"""
+
+    return uconv.get_table().standardize(original_unit)
 
 
 def convert_qty(qty, original_unit):
 
-    std_unit = standardize_unit(str(original_unit))
+    return uconv.get_table().convert(qty, original_unit)
 
-    # grab conversion object
-    conversion = UnitConversion.query.filter(UnitConversion.base_unit
-                                            ==std_unit).one()
-    std_unit = conversion.std_unit
-    std_qty = float(qty)*conversion.mult_factor
-    
-    return std_qty, std_unit
+
+INGRED_URL = "https://spoonacular-recipe-food-nutrition-v1.p.rapidapi.com/recipes/parseIngredients"
 
 
+@metrics.timed('call_ingred_api')
 def call_ingred_api(ingredients):
     """Query Spoonacular API to parse target ingredient"""
 
-    url = "https://spoonacular-recipe-food-nutrition-v1.p.rapidapi.com/recipes/parseIngredients"
     headers={"X-RapidAPI-Key": spoonacular_key, "Content-Type": "application/x-www-form-urlencoded"}
     payload={"ingredientList": ingredients,"servings": 1}
 
-    response = requests.post(url, headers=headers, params = payload)
+    response = httpClient.post(INGRED_URL, headers=headers, params = payload,
+                                timeout=resilience.call_timeout())
+    resilience.check_status('spoonacular', response)
     data = response.json()
     rtrack.update_API_calls_remaining(response.headers)
     
     return data
 
 
-def check_ingred_qty(ingred_dict, min_qty, max_qty, unit):
-    """Check whether ingredient lies within bounds"""
+@metrics.timed('parse_ingredients')
+def parse_ingredients(ingred_lines, local=True):
+    """Parse ingredient lines locally, sending only unhandled, unseen lines
+    to Spoonacular; local=False skips the local parser for lines it has
+    already failed on
+
+    Returns {original, amount, unitLong, name} records in the same order as
+    ingred_lines, with None for lines that could not be parsed."""
+
+    parsed, misses = _parse_known_lines(ingred_lines, local)
+
+    # one batched API call for all lines not parsed before, within budget
+    if misses:
+        batch = '\n'.join(misses)
+        data = parse_flight.do(batch, _call_within_budget, batch)
+        _merge_parsed_lines(parsed, misses, data)
+
+    return [parsed.get(line) for line in ingred_lines]
+
+
+def _call_within_budget(batch):
+    """Send batch to Spoonacular if it is up and a call can be reserved,
+    else None; connection failures are retried, reserving each attempt and
+    releasing the reservation of an attempt that failed"""
+
+    for attempt in range(CONNECT_RETRIES + 1):
+        if attempt:
+            time.sleep(CONNECT_BACKOFF*(2**(attempt - 1)))
+        if not spoonacular.available() or not rtrack.reserve_api_calls():
+            return None
 
-    # standardize bounds
-    min_std, unit_std = convert_qty(min_qty, unit)
-    max_std, unit_std = convert_qty(max_qty, unit)
-
-    ingred_set = set()
-    # format and standardize recipe qty
-    for ingred in ingred_dict:
-        unit = ingred['unitLong']
-        qty = ingred['amount']
-
-        # need to handle dry goods given in grams (vs. cups)
-        # need to check that units are the same
-        # temporarily avoid mass/volume conversions
         try:
-            qty_conv, unit_conv = convert_qty(qty, unit)
-        except:
-            qty_conv = -1
+            return spoonacular.call(call_ingred_api, batch)
+        except resilience.UpstreamRejected:
+            break
+        except resilience.UpstreamUnavailable as error:
+            rtrack.release_api_calls()
+            if not isinstance(error.__cause__, requests.ConnectionError):
+                break
+
+    # the lines stay unparsed and their recipes don't qualify
+    resilience.record_fallback('spoonacular_unparsed')
+
+    return None
+
+
+def _parse_known_lines(ingred_lines, local=True):
+    """Parse lines locally or from the memo store; return (parsed, misses)"""
 
-        if qty_conv >= min_std and qty_conv <= max_std and unit_std==unit_conv:
-            ingred_set.add(ingred['original'])
+    parsed = {}
+    misses = []
+    for line in ingred_lines:
+        if line in parsed or line in misses:
+            continue
+
+        # offline fast path, then previously parsed lines
+        record = ingredientParser.parse_line(line) if local else None
+        if record is None:
+            record = parse_cache.get(_memo_key(line))
+        if record is None:
+            misses.append(line)
         else:
+            parsed[line] = record
+
+    return parsed, misses
+
+
+def _memo_key(line):
+    """Memo key for the exact raw line; case matters ('1 T' vs '1 t')"""
+
+    return hashlib.sha256(line.encode('utf-8')).hexdigest()
+
+
+def _merge_parsed_lines(parsed, misses, data):
+    """Add API parse results for missed lines to parsed and the memo store"""
+
+    if not isinstance(data, list):
+        data = []
+
+    # match results by position when complete, else by original text
+    if len(data) == len(misses):
+        pairs = zip(misses, data)
+    else:
+        pairs = ((ingred.get('original'), ingred) for ingred in data)
+
+    for line, ingred in pairs:
+        if line not in misses:
             continue
+        record = {'original': line, 'amount': ingred.get('amount'),
+                    'unitLong': ingred.get('unitLong'),
+                    'name': ingred.get('name')}
+        parsed[line] = record
+        parse_cache.set(_memo_key(line), record)
 
-    return ingred_set
+
+def check_ingred_qty(ingred_dict, min_qty, max_qty, unit):
+    """Check whether ingredient lies within bounds"""
+
+    mask = check_ingred_qty_batch(ingred_dict, [(min_qty, max_qty, unit)])[0]
+
+    return {ingred['original'] for ingred, fits in zip(ingred_dict, mask)
+                                                                    if fits}
 
 
-# def process_string_spacy(string, has_range=False):
-#     """Parse string to quantities, unit, and ingredient using spaCy"""
+@metrics.timed('check_ingred_qty')
+def check_ingred_qty_batch(parsed_ingreds, constraints):
+    """Check parsed ingredients against several (min, max, unit) limits
+
+    Returns a boolean array with one row per constraint and one column per
+    parsed ingredient.  Ingredients whose amount or unit can't be converted
+    never qualify."""
+
+    table = uconv.get_table()
+
+    # standardize recipe quantities in one pass
+    amounts = np.array([_to_float(ingred.get('amount'))
+                                        for ingred in parsed_ingreds])
+    factors, codes = table.encode([str(ingred.get('unitLong'))
+                                        for ingred in parsed_ingreds])
+    std_qtys = amounts*factors
+
+    # standardize bounds
+    mins = np.empty(len(constraints))
+    maxs = np.empty(len(constraints))
+    bound_codes = np.empty(len(constraints), dtype=np.int64)
+    for idx, (min_qty, max_qty, unit) in enumerate(constraints):
+        mins[idx], unit_std = table.convert(min_qty, unit)
+        maxs[idx], unit_std = table.convert(max_qty, unit)
+        bound_codes[idx] = table.std_codes[unit_std]
 
-#     # process user input with min/max
-#     if has_range:
+    # NaN quantities compare False, so unconvertible rows drop out
+    with np.errstate(invalid='ignore'):
+        mask = ((std_qtys >= mins[:, None]) & (std_qtys <= maxs[:, None])
+                    & (codes == bound_codes[:, None]))
 
+    return mask
 
-#     # process individual ingredient from recipes
-#     else:
-#         pass
-#     pass
 
+def _to_float(amount):
+    """Convert parsed amount to float, NaN if missing or malformed"""
 
+    try:
+        return float(amount)
+    except (TypeError, ValueError):
+        return np.nan
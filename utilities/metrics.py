@@ -0,0 +1,256 @@
+"""Sampled per-stage timings, DB query counts and upstream bytes, exported
+in Prometheus text format"""
+
+import functools, os, random, threading, time
+from collections import defaultdict
+from contextlib import contextmanager
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# share of requests whose stages are timed; request counts are always kept
+SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', 1.0))
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+_local = threading.local()
+_lock = threading.Lock()
+
+
+def format_value(value):
+    """Sample value in full precision; integral values without a fraction"""
+
+    value = float(value)
+    if value.is_integer():
+        return str(int(value))
+
+    return repr(value)
+
+
+def format_labels(label, label_value):
+    """Label pairs for a sample; label may be a tuple of names, in which
+    case label_value is the matching tuple of values"""
+
+    if isinstance(label, tuple):
+        return ','.join(f'{name}="{value}"'
+                            for name, value in zip(label, label_value))
+
+    return f'{label}="{label_value}"'
+
+
+class Counter(object):
+    """Monotonic total per label value"""
+
+    def __init__(self, name, help, label):
+
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values = defaultdict(float)
+
+    def inc(self, label_value, amount=1):
+        with _lock:
+            self.values[label_value] += amount
+
+    def lines(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for label_value, value in sorted(self.values.items()):
+            labels = format_labels(self.label, label_value)
+            yield f'{self.name}{{{labels}}} {format_value(value)}'
+
+
+class Gauge(object):
+    """Current value per label value"""
+
+    def __init__(self, name, help, label):
+
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values = {}
+
+    def set(self, label_value, value):
+        with _lock:
+            self.values[label_value] = value
+
+    def lines(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        for label_value, value in sorted(self.values.items()):
+            labels = format_labels(self.label, label_value)
+            yield f'{self.name}{{{labels}}} {format_value(value)}'
+
+
+class Histogram(object):
+    """Bucketed observations per label value"""
+
+    def __init__(self, name, help, label, buckets=BUCKETS):
+
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        self.counts = defaultdict(lambda: [0] * len(self.buckets))
+        self.sums = defaultdict(float)
+        self.totals = defaultdict(int)
+
+    def observe(self, label_value, value):
+        with _lock:
+            counts = self.counts[label_value]
+            for idx, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[idx] += 1
+            self.sums[label_value] += value
+            self.totals[label_value] += 1
+
+    def lines(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for label_value in sorted(self.totals):
+            label = format_labels(self.label, label_value)
+            for bound, count in zip(self.buckets, self.counts[label_value]):
+                yield f'{self.name}_bucket{{{label},le="{bound:g}"}} {count}'
+            yield (f'{self.name}_bucket{{{label},le="+Inf"}} '
+                    f'{self.totals[label_value]}')
+            yield (f'{self.name}_sum{{{label}}} '
+                    f'{format_value(self.sums[label_value])}')
+            yield f'{self.name}_count{{{label}}} {self.totals[label_value]}'
+
+
+requests_total = Counter('recipe_app_requests_total',
+                            'Requests handled, sampled or not', 'route')
+request_seconds = Histogram('recipe_app_request_seconds',
+                            'Duration of sampled requests', 'route')
+stage_seconds = Histogram('recipe_app_stage_seconds',
+                            'Duration of pipeline stages in sampled requests',
+                            'stage')
+db_queries = Histogram('recipe_app_db_queries_per_request',
+                        'Database queries issued by sampled requests',
+                        'route', QUERY_BUCKETS)
+upstream_bytes = Counter('recipe_app_upstream_bytes_total',
+                            'Response bytes received from upstream APIs',
+                            'host')
+circuit_state = Gauge('recipe_app_circuit_state',
+                        'Upstream circuit breaker state '
+                        '(0 closed, 1 half-open, 2 open)', 'upstream')
+circuit_opens = Counter('recipe_app_circuit_opens_total',
+                        'Times an upstream circuit breaker opened', 
+                        'upstream')
+fallbacks = Counter('recipe_app_fallbacks_total',
+                    'Upstream calls answered by a fallback', 'fallback')
+upstream_seconds = Histogram('recipe_app_upstream_seconds',
+                                'Latency of upstream API calls', 'host')
+password_hash_seconds = Histogram('recipe_app_password_hash_seconds',
+                                    'Duration of bcrypt hashes and checks, '
+                                    'and their wait for a worker',
+                                    'operation')
+cache_lookups = Counter('recipe_app_cache_lookups_total',
+                        'Response cache lookups by result',
+                        ('cache', 'result'))
+
+METRICS = [requests_total, request_seconds, stage_seconds, db_queries,
+            upstream_bytes, circuit_state, circuit_opens, fallbacks,
+            upstream_seconds, password_hash_seconds, cache_lookups]
+
+
+def is_sampled():
+    """Whether the current request's stages are being timed"""
+
+    return getattr(_local, 'sampled', False)
+
+
+def start_request():
+    """Decide whether to sample the request starting on this thread"""
+
+    _local.sampled = random.random() < SAMPLE_RATE
+    _local.queries = 0
+    _local.start = time.perf_counter()
+
+
+def end_request(route):
+    """Record the request that started on this thread"""
+
+    requests_total.inc(route)
+    if is_sampled():
+        request_seconds.observe(route, time.perf_counter() - _local.start)
+        db_queries.observe(route, _local.queries)
+    _local.sampled = False
+
+
+def bind(function):
+    """Carry this thread's sampling decision into a worker thread"""
+
+    sampled = is_sampled()
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        previous = is_sampled()
+        _local.sampled = sampled
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _local.sampled = previous
+
+    return wrapper
+
+
+@contextmanager
+def span(stage):
+    """Time the enclosed block as stage when the request is sampled"""
+
+    if not is_sampled():
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.observe(stage, time.perf_counter() - start)
+
+
+def observe_stage(stage, seconds):
+    """Record a stage timed outside span(), if the request is sampled"""
+
+    if is_sampled():
+        stage_seconds.observe(stage, seconds)
+
+
+def timed(stage):
+    """Decorator timing each call of a function as stage"""
+
+    def decorator(function):
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return function(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def record_upstream_bytes(host, size):
+    """Count bytes received from an upstream API"""
+
+    upstream_bytes.inc(host, size)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    """Count queries issued by sampled requests"""
+
+    if is_sampled():
+        _local.queries = getattr(_local, 'queries', 0) + 1
+
+
+def render():
+    """All metrics in Prometheus text exposition format"""
+
+    lines = []
+    with _lock:
+        for metric in METRICS:
+            lines.extend(metric.lines())
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,103 @@
+"""Password hashing on a bounded process pool, off the request threads"""
+
+import os, threading, time
+from concurrent.futures import ProcessPoolExecutor
+import bcrypt
+from utilities import metrics
+
+# bcrypt cost factor for new hashes; stored hashes with another cost are
+# rehashed on the next successful login
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+
+HASH_WORKERS = int(os.environ.get('HASH_WORKERS', 
+                                    max(1, (os.cpu_count() or 2) // 2)))
+
+# hashes queued or running before new requests are turned away
+MAX_QUEUE_DEPTH = int(os.environ.get('HASH_QUEUE_DEPTH', 32))
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(MAX_QUEUE_DEPTH)
+
+
+class HashQueueFull(Exception):
+    """Raised when too many hashes are already waiting"""
+
+
+def _get_pool():
+    """Process pool, started on first use"""
+
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=HASH_WORKERS)
+
+        return _pool
+
+
+def _hash(password, rounds):
+    """Hash password in a worker; return (hash, start time, duration)"""
+
+    start = time.time()
+    hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds))
+
+    return hashed.decode('utf-8'), start, time.time() - start
+
+
+def _check(password, hashed):
+    """Check password in a worker; return (match, start time, duration)"""
+
+    start = time.time()
+    try:
+        match = bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+    except ValueError:
+        # not a bcrypt hash
+        match = False
+
+    return match, start, time.time() - start
+
+
+def _run(task, *args):
+    """Run task on the pool, refusing work beyond MAX_QUEUE_DEPTH"""
+
+    if not _slots.acquire(blocking=False):
+        raise HashQueueFull()
+
+    submitted = time.time()
+    try:
+        result, start, duration = _get_pool().submit(task, *args).result()
+    finally:
+        _slots.release()
+
+    record_timing('queue_wait', max(0, start - submitted))
+    record_timing(task.__name__.strip('_'), duration)
+
+    return result
+
+
+def hash_password(password):
+    """bcrypt hash of password at the configured cost"""
+
+    return _run(_hash, password, BCRYPT_ROUNDS)
+
+
+def check_password(password, hashed):
+    """Whether password matches the stored hash"""
+
+    return _run(_check, password, hashed)
+
+
+def needs_rehash(hashed):
+    """Whether hashed was made with a different cost than BCRYPT_ROUNDS"""
+
+    try:
+        return int(hashed.split('$')[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+
+def record_timing(name, seconds):
+    """Export a hash latency or queue wait on /metrics"""
+
+    metrics.password_hash_seconds.observe(name, seconds)
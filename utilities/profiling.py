@@ -0,0 +1,195 @@
+"""Opt-in sampling profiler for production requests
+
+Profiles 1 in PROFILE_SAMPLE_EVERY requests, plus any request carrying a
+valid X-Profile-Token header signed with PROFILE_SECRET. A profiled
+request's thread is sampled with sys._current_frames() every
+PROFILE_INTERVAL seconds. The stacks are written in collapsed
+('folded') format, one file per request, under PROFILE_DIR/<route>/. Only
+the newest PROFILE_MAX_FILES files are kept. The folded files can be fed
+straight to flamegraph.pl or speedscope."""
+
+import hashlib, hmac, itertools, os, re, sys, threading, time
+from collections import Counter
+from werkzeug.wsgi import ClosingIterator
+
+SAMPLE_EVERY = int(os.environ.get('PROFILE_SAMPLE_EVERY', 0))
+SECRET = os.environ.get('PROFILE_SECRET', '')
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.005))
+MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 500))
+
+TOKEN_HEADER = 'HTTP_X_PROFILE_TOKEN'
+
+_slug_pattern = re.compile(r'[^A-Za-z0-9]+')
+
+
+def enabled():
+    """Whether sampling or signed-header profiling is configured"""
+
+    return SAMPLE_EVERY > 0 or bool(SECRET)
+
+
+def make_token(secret, ttl=300):
+    """Header value that turns on profiling for the next ttl seconds"""
+
+    expires = str(int(time.time() + ttl))
+
+    return expires + '.' + _sign(secret, expires)
+
+
+def check_token(secret, token):
+    """Whether token was made with secret and hasn't expired"""
+
+    if not secret or not token or '.' not in token:
+        return False
+
+    expires, signature = token.split('.', 1)
+    if not hmac.compare_digest(_sign(secret, expires), signature):
+        return False
+
+    try:
+        return int(expires) >= time.time()
+    except ValueError:
+        return False
+
+
+def _sign(secret, message):
+    return hmac.new(secret.encode('utf-8'), message.encode('utf-8'),
+                    hashlib.sha256).hexdigest()
+
+
+class StackSampler(object):
+    """Samples one thread's stack from a background thread"""
+
+    def __init__(self, thread_id, interval=INTERVAL):
+
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            self.stacks[_collapse(frame)] += 1
+            if self._stop.wait(self.interval):
+                break
+
+
+def _collapse(frame):
+    """Frame and its callers as 'outer;...;inner' of file:function"""
+
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+
+    return ';'.join(reversed(names))
+
+
+class SamplingProfiler(object):
+    """WSGI middleware writing collapsed stacks for sampled requests"""
+
+    def __init__(self, app, url_map, sample_every=SAMPLE_EVERY,
+                    secret=SECRET, output_dir=PROFILE_DIR, interval=INTERVAL,
+                    max_files=MAX_FILES):
+
+        self.app = app
+        self.url_map = url_map
+        self.sample_every = sample_every
+        self.secret = secret
+        self.output_dir = output_dir
+        self.interval = interval
+        self.max_files = max_files
+        self._requests = itertools.count(1)
+        self._files_lock = threading.Lock()
+
+    def should_profile(self, environ):
+        """Every sample_every-th request, or one with a valid token"""
+
+        if self.sample_every and next(self._requests) % self.sample_every == 0:
+            return True
+
+        return check_token(self.secret, environ.get(TOKEN_HEADER))
+
+    def __call__(self, environ, start_response):
+
+        if not self.should_profile(environ):
+            return self.app(environ, start_response)
+
+        sampler = StackSampler(threading.get_ident(), self.interval)
+        route = self.route_name(environ)
+        started = time.time()
+        sampler.start()
+
+        def finish():
+            sampler.stop()
+            self.write_profile(route, started, sampler.stacks)
+
+        try:
+            app_iter = self.app(environ, start_response)
+        except BaseException:
+            finish()
+            raise
+
+        # streamed bodies are rendered while the server iterates them
+        return ClosingIterator(app_iter, [finish])
+
+    def route_name(self, environ):
+        """URL rule the request matches, for grouping profiles"""
+
+        try:
+            rule, args = self.url_map.bind_to_environ(environ).match(
+                                                            return_rule=True)
+            return rule.rule
+        except Exception:
+            return 'unmatched'
+
+    def write_profile(self, route, started, stacks):
+        """Write stacks for one request and drop the oldest profiles"""
+
+        if not stacks:
+            return
+
+        directory = os.path.join(self.output_dir,
+                                    _slug_pattern.sub('_', route).strip('_')
+                                                                or 'root')
+        os.makedirs(directory, exist_ok=True)
+        filename = os.path.join(directory, f'{int(started * 1000)}-'
+                                            f'{os.getpid()}-'
+                                            f'{threading.get_ident()}.folded')
+        with open(filename, 'w') as file:
+            for stack, count in stacks.most_common():
+                file.write(f"{stack} {count}\n")
+
+        self.rotate()
+
+    def rotate(self):
+        """Keep only the newest max_files profiles"""
+
+        with self._files_lock:
+            profiles = []
+            for directory, _, files in os.walk(self.output_dir):
+                profiles.extend(os.path.join(directory, name)
+                                    for name in files
+                                    if name.endswith('.folded'))
+            if len(profiles) <= self.max_files:
+                return
+
+            profiles.sort(key=os.path.getmtime)
+            for path in profiles[:len(profiles) - self.max_files]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
@@ -0,0 +1,134 @@
+"""Log of recent recipe searches, for finding the popular ones to warm"""
+
+import atexit, os, queue, sqlite3, threading, time
+from collections import namedtuple
+from utilities import recipeTools
+
+# a search as the routes make it; num_recipes and excluded are part of the
+# recipe cache key, and ingredient searches also parse ingredient lines
+LoggedSearch = namedtuple('LoggedSearch', ['query', 'diet', 'health',
+                                            'excluded', 'num_recipes',
+                                            'ingredient', 'count'])
+
+
+# seconds between batched writes of queued searches
+FLUSH_INTERVAL = 2.0
+
+
+class QueryLog(object):
+    """Searches in a SQLite table, one row per search made
+
+    record() only queues the row; a background thread writes the queue in
+    one transaction every flush_interval seconds."""
+
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL):
+
+        self.path = path
+        self.flush_interval = flush_interval
+        self._conn = None
+        self._lock = threading.Lock()
+        self._pending = queue.Queue()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+
+    def _connection(self):
+        """Connection shared under self._lock, creating the table"""
+
+        conn = self._conn
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, 
+                                    check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS searches '
+                            '(query TEXT NOT NULL, diet TEXT, health TEXT, '
+                            'excluded TEXT, num_recipes INTEGER NOT NULL, '
+                            'ingredient INTEGER NOT NULL, '
+                            'logged REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_searches_logged '
+                            'ON searches (logged)')
+            self._conn = conn
+
+        return conn
+
+    def record(self, query, diet, health, excluded, num_recipes,
+                ingredient=False):
+        """Queue one search for logging; query is a keyword string or
+        ingredient list"""
+
+        # the same terms recipeTools keys the recipe cache on
+        query = recipeTools.join_query(query).lower()
+        if not query:
+            return
+
+        self._pending.put((query, diet, health,
+                            ','.join(excluded) if excluded else None,
+                            num_recipes, int(ingredient), time.time()))
+        if self._writer is None:
+            self._start_writer()
+
+    def _start_writer(self):
+        """Start the thread writing queued searches"""
+
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_forever, 
+                                                daemon=True)
+                self._writer.start()
+                # write what is still queued when the worker exits
+                atexit.register(self.flush)
+
+    def _write_forever(self):
+
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Write every queued search in one transaction"""
+
+        rows = []
+        while True:
+            try:
+                rows.append(self._pending.get_nowait())
+            except queue.Empty:
+                break
+        if not rows:
+            return
+
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany('INSERT INTO searches VALUES '
+                                    '(?,?,?,?,?,?,?)', rows)
+
+    def top(self, limit, since):
+        """The limit most frequent searches logged since the given time"""
+
+        self.flush()
+        with self._lock:
+            rows = self._connection().execute(
+                        'SELECT query, diet, health, excluded, num_recipes, '
+                        'ingredient, count(*) AS n FROM searches '
+                        'WHERE logged >= ? GROUP BY query, diet, health, '
+                        'excluded, num_recipes, ingredient '
+                        'ORDER BY n DESC, max(logged) DESC LIMIT ?',
+                        (since, limit)).fetchall()
+
+        return [LoggedSearch(query, diet, health,
+                                excluded.split(',') if excluded else None,
+                                num_recipes, bool(ingredient), count)
+                    for query, diet, health, excluded, num_recipes,
+                        ingredient, count in rows]
+
+    def prune(self, before):
+        """Drop searches logged before the given time"""
+
+        self.flush()
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute('DELETE FROM searches WHERE logged < ?', 
+                                (before,))
+
+
+query_log = QueryLog(os.environ.get('QUERY_LOG', 'query_log.sqlite'))
@@ -0,0 +1,176 @@
+"""Local full-text index of every recipe seen from the recipe API"""
+
+import json, sqlite3, threading, time
+from utilities.ingredientIndex import RecipeList
+from utilities.recipeTypes import Recipe
+
+
+def normalize_label(label):
+    """Diet/health label as stored in the diets table, e.g. 'low-carb'"""
+
+    return label.strip().lower().replace(' ', '-')
+
+
+def match_query(query, excluded=None):
+    """FTS5 query requiring every search term and no excluded ingredient"""
+
+    if isinstance(query, str):
+        query = query.split(',')
+
+    terms = [_phrase(term) for term in query if term.strip()]
+    if not terms:
+        return None
+
+    match = ' AND '.join(terms)
+    for exclusion in excluded or ():
+        if exclusion.strip():
+            match = f'({match}) NOT ingredients : {_phrase(exclusion)}'
+
+    return match
+
+
+def _phrase(term):
+    """Quote term as an FTS5 phrase"""
+
+    return '"' + term.strip().replace('"', '""') + '"'
+
+
+class RecipeCorpus(object):
+    """Recipes in a SQLite table with an FTS5 index over title and
+    ingredient lines, ranked with BM25
+
+    Recipes not seen for max_age seconds, and the least recently seen
+    beyond max_recipes, are pruned every PRUNE_EVERY ingests."""
+
+    PRUNE_EVERY = 50
+
+    def __init__(self, path, max_recipes=50000, max_age=90*24*60*60):
+
+        self.path = path
+        self.max_recipes = max_recipes
+        self.max_age = max_age
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._ingests = 0
+
+    def _connection(self):
+        """SQLite connection for the current thread, creating the tables"""
+
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS recipes '
+                            '(id INTEGER PRIMARY KEY, '
+                            'url TEXT UNIQUE NOT NULL, title TEXT, '
+                            'image TEXT, ingredients TEXT, '
+                            'diet_labels TEXT, health_labels TEXT, '
+                            'updated REAL NOT NULL)')
+            conn.execute('CREATE VIRTUAL TABLE IF NOT EXISTS recipe_fts USING '
+                            "fts5(title, ingredients, tokenize='porter')")
+            self._local.conn = conn
+
+        return conn
+
+    def ingest(self, recipes):
+        """Add or refresh recipes, keyed by url, in one transaction"""
+
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            for recipe in recipes:
+                conn.execute('INSERT INTO recipes (url, title, image, '
+                                'ingredients, diet_labels, health_labels, '
+                                'updated) VALUES (?,?,?,?,?,?,?) '
+                                'ON CONFLICT(url) DO UPDATE SET '
+                                'title=excluded.title, image=excluded.image, '
+                                'ingredients=excluded.ingredients, '
+                                'diet_labels=excluded.diet_labels, '
+                                'health_labels=excluded.health_labels, '
+                                'updated=excluded.updated',
+                                (recipe.url, recipe.title, recipe.image,
+                                json.dumps(recipe.ingredients),
+                                _label_field(recipe.diet_labels),
+                                _label_field(recipe.health_labels), now))
+                rowid = conn.execute('SELECT id FROM recipes WHERE url=?',
+                                        (recipe.url,)).fetchone()[0]
+                conn.execute('DELETE FROM recipe_fts WHERE rowid=?', (rowid,))
+                conn.execute('INSERT INTO recipe_fts (rowid, title, '
+                                'ingredients) VALUES (?,?,?)',
+                                (rowid, recipe.title,
+                                '\n'.join(recipe.ingredients)))
+
+        with self._lock:
+            self._ingests += 1
+            prune = self._ingests % self.PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+
+    def prune(self, now=None):
+        """Drop recipes older than max_age and beyond max_recipes"""
+
+        now = time.time() if now is None else now
+        stale = ('SELECT id FROM recipes WHERE updated < ? OR id NOT IN '
+                    '(SELECT id FROM recipes ORDER BY updated DESC LIMIT ?)')
+        params = (now - self.max_age, self.max_recipes)
+
+        conn = self._connection()
+        with conn:
+            conn.execute(f'DELETE FROM recipe_fts WHERE rowid IN ({stale})',
+                            params)
+            conn.execute(f'DELETE FROM recipes WHERE id IN ({stale})', params)
+
+    def search(self, query, diet=None, health=None, excluded=None, limit=20):
+        """Best matching recipes for query, honouring diet/health labels and
+        excluded ingredients"""
+
+        match = match_query(query, excluded)
+        if match is None:
+            return RecipeList()
+
+        sql = ('SELECT r.title, r.image, r.url, r.ingredients, r.diet_labels, '
+                'r.health_labels FROM recipe_fts JOIN recipes r '
+                'ON r.id = recipe_fts.rowid WHERE recipe_fts MATCH ?')
+        params = [match]
+        if diet:
+            sql += " AND instr(replace(lower(r.diet_labels), ' ', '-'), ?)"
+            params.append('|' + normalize_label(diet) + '|')
+        if health:
+            sql += " AND instr(replace(lower(r.health_labels), ' ', '-'), ?)"
+            params.append('|' + normalize_label(health) + '|')
+
+        # title matches count for more than ingredient line matches
+        sql += ' ORDER BY bm25(recipe_fts, 10.0, 1.0) LIMIT ?'
+        params.append(limit)
+
+        try:
+            rows = self._connection().execute(sql, params).fetchall()
+        except sqlite3.OperationalError:
+            # query the FTS syntax can't express
+            return RecipeList()
+
+        return RecipeList(Recipe(title, image, url, json.loads(ingredients),
+                                    _split_labels(diet_labels),
+                                    _split_labels(health_labels))
+                            for title, image, url, ingredients, diet_labels,
+                                health_labels in rows)
+
+    def count(self):
+        """Number of recipes stored"""
+
+        row = self._connection().execute(
+                                    'SELECT count(*) FROM recipes').fetchone()
+
+        return row[0]
+
+
+def _label_field(labels):
+    """Labels stored as '|Low-Carb|Peanut-Free|' for substring filtering"""
+
+    return '|' + '|'.join(label.strip() for label in labels) + '|'
+
+
+def _split_labels(field):
+    """Labels back from their stored form"""
+
+    return [label for label in field.split('|') if label]
@@ -1,59 +1,267 @@
-import requests, os
+import base64, binascii, json, os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from utilities import ingredientTools as itools
-from flask import flash
+from utilities import httpClient, metrics, resilience
+from utilities.responseCache import ResponseCache
+from utilities.ingredientIndex import IngredientIndex, RecipeList
+from utilities.recipeTypes import IngredientLine, Recipe
+from utilities.recipeCorpus import RecipeCorpus
+from utilities.singleFlight import SingleFlight
+from flask import flash, has_request_context
 
 edamam_id = os.environ['search_id']
 edamam_key = os.environ['search_key']
 
+RECIPE_URL = 'https://api.edamam.com/search'
 
-def get_recipes(query, diet, health, num_recipes, excluded):
-    """High level function to get recipes and return digested recipe info"""
+# expired searches are served for another day while they are refreshed
+recipe_cache = ResponseCache(os.environ.get('RECIPE_CACHE', 
+                                            'recipe_cache.sqlite'),
+                                table='edamam_searches', stale_ttl=24*60*60)
+
+edamam = resilience.breakers['edamam']
+
+# every recipe seen, searchable offline
+recipe_corpus = RecipeCorpus(os.environ.get('RECIPE_CORPUS', 
+                                            'recipe_corpus.sqlite'))
+
+# answer searches from the local corpus before calling the API
+LOCAL_FIRST = os.environ.get('LOCAL_FIRST', '') == '1'
+
+# local results needed before the API is skipped
+LOCAL_MIN_RESULTS = 10
+
+# concurrent identical searches share one API call and extraction
+recipe_flight = SingleFlight()
+
+# shared, bounded pool for parsing each constraint's ingredient lines
+parse_pool = ThreadPoolExecutor(max_workers=8)
+
+# recipes a constraint must leave for a best-match search to apply it
+BEST_MATCH_MIN = 6
+
+# Edamam serves at most this many results for one search
+MAX_RESULTS = 100
+
+# results fetched per page by the deep search
+PAGE_SIZE = 20
+
+
+def get_recipes(query, diet, health, num_recipes, excluded, 
+                local_first=None, warn=flash):
+    """High level function to get recipes and return digested recipe info;
+    warn is given any notice for the user from the caller that runs the
+    search"""
+
+    if local_first or (local_first is None and LOCAL_FIRST):
+        recipes = search_local_recipes(query, diet, health, num_recipes, 
+                                        excluded)
+        if recipes is not None:
+            return recipes
+
+    cache_key = recipe_search_payload(query, diet, health, num_recipes, 
+                                        excluded)[0]
+
+    return recipe_flight.do(cache_key, fetch_recipes, query, diet, health, 
+                            num_recipes, excluded, warn)
+
+
+def fetch_recipes(query, diet, health, num_recipes, excluded, warn=flash):
+    """Call the recipe API and extract recipes from its response"""
+
+    data = call_recipe_api(query, diet, health, num_recipes, excluded, 
+                            warn=warn)
+
+    return extract_recipes(data)
+
+
+@metrics.timed('search_local_recipes')
+def search_local_recipes(query, diet, health, num_recipes, excluded):
+    """Recipes from the local corpus, or None if too few match to skip the
+    API"""
+
+    recipes = recipe_corpus.search(query, diet, health, excluded, 
+                                    num_recipes)
+    if len(recipes) < min(num_recipes, LOCAL_MIN_RESULTS):
+        return None
 
-    data = call_recipe_api(query, diet, health, num_recipes, excluded)
-    recipes = extract_recipes(data)
-    
     return recipes
 
 
-def call_recipe_api(query, diet, health, num_recipes = 5, excluded = None):
-    """ Query Recipe API for search terms """
+@metrics.timed('call_recipe_api')
+def call_recipe_api(query, diet, health, num_recipes = 5, excluded = None,
+                    start = 0, warn=flash):
+    """ Query Recipe API for search terms; warn is given a notice for the
+    user when the search fails """
 
-    if isinstance(query, list):
-        query = ','.join(query)
+    # identical searches are answered from the cache
+    cache_key, payload = recipe_search_payload(query, diet, health, 
+                                                num_recipes, excluded, start)
+    data, fresh = recipe_cache.lookup(cache_key)
+    if data is not None:
+        if not fresh:
+            refresh_stale_search(cache_key, payload)
+        return data
+
+    try:
+        data = edamam.call(request_recipe_search, payload)
+    except resilience.UpstreamUnavailable:
+        resilience.record_fallback('edamam_empty')
+        return empty_search(unavailable=True)
+    except resilience.UpstreamUnauthorized:
+        # our keys were refused; not the user's fault, nor cacheable
+        resilience.record_fallback('edamam_unauthorized')
+        notify(warn, "Recipe search is unavailable right now. Please try "
+                        "again later.")
+        return empty_search(unavailable=True)
+    except resilience.UpstreamRejected:
+        # the search itself is bad; retrying or caching it won't help
+        resilience.record_fallback('edamam_rejected')
+        notify(warn, "The recipe search couldn't be run; check the search "
+                        "terms and try again.")
+        return empty_search()
+
+    return cache_recipe_data(cache_key, data)
+
+
+def notify(warn, message):
+    """Pass message to warn, unless warn is flash outside a request"""
+
+    if warn is not flash or has_request_context():
+        warn(message)
 
-    payload = {'app_id':edamam_id, 'app_key':edamam_key, 'q':query, 
-                'from':0, 'to':num_recipes, 'diet':diet, 'health':health,
-                'excluded':excluded}    
-    url = 'https://api.edamam.com/search'
-    
-    response = requests.get(url, params=payload)
-    data = response.json()
+
+def request_recipe_search(payload):
+    """GET one search from Edamam within the request's time budget, raising
+    UpstreamRejected for client errors and UpstreamUnavailable for other
+    error responses"""
+
+    response = httpClient.get(RECIPE_URL, params=payload, 
+                                timeout=resilience.call_timeout())
+    resilience.check_status('edamam', response)
+
+    return check_recipe_data(response.json())
+
+
+def check_recipe_data(data):
+    """Return data if it is a search result, else raise UpstreamUnavailable"""
+
+    if not isinstance(data, dict) or 'hits' not in data:
+        message = data.get('message') if isinstance(data, dict) else data
+        raise resilience.UpstreamUnavailable(f"edamam error: {message}")
 
     return data
 
 
-def extract_recipes(data):
-    """Extract recipes from API response of nested dictionaries"""
+def refresh_stale_search(cache_key, payload):
+    """Serve the expired copy of a search while re-fetching it off the
+    request path"""
+
+    resilience.record_fallback('edamam_stale')
+    if edamam.available():
+        resilience.refresh_in_background(cache_key, refresh_search, 
+                                            cache_key, payload)
 
-    recipes = []
+
+def refresh_search(cache_key, payload):
+    """Re-fetch a search and cache the result"""
+
+    data = edamam.call(request_recipe_search, payload)
+
+    return cache_recipe_data(cache_key, data)
+
+
+def empty_search(unavailable=False):
+    """Search result with no recipes, used when Edamam fails; unavailable
+    marks a failure worth retrying"""
+
+    data = {'hits': [], 'more': False, 'count': 0}
+    if unavailable:
+        data['unavailable'] = True
+
+    return data
+
+
+def recipe_search_payload(query, diet, health, num_recipes, excluded, 
+                            start=0):
+    """Return (cache key, request params) for a recipe search, asking for
+    results from position start up to num_recipes"""
+
+    search = {'q':join_query(query), 'from':start, 'to':num_recipes, 
+                'diet':diet, 'health':health, 'excluded':excluded}
+    payload = dict(search, app_id=edamam_id, app_key=edamam_key)
+
+    return recipe_cache.make_key(search), payload
+
+
+def join_query(query):
+    """Search terms as one comma separated string, e.g. 'chicken,rice' for
+    'chicken, rice' or ['chicken', ' rice']"""
+
+    if isinstance(query, str):
+        query = query.split(',')
+
+    return ','.join(term.strip() for term in query if term.strip())
+
+
+def cache_recipe_data(cache_key, data):
+    """Cache successful searches, trimmed to the fields we use"""
+
+    if 'hits' in data:
+        data = slim_recipe_data(data)
+        recipe_cache.set(cache_key, data)
+        index_search(cache_key, data)
+
+    return data
+
+
+def index_search(cache_key, data):
+    """Add a newly fetched search to the local corpus off the request path"""
+
+    resilience.refresh_in_background(('corpus', cache_key), 
+                                        recipe_corpus.ingest, 
+                                        list(iter_recipes(data)))
+
+
+def slim_recipe_data(data):
+    """Drop nutrient details etc. that extract_recipes doesn't read"""
+
+    hits = []
     for hit in data['hits']:
         recipe = hit['recipe']
-        parsed_recipe = {}
-        ingredients = []
+        hits.append({'recipe': {
+                        'label': recipe['label'],
+                        'image': recipe['image'],
+                        'url': recipe['url'],
+                        'dietLabels': recipe.get('dietLabels', []),
+                        'healthLabels': recipe.get('healthLabels', []),
+                        'ingredients': [{'text': ingredient['text']} 
+                                    for ingredient in recipe['ingredients']]}})
 
-        # add relevant info to new_entry
-        parsed_recipe['title'] = recipe['label']
-        parsed_recipe['image'] = recipe['image']
-        parsed_recipe['url'] = recipe['url']
+    return {'q': data.get('q'), 'from': data.get('from'), 
+            'to': data.get('to'), 'more': data.get('more'), 
+            'count': data.get('count'), 'hits': hits}
 
-        # extract text from each ingredient and add to new_entry
-        for ingredient in recipe['ingredients']:
-            ingredients.append(ingredient['text'])        
-        parsed_recipe['ingredients'] = ingredients
 
-        recipes.append(parsed_recipe)
+@metrics.timed('extract_recipes')
+def extract_recipes(data):
+    """Extract recipes from API response of nested dictionaries"""
 
-    return recipes
+    # index ingredient lines once for every constraint lookup
+    return RecipeList(iter_recipes(data))
+
+
+def iter_recipes(data):
+    """Yield digested recipes one at a time from API response"""
+
+    for hit in data['hits']:
+        recipe = hit['recipe']
+
+        yield Recipe(recipe['label'], recipe['image'], recipe['url'],
+                        [ingredient['text'] 
+                                    for ingredient in recipe['ingredients']],
+                        recipe.get('dietLabels', ()),
+                        recipe.get('healthLabels', ()))
 
 
 def get_qualifying_recipes(recipes, query, mins, maxs, unit):
@@ -62,51 +270,275 @@ def get_qualifying_recipes(recipes, query, mins, maxs, unit):
     if '' in query:
         query.remove('')
 
-    for idx in range(len(query)):
-        ingred = query[idx]
-        remaining_recipes = []
-        
-        rel_recipes, ingred_list = get_relevant_recipes_and_ingred(ingred, 
-                                                                    recipes)
+    checked = dict(check_constraints(recipes, query, mins, maxs, unit, 
+                                        BEST_MATCH_MIN))
 
-        parsed_ingred_dict = itools.call_ingred_api('\n'.join(ingred_list))
+    return narrow_recipes(recipes, [checked.get(idx) 
+                                        for idx in range(len(query))])
 
-        # create set of ingredients within min/max
-        qualifying_ingred_set = itools.check_ingred_qty(parsed_ingred_dict, 
-                                                        mins[idx], maxs[idx],
-                                                        unit[idx])
 
-        # include recipes with ingredients in qualifying set
-        for idx, ingredient in enumerate(ingred_list):
-            if ingredient in qualifying_ingred_set:
-                remaining_recipes.append(rel_recipes[idx])
+def stream_qualifying_recipes(query, diet, health, num_recipes, excluded, 
+                                mins, maxs, unit, on_fetched=None):
+    """Search with ingredient limits, yielding progress as it happens
+
+    Yields ('stage', message) as each step finishes, then ('recipe', recipe)
+    for every qualifying recipe. on_fetched, if given, is called with the
+    recipes found before they are checked."""
+
+    if '' in query:
+        query.remove('')
+
+    # headers are already sent, so notices go in the stream, not flash()
+    notices = []
+    recipes = get_recipes(query, diet, health, num_recipes, excluded, 
+                            warn=notices.append)
+    if on_fetched is not None:
+        on_fetched(recipes)
+    for notice in notices:
+        yield 'stage', notice
+    yield 'stage', f"Found {len(recipes)} recipes"
+
+    checked = {}
+    for idx, recipe_ids in check_constraints(recipes, query, mins, maxs, 
+                                                unit, BEST_MATCH_MIN):
+        checked[idx] = recipe_ids
+        yield 'stage', f"Checked {query[idx]} quantities"
+
+    notices = []
+    qualifying = narrow_recipes(recipes, [checked.get(idx) 
+                                            for idx in range(len(query))],
+                                warn=notices.append)
+    for notice in notices:
+        yield 'stage', notice
+
+    for recipe in qualifying:
+        yield 'recipe', recipe
+
+
+def check_constraints(recipes, query, mins, maxs, unit, needed, 
+                        selective_first=False):
+    """Yield (constraint index, ids of recipes within its limits) as each
+    constraint is checked, parsing only lines that can change the result
+
+    The first constraint, or the one matching the fewest recipes if
+    selective_first, is parsed on its own. If it leaves needed recipes,
+    the rest are parsed concurrently for those recipes only, up to the
+    first that matches fewer than needed of them. Constraints not yielded
+    couldn't have left needed recipes."""
+
+    if not query:
+        return
+    if not isinstance(recipes, RecipeList):
+        recipes = RecipeList(recipes)
+    index = recipes.ingredient_index
+
+    def relevant_count(ingred, within=None):
+        matches = index.lookup(ingred)
+        if within is None:
+            return len(matches)
+        return sum(1 for recipe_idx in matches 
+                                    if id(recipes[recipe_idx]) in within)
+
+    def qualifying(idx, relevant):
+        return qualifying_recipe_ids([relevant], [mins[idx]], [maxs[idx]], 
+                                        [unit[idx]])[0]
+
+    order = list(range(len(query)))
+    if selective_first:
+        order.sort(key=lambda idx: relevant_count(query[idx]))
+
+    first = order[0]
+    if relevant_count(query[first]) < needed:
+        return
+    candidates = qualifying(first, parse_relevant_ingred(query[first], 
+                                                            recipes))
+    yield first, candidates
+    if len(candidates) < needed:
+        return
+
+    rest = []
+    for idx in order[1:]:
+        if relevant_count(query[idx], candidates) < needed:
+            break
+        rest.append(idx)
+
+    parse = resilience.bind(metrics.bind(parse_relevant_ingred))
+    futures = {parse_pool.submit(parse, query[idx], recipes, candidates): idx
+                                                            for idx in rest}
+    for future in as_completed(futures):
+        idx = futures[future]
+        yield idx, qualifying(idx, future.result())
+
+
+@metrics.timed('narrow_recipes')
+def narrow_recipes(recipes, qualifying_ids, warn=flash):
+    """Keep recipes within each constraint's limits, in constraint order;
+    qualifying_ids holds None for constraints that weren't checked"""
+
+    # narrow constraint by constraint, stopping when too few remain
+    for recipe_ids in qualifying_ids:
+        remaining_recipes = [recipe for recipe in recipes 
+                                        if id(recipe) in (recipe_ids or ())]
     
-        if len(remaining_recipes)>5:
+        if len(remaining_recipes) >= BEST_MATCH_MIN:
             recipes = remaining_recipes
         else:
-            flash("Couldn't find recipes fitting all constraints \
+            warn("Couldn't find recipes fitting all constraints \
                     but here is our best match!")
             break
 
     return recipes
 
 
-def get_relevant_recipes_and_ingred(query, recipes):
-    """Extract list of strings with ingredient with limits"""
+def qualifying_recipe_ids(relevant, mins, maxs, unit):
+    """Ids of recipes with a relevant line inside each constraint's limits"""
 
-    relevant_recipes = []
-    target_ingreds = []
-    for recipe in recipes:
-        if query not in ','.join(recipe['ingredients']).lower():
-            continue
-    
-        # extract ingredients that match query
-        target_ingred = ''
-        for ingredient in recipe['ingredients']:
-            if query.lower() in ingredient.lower():
-                target_ingred = ingredient
-        relevant_recipes.append(recipe)
-        target_ingreds.append(target_ingred) # will only take last match from a recipe
+    qualifying_ids = []
+    for idx, (rel_recipes, ingred_lists, parsed_ingred_dict) in \
+                                                        enumerate(relevant):
+        qualifying_ingred_set = itools.check_ingred_qty(parsed_ingred_dict, 
+                                                        mins[idx], maxs[idx],
+                                                        unit[idx])
+        qualifying_ids.append({id(recipe) 
+                            for recipe, ingred_list in zip(rel_recipes, 
+                                                            ingred_lists)
+                            if not qualifying_ingred_set.isdisjoint(
+                                                                ingred_list)})
+
+    return qualifying_ids
+
+
+def find_qualifying_page(query, diet, health, excluded, mins, maxs, unit,
+                            want=20, cursor=None, page_size=PAGE_SIZE, 
+                            max_pages=5):
+    """Fetch result pages lazily until want recipes meet every constraint
+
+    Returns (qualifying recipes, cursor to resume from or None when the
+    search is exhausted). If Edamam is unavailable the cursor points at the
+    page that failed, so it can be retried."""
+
+    if '' in query:
+        query.remove('')
+
+    qualifying = []
+    seen_urls = set()
+    start = decode_cursor(cursor)
+    pages = 0
+
+    while start < MAX_RESULTS and pages < max_pages:
+        end = min(start + page_size, MAX_RESULTS)
+        data = call_recipe_api(query, diet, health, end, excluded, start)
+        if data.get('unavailable') or 'hits' not in data:
+            break
+
+        # skip recipes already shown on an earlier page
+        recipes = RecipeList(recipe for recipe in iter_recipes(data)
+                                        if recipe.url not in seen_urls)
+        seen_urls.update(recipe.url for recipe in recipes)
+        qualifying.extend(filter_recipes(recipes, query, mins, maxs, unit))
+        start = end
+        pages += 1
+
+        if not data.get('more') or not data['hits']:
+            return qualifying, None
+        if len(qualifying) >= want:
+            break
+
+    if start >= MAX_RESULTS:
+        return qualifying, None
+
+    return qualifying, encode_cursor(start)
+
+
+def filter_recipes(recipes, query, mins, maxs, unit):
+    """Recipes meeting every ingredient constraint (no best-match fallback)"""
+
+    checked = dict(check_constraints(recipes, query, mins, maxs, unit, 1,
+                                        selective_first=True))
+    if len(checked) < len(query):
+        return []
+
+    return [recipe for recipe in recipes 
+                if all(id(recipe) in recipe_ids 
+                                        for recipe_ids in checked.values())]
+
+
+def encode_cursor(start):
+    """Opaque cursor for resuming a paginated search at position start"""
+
+    encoded = json.dumps({'from': start}).encode('utf-8')
+
+    return base64.urlsafe_b64encode(encoded).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Position encoded in cursor, 0 for a missing or malformed cursor"""
+
+    if not cursor:
+        return 0
+
+    try:
+        start = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return max(0, int(start['from']))
+    except (ValueError, KeyError, TypeError, binascii.Error):
+        return 0
+
+
+def parse_relevant_ingred(query, recipes, within=None):
+    """Find recipes using query ingredient and parse the matching lines;
+    within, if given, limits the search to recipes with those ids"""
+
+    matches = relevant_lines(query, recipes, within)
+
+    # lines the local parser handles were parsed once, on their recipe
+    parsed_ingred_dict = []
+    unparsed = []
+    for recipe, lines in matches:
+        for line in lines:
+            if line.parsed is None:
+                unparsed.append(line.text)
+            else:
+                parsed_ingred_dict.append(line.parsed)
+
+    parsed_ingreds = itools.parse_ingredients(unparsed, local=False)
+    parsed_ingred_dict.extend(ingred for ingred in parsed_ingreds 
+                                                    if ingred is not None)
+
+    return ([recipe for recipe, lines in matches], 
+            [[line.text for line in lines] for recipe, lines in matches],
+            parsed_ingred_dict)
+
+
+@metrics.timed('get_relevant_recipes_and_ingred')
+def get_relevant_recipes_and_ingred(query, recipes, within=None):
+    """Extract lists of strings with ingredient with limits
+
+    Returns [relevant recipes, list of every matching line per recipe]."""
+
+    matches = relevant_lines(query, recipes, within)
             
-    return [relevant_recipes, target_ingreds]
+    return [[recipe for recipe, lines in matches], 
+            [[line.text for line in lines] for recipe, lines in matches]]
+
+
+def relevant_lines(query, recipes, within=None):
+    """[(recipe, [IngredientLine matching query])] for recipes using the
+    query ingredient; within, if given, limits them to those recipe ids"""
+
+    index = getattr(recipes, 'ingredient_index', None)
+    if index is None:
+        index = IngredientIndex(recipes)
+
+    matches = []
+    for recipe_idx, line_idxs in sorted(index.lookup(query).items()):
+        recipe = recipes[recipe_idx]
+        if within is not None and id(recipe) not in within:
+            continue
+        # plain dict recipes (older callers) get lines for this lookup only
+        lines = getattr(recipe, 'lines', None)
+        if lines is None:
+            lines = [IngredientLine(str(text)) 
+                                        for text in recipe['ingredients']]
+        matches.append((recipe, [lines[line_idx] for line_idx in line_idxs]))
 
+    return matches
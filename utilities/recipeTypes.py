@@ -0,0 +1,91 @@
+"""Compact recipe and ingredient line types used in the search pipeline"""
+
+import sys
+from utilities import ingredientParser
+
+_unparsed = object()
+
+
+class IngredientLine(object):
+    """One ingredient line of a recipe, parsed on first use"""
+
+    __slots__ = ('text', '_parsed')
+
+    def __init__(self, text):
+
+        self.text = text
+        self._parsed = _unparsed
+
+    @property
+    def parsed(self):
+        """Local parse of the line, None if the rules can't handle it"""
+
+        if self._parsed is _unparsed:
+            parsed = ingredientParser.parse_line(self.text)
+            if parsed is not None:
+                parsed['unitLong'] = sys.intern(parsed['unitLong'])
+                parsed['name'] = sys.intern(parsed['name'])
+            self._parsed = parsed
+
+        return self._parsed
+
+    @property
+    def amount(self):
+        return self.parsed and self.parsed['amount']
+
+    @property
+    def unit(self):
+        return self.parsed and self.parsed['unitLong']
+
+    @property
+    def name(self):
+        return self.parsed and self.parsed['name']
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return f"<IngredientLine {self.text!r}>"
+
+
+class Recipe(object):
+    """Recipe fields used by filters and templates
+
+    Ingredient lines are kept as interned strings; IngredientLine objects
+    are only created when quantities are asked for."""
+
+    __slots__ = ('title', 'image', 'url', 'ingredients', 'diet_labels',
+                    'health_labels', '_lines')
+
+    def __init__(self, title, image, url, ingredients, diet_labels=(),
+                    health_labels=()):
+
+        self.title = title
+        self.image = image
+        self.url = url
+        self.ingredients = tuple(sys.intern(text) for text in ingredients)
+        self.diet_labels = tuple(sys.intern(label) for label in diet_labels)
+        self.health_labels = tuple(sys.intern(label)
+                                                for label in health_labels)
+        self._lines = None
+
+    @property
+    def lines(self):
+        """IngredientLine for each ingredient, created on first use"""
+
+        if self._lines is None:
+            self._lines = tuple(IngredientLine(text)
+                                                for text in self.ingredients)
+
+        return self._lines
+
+    def __getitem__(self, key):
+        """Dict-style access kept for templates and older callers"""
+
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __repr__(self):
+        return f"<Recipe title={self.title}>"
@@ -1,8 +1,188 @@
+"""Process-safe tracking of the Spoonacular API call budget"""
+
 from datetime import datetime
-import pickle
+import os, pickle, sqlite3, threading, warnings
+
+QUOTA_DB = os.environ.get('QUOTA_DB', 'api_quota.sqlite')
+LEGACY_FILE = 'api_tracker.pickle'
+
+CALL_LIMIT = 50
+RESULT_LIMIT = 500
+
+
+class QuotaStore(object):
+    """Daily API budget in a SQLite (WAL) file shared by all workers
+
+    Every read-modify-write runs inside BEGIN IMMEDIATE, so concurrent
+    processes can't both spend the last call."""
+
+    def __init__(self, path=QUOTA_DB, legacy_file=LEGACY_FILE):
+
+        self.path = path
+        self.legacy_file = legacy_file
+        self._local = threading.local()
+
+    def _connection(self):
+        """SQLite connection for the current thread, creating the table"""
+
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10,
+                                    isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS api_quota '
+                            '(api TEXT PRIMARY KEY, call_update_date TEXT, '
+                            'qty_calls_remaining INTEGER, '
+                            'qty_results_remaining INTEGER)')
+            self._local.conn = conn
+
+        return conn
+
+    def _transaction(self, update):
+        """Run update(state) atomically on today's state; save what it
+        returns as the new state along with its result"""
+
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT call_update_date, qty_calls_remaining, '
+                                'qty_results_remaining FROM api_quota '
+                                'WHERE api=?', ('spoonacular',)).fetchone()
+            if row is None:
+                state = self._initial_state()
+            else:
+                state = {'call_update_date': _to_date(row[0]),
+                        'qty_calls_remaining': row[1],
+                        'qty_results_remaining': row[2]}
+
+            # budget resets each day (UTC)
+            if datetime.utcnow().date() > state['call_update_date']:
+                state = _full_budget()
+
+            result, state = update(state)
+            conn.execute('INSERT OR REPLACE INTO api_quota VALUES (?,?,?,?)',
+                            ('spoonacular',
+                            state['call_update_date'].isoformat(),
+                            state['qty_calls_remaining'],
+                            state['qty_results_remaining']))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        return result
+
+    def _initial_state(self):
+        """Start from the old pickle tracker if present, else a full budget"""
+
+        if self.legacy_file and os.path.exists(self.legacy_file):
+            with open(self.legacy_file, 'rb') as file:
+                call_info = pickle.load(file)
+            return {key: call_info[key] for key in ('call_update_date',
+                                                    'qty_calls_remaining',
+                                                    'qty_results_remaining')}
+
+        return _full_budget()
+
+    def has_budget(self):
+        """Whether at least one call and one result remain today"""
+
+        return self._transaction(lambda state: (_available(state), state))
+
+    def reserve(self, qty_calls=1):
+        """Atomically take qty_calls from today's budget if available"""
+
+        def update(state):
+            if (state['qty_calls_remaining'] >= qty_calls
+                                    and state['qty_results_remaining'] > 0):
+                state = dict(state, qty_calls_remaining=
+                                    state['qty_calls_remaining'] - qty_calls)
+                return True, state
+            return False, state
+
+        return self._transaction(update)
+
+    def release(self, qty_calls=1):
+        """Return reserved calls that were not sent"""
+
+        def update(state):
+            return None, dict(state, qty_calls_remaining=
+                                    state['qty_calls_remaining'] + qty_calls)
+
+        return self._transaction(update)
+
+    def set_remaining(self, date, qty_calls_remaining, qty_results_remaining):
+        """Take the counts reported by the API; on the same day keep the
+        lower local counts, which include calls reserved but not yet sent"""
+
+        def update(state):
+            if date < state['call_update_date']:
+                return None, state
+            if date == state['call_update_date']:
+                qty_calls = min(qty_calls_remaining, 
+                                state['qty_calls_remaining'])
+                qty_results = min(qty_results_remaining, 
+                                    state['qty_results_remaining'])
+            else:
+                qty_calls = qty_calls_remaining
+                qty_results = qty_results_remaining
+            return None, {'call_update_date': date,
+                            'qty_calls_remaining': qty_calls,
+                            'qty_results_remaining': qty_results}
+
+        return self._transaction(update)
+
+    def reset(self):
+        """Restore today's full budget"""
+
+        return self._transaction(lambda state: (None, _full_budget()))
+
+    def state(self):
+        """Current budget as a dict"""
+
+        return self._transaction(lambda state: (dict(state), state))
+
 
+def _full_budget():
+    """Budget at the start of a day"""
 
-def update_API_calls_remaining(header, file='api_tracker.pickle'):
+    return {'call_update_date': datetime.utcnow().date(),
+            'qty_calls_remaining': CALL_LIMIT,
+            'qty_results_remaining': RESULT_LIMIT}
+
+
+def _available(state):
+    """Whether calls and results remain in state"""
+
+    return (state['qty_calls_remaining'] > 0
+                                    and state['qty_results_remaining'] > 0)
+
+
+def _to_date(value):
+    """Parse an ISO date stored in SQLite"""
+
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(path=None):
+    """Shared QuotaStore for path, QUOTA_DB by default"""
+
+    path = path or QUOTA_DB
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = QuotaStore(path)
+        return _stores[path]
+
+
+##############################################################################
+# Compatibility functions used before the quota store; passing pickle files
+# still works but is deprecated
+
+def update_API_calls_remaining(header, file=None, path=None):
     """Update remaining calls for spoonacular API"""
 
     # extract time and remaining budget from header
@@ -10,56 +190,77 @@ def update_API_calls_remaining(header, file='api_tracker.pickle'):
     qty_calls_remaining = int(header['X-RateLimit-requests-Remaining'])
     qty_results_remaining = int(header['X-RateLimit-results-Remaining'])
 
-    # set boolean for whether calls are available
-    if qty_calls_remaining > 0 and qty_results_remaining > 0:
-        calls_avail_bool = True
-
-    else:
-        calls_avail_bool = False
+    if file is not None:
+        _warn_pickle('update_API_calls_remaining')
+        _dump_pickle(file, date, qty_calls_remaining, qty_results_remaining)
+        return
 
-    # write call information to file
-    call_info = {"call_update_date":date,"calls_avail_bool":calls_avail_bool, 
-                    "qty_calls_remaining":qty_calls_remaining,
-                    "qty_results_remaining":qty_results_remaining}
-    with open(file,'wb') as file:
-        pickle.dump(call_info, file)
+    get_store(path).set_remaining(date, qty_calls_remaining,
+                                    qty_results_remaining)
 
 
-def check_api_call_budget(infile='api_tracker.pickle', 
-                                    outfile='api_tracker.pickle'):
+def check_api_call_budget(infile=None, outfile=None, path=None):
     """Check for remaining API calls before making a call"""
 
+    if infile is None and outfile is None:
+        return get_store(path).has_budget()
+
+    _warn_pickle('check_api_call_budget')
+    infile = infile or LEGACY_FILE
     with open(infile,'rb') as file:
         call_info = pickle.load(file)
 
-    if call_info['calls_avail_bool']==True and call_info['qty_calls_remaining']>0:
+    if (call_info['calls_avail_bool']==True 
+                                    and call_info['qty_calls_remaining']>0):
         return True
 
-    else:
-        now = datetime.utcnow().date()
-        if now > call_info['call_update_date']:
-            reset_api_call_count(outfile)
-            return True
-            
-        else:
-            return False
+    # budget resets each day (UTC)
+    if datetime.utcnow().date() > call_info['call_update_date']:
+        _dump_pickle(outfile or LEGACY_FILE, datetime.utcnow().date(), 
+                        CALL_LIMIT, RESULT_LIMIT)
+        return True
+
+    return False
+
+
+def reserve_api_calls(qty_calls=1, path=None):
+    """Reserve calls before sending a batch; False if over budget"""
+
+    return get_store(path).reserve(qty_calls)
 
 
-def reset_api_call_count(filename='api_tracker.pickle'):
+def release_api_calls(qty_calls=1, path=None):
+    """Return reserved calls that were not charged"""
+
+    get_store(path).release(qty_calls)
+
+
+def reset_api_call_count(filename=None, path=None):
     """Reset counters for API"""
-    
-    CALL_LIMIT = 50
-    RESULT_LIMIT = 500
-
-    calls_avail_bool = True
-    call_update_date = datetime.utcnow().date()
-    qty_results_remaining = RESULT_LIMIT
-    qty_calls_remaining = CALL_LIMIT
-
-    call_info = {"call_update_date":call_update_date,"calls_avail_bool":calls_avail_bool, 
-                "qty_calls_remaining":qty_calls_remaining,
-                "qty_results_remaining":qty_results_remaining}
-
-    file = open(filename, 'wb')
-    pickle.dump(call_info, file)
-    file.close()
\ No newline at end of file
+
+    if filename is not None:
+        _warn_pickle('reset_api_call_count')
+        _dump_pickle(filename, datetime.utcnow().date(), CALL_LIMIT, 
+                        RESULT_LIMIT)
+        return
+
+    get_store(path).reset()
+
+
+def _warn_pickle(name):
+
+    warnings.warn(f"{name}: pickle tracker files are deprecated and not "
+                    "shared between workers; use the quota store (path=...)",
+                    DeprecationWarning, stacklevel=3)
+
+
+def _dump_pickle(filename, date, qty_calls_remaining, qty_results_remaining):
+    """Write a budget in the old pickle tracker format"""
+
+    call_info = {"call_update_date": date,
+                    "calls_avail_bool": (qty_calls_remaining > 0 
+                                            and qty_results_remaining > 0),
+                    "qty_calls_remaining": qty_calls_remaining,
+                    "qty_results_remaining": qty_results_remaining}
+    with open(filename, 'wb') as file:
+        pickle.dump(call_info, file)
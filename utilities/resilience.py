@@ -0,0 +1,277 @@
+"""Circuit breakers, per-request timeout budgets and background refreshes
+for calls to the upstream recipe and ingredient APIs"""
+
+import functools, os, threading, time
+from concurrent import futures
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from utilities import httpClient, metrics
+
+# consecutive failures that open a breaker, and seconds before a trial call
+FAILURE_THRESHOLD = int(os.environ.get('BREAKER_FAILURES', 5))
+RESET_TIMEOUT = float(os.environ.get('BREAKER_RESET_SECONDS', 30))
+
+# latency objective for a search route, and the share of it upstream calls
+# may spend; the rest is left for parsing and rendering
+SLO_SECONDS = float(os.environ.get('ROUTE_SLO_SECONDS', 5))
+UPSTREAM_SHARE = float(os.environ.get('UPSTREAM_BUDGET_SHARE', 0.6))
+
+CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+UPSTREAM_ERRORS = (requests.RequestException, ValueError)
+
+# client errors that say the upstream is overloaded rather than the request
+# is bad; these still count against its breaker
+THROTTLED_STATUSES = (429,)
+
+# client errors about our credentials rather than the request
+AUTH_STATUSES = (401, 403)
+
+_local = threading.local()
+
+# stale searches refreshed and new ones indexed off the request path
+refresh_pool = ThreadPoolExecutor(max_workers=2)
+_refreshing = {}
+_refresh_lock = threading.Lock()
+
+
+class UpstreamUnavailable(Exception):
+    """Upstream call failed, was refused by its breaker or ran out of time"""
+
+
+class CircuitOpen(UpstreamUnavailable):
+    """Breaker is open; the upstream isn't called"""
+
+
+class BudgetExhausted(UpstreamUnavailable):
+    """Request has no time left for upstream calls"""
+
+
+class UpstreamRejected(Exception):
+    """Upstream answered but refused the request itself (4xx); the upstream
+    is up, so this doesn't count against its breaker"""
+
+
+class UpstreamUnauthorized(UpstreamRejected):
+    """Upstream refused our credentials (401/403); any request would fail
+    the same way until the keys are fixed"""
+
+
+class CircuitBreaker(object):
+    """Stops calling an upstream after repeated failures
+
+    Closed: calls go through. After failure_threshold consecutive failures
+    the breaker opens and calls fail fast. After reset_timeout seconds one
+    trial call is let through (half-open); its success closes the breaker,
+    its failure opens it again."""
+
+    def __init__(self, name, failure_threshold=FAILURE_THRESHOLD,
+                    reset_timeout=RESET_TIMEOUT):
+
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._opened = None
+        self._trial = False
+        self._lock = threading.Lock()
+        metrics.circuit_state.set(name, STATE_VALUES[CLOSED])
+
+    @property
+    def state(self):
+        """closed, half_open once the cooldown has passed, or open"""
+
+        if self._opened is None:
+            return CLOSED
+        if time.monotonic() - self._opened >= self.reset_timeout:
+            return HALF_OPEN
+
+        return OPEN
+
+    def available(self):
+        """Whether a call would be let through, without claiming the trial"""
+
+        with self._lock:
+            state = self.state
+            return state == CLOSED or (state == HALF_OPEN and not self._trial)
+
+    def allow(self):
+        """Whether to make a call now; claims the half-open trial"""
+
+        with self._lock:
+            state = self.state
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and not self._trial:
+                self._trial = True
+                metrics.circuit_state.set(self.name, STATE_VALUES[HALF_OPEN])
+                return True
+
+        return False
+
+    def release_trial(self):
+        """Let another caller make the half-open trial call"""
+
+        with self._lock:
+            self._trial = False
+
+    def record_success(self):
+
+        with self._lock:
+            self.failures = 0
+            self._opened = None
+            self._trial = False
+        metrics.circuit_state.set(self.name, STATE_VALUES[CLOSED])
+
+    def record_failure(self):
+
+        with self._lock:
+            self.failures += 1
+            reopen = self._trial or self.failures >= self.failure_threshold
+            self._trial = False
+            if not reopen:
+                return
+            if self._opened is None or self.state == HALF_OPEN:
+                metrics.circuit_opens.inc(self.name)
+            self._opened = time.monotonic()
+        metrics.circuit_state.set(self.name, STATE_VALUES[OPEN])
+
+    def call(self, function, *args, **kwargs):
+        """Return function(*args, **kwargs) through the breaker, raising
+        UpstreamUnavailable on failure"""
+
+        if not self.allow():
+            raise CircuitOpen(self.name)
+
+        try:
+            result = function(*args, **kwargs)
+        except BudgetExhausted:
+            # out of time is the caller's problem, not the upstream's
+            self.release_trial()
+            raise
+        except UpstreamRejected:
+            self.record_success()
+            raise
+        except (UpstreamUnavailable,) + UPSTREAM_ERRORS as error:
+            self.record_failure()
+            raise UpstreamUnavailable(f"{self.name}: {error!r}") from error
+        except BaseException:
+            self.release_trial()
+            raise
+
+        self.record_success()
+
+        return result
+
+
+breakers = {'edamam': CircuitBreaker('edamam'),
+            'spoonacular': CircuitBreaker('spoonacular')}
+
+
+def check_status(name, response):
+    """Raise UpstreamUnavailable for server errors and throttling,
+    UpstreamUnauthorized for credential errors and UpstreamRejected for
+    other client errors"""
+
+    status = response.status_code
+    if status < 400:
+        return
+
+    message = f"{name} {status}: {response.text[:200]}"
+    if status >= 500 or status in THROTTLED_STATUSES:
+        raise UpstreamUnavailable(message)
+    if status in AUTH_STATUSES:
+        raise UpstreamUnauthorized(message)
+
+    raise UpstreamRejected(message)
+
+
+def record_fallback(fallback):
+    """Count an upstream result replaced by stale, empty or partial data"""
+
+    metrics.fallbacks.inc(fallback)
+
+
+def start_budget(slo=SLO_SECONDS):
+    """Give upstream calls on this thread their share of an slo-second
+    latency objective"""
+
+    _local.deadline = time.monotonic() + slo*UPSTREAM_SHARE
+
+
+def end_budget():
+    """Remove this thread's budget"""
+
+    _local.deadline = None
+
+
+def remaining():
+    """Seconds left for upstream calls, or None outside a budget"""
+
+    deadline = getattr(_local, 'deadline', None)
+    if deadline is None:
+        return None
+
+    return deadline - time.monotonic()
+
+
+def call_timeout(default=httpClient.DEFAULT_TIMEOUT):
+    """(connect, read) timeouts capped at the time left in the budget"""
+
+    left = remaining()
+    if left is None:
+        return default
+    if left <= 0:
+        raise BudgetExhausted('no time left for upstream calls')
+
+    connect, read = default
+
+    return min(connect, left), min(read, left)
+
+
+def bind(function):
+    """Carry this thread's budget into a worker thread"""
+
+    deadline = getattr(_local, 'deadline', None)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        previous = getattr(_local, 'deadline', None)
+        _local.deadline = deadline
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _local.deadline = previous
+
+    return wrapper
+
+
+def refresh_in_background(key, function, *args):
+    """Run function(*args) on the refresh pool unless key is already being
+    refreshed; return its future"""
+
+    def _refresh():
+        try:
+            return function(*args)
+        except (UpstreamUnavailable, UpstreamRejected):
+            return None
+        finally:
+            with _refresh_lock:
+                _refreshing.pop(key, None)
+
+    with _refresh_lock:
+        if key not in _refreshing:
+            _refreshing[key] = refresh_pool.submit(_refresh)
+        return _refreshing[key]
+
+
+def wait_for_refreshes():
+    """Block until background jobs, and any they start, have finished"""
+
+    while True:
+        with _refresh_lock:
+            pending = list(_refreshing.values())
+        if not pending:
+            return
+        futures.wait(pending)
@@ -0,0 +1,148 @@
+"""Persistent cache for upstream API responses"""
+
+import hashlib, json, sqlite3, threading, time
+from collections import OrderedDict
+from utilities import metrics
+
+
+class ResponseCache(object):
+    """In-process LRU in front of an on-disk SQLite table, with TTL
+
+    Entries past their TTL are kept on disk for stale_ttl more seconds so
+    callers can serve them while refreshing."""
+
+    def __init__(self, path, table='responses', ttl=6*60*60, max_entries=256,
+                    max_disk_entries=20000, stale_ttl=0):
+
+        self.path = path
+        self.table = table
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.stale_ttl = stale_ttl
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes = 0
+
+    @staticmethod
+    def make_key(payload):
+        """Content address for a payload, independent of key order/case"""
+
+        normalized = {}
+        for name, value in payload.items():
+            if isinstance(value, str):
+                value = value.strip().lower()
+            elif isinstance(value, (list, tuple)):
+                value = sorted(str(item).strip().lower() for item in value)
+            normalized[name] = value
+
+        encoded = json.dumps(normalized, sort_keys=True, default=str)
+
+        return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+    def _connection(self):
+        """SQLite connection for the current thread"""
+
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(f'CREATE TABLE IF NOT EXISTS {self.table} '
+                            '(key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+                            'created REAL NOT NULL)')
+            self._local.conn = conn
+
+        return conn
+
+    def get(self, key):
+        """Return cached value for key, or None if missing or expired"""
+
+        value, fresh = self.lookup(key)
+
+        return value if fresh else None
+
+    def lookup(self, key):
+        """Return (value, fresh) for key; expired values are returned with
+        fresh False until they are stale_ttl seconds past their TTL"""
+
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[1] < self.ttl:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                metrics.cache_lookups.inc((self.table, 'memory_hit'))
+                return entry[0], True
+
+        row = self._connection().execute(
+                    f'SELECT value, created FROM {self.table} WHERE key=?',
+                    (key,)).fetchone()
+
+        with self._lock:
+            if row is None or now - row[1] >= self.ttl + self.stale_ttl:
+                self.misses += 1
+                metrics.cache_lookups.inc((self.table, 'miss'))
+                return None, False
+
+            value = json.loads(row[0])
+            self._remember(key, value, row[1])
+            fresh = now - row[1] < self.ttl
+            if fresh:
+                self.hits += 1
+                self.disk_hits += 1
+                metrics.cache_lookups.inc((self.table, 'disk_hit'))
+            else:
+                self.stale_hits += 1
+                metrics.cache_lookups.inc((self.table, 'stale_hit'))
+
+        return value, fresh
+
+    def set(self, key, value):
+        """Store value under key in memory and on disk"""
+
+        now = time.time()
+
+        with self._lock:
+            self._remember(key, value, now)
+            self._writes += 1
+            prune = self._writes % 100 == 0
+
+        conn = self._connection()
+        with conn:
+            conn.execute(f'INSERT OR REPLACE INTO {self.table} '
+                            '(key, value, created) VALUES (?, ?, ?)',
+                            (key, json.dumps(value), now))
+            if prune:
+                self._prune(conn, now)
+
+    def _remember(self, key, value, created):
+        """Add entry to the in-memory LRU, evicting the oldest if full"""
+
+        self._memory[key] = (value, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _prune(self, conn, now):
+        """Drop expired rows and keep the disk tier under its size bound"""
+
+        conn.execute(f'DELETE FROM {self.table} WHERE created < ?',
+                        (now - self.ttl - self.stale_ttl,))
+        conn.execute(f'DELETE FROM {self.table} WHERE key NOT IN '
+                        f'(SELECT key FROM {self.table} ORDER BY created DESC '
+                        'LIMIT ?)', (self.max_disk_entries,))
+
+    def stats(self):
+        """Hit/miss counters for monitoring"""
+
+        return {'hits': self.hits, 'disk_hits': self.disk_hits,
+                'misses': self.misses, 'stale_hits': self.stale_hits, 
+                'entries': len(self._memory)}
@@ -0,0 +1,58 @@
+"""Coalesce concurrent identical calls into one in-flight call"""
+
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight(object):
+    """Concurrent callers with the same key share the first caller's result
+
+    The first caller runs the call and the rest wait on its future."""
+
+    def __init__(self):
+
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.shared = 0
+
+    def _join(self, key):
+        """Return (future for key, whether this caller should run the call)"""
+
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.shared += 1
+                return future, False
+
+            future = Future()
+            self._calls[key] = future
+            return future, True
+
+    def _finish(self, key, future, result=None, error=None):
+        """Hand result or error to waiters; later callers start afresh"""
+
+        with self._lock:
+            del self._calls[key]
+
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key, function, *args, **kwargs):
+        """Return function(*args, **kwargs), shared with concurrent callers
+        using the same key"""
+
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as error:
+            self._finish(key, future, error=error)
+            raise
+
+        self._finish(key, future, result)
+
+        return result
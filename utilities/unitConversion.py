@@ -0,0 +1,164 @@
+"""In-memory unit conversion table built from the unit seed tables"""
+
+import hashlib, string, threading, time
+import numpy as np
+from model import db, UnitConversion, FormattedUnit
+
+# seconds between checks for reseeded unit tables
+REFRESH_INTERVAL = 300
+
+_translator = str.maketrans('', '', string.punctuation)
+_lock = threading.Lock()
+_table = None
+_version = 0
+_last_checked = 0
+
+
+class ConversionTable(object):
+    """Versioned alias -> canonical unit -> base unit + factor lookups"""
+
+    def __init__(self, formatted_units, conversions, version=0,
+                    fingerprint=None):
+        """Build lookups from (unit_name, formatted_name, meas_type) rows and
+        (base_unit, meas_type, std_unit, mult_factor) rows"""
+
+        self.version = version
+        self.fingerprint = fingerprint
+
+        self.aliases = {}
+        for unit_name, formatted_name, meas_type in formatted_units:
+            self.aliases[unit_name] = formatted_name
+
+        self.conversions = {}
+        for base_unit, meas_type, std_unit, mult_factor in conversions:
+            self.conversions[base_unit] = (std_unit, float(mult_factor))
+
+        # integer codes for standard units so arrays can be compared
+        self.std_units = sorted({std for std, _ in self.conversions.values()})
+        self.std_codes = {std: code for code, std
+                                    in enumerate(self.std_units)}
+
+        # raw unit string -> (mult_factor, std unit code), filled on demand
+        self._encoded = {}
+
+    def standardize(self, original_unit):
+        """Map a raw unit string to its canonical unit name"""
+
+        # get rid of extra characters
+        unit = str(original_unit).translate(_translator).strip()
+
+        # lowercase unless it is T (tablespoon)
+        if unit != 'T':
+            unit = unit.lower()
+
+        try:
+            return self.aliases[unit]
+        except KeyError:
+            raise KeyError(f"Unknown unit: {original_unit}")
+
+    def convert(self, qty, original_unit):
+        """Convert quantity to the base unit of its measurement type"""
+
+        formatted = self.standardize(original_unit)
+        try:
+            std_unit, mult_factor = self.conversions[formatted]
+        except KeyError:
+            raise KeyError(f"No conversion for unit: {formatted}")
+
+        return float(qty)*mult_factor, std_unit
+
+    def encode(self, units):
+        """Return arrays of multiplication factors and standard unit codes
+
+        Units that cannot be converted get a NaN factor and a code of -1."""
+
+        factors = np.empty(len(units))
+        codes = np.empty(len(units), dtype=np.int64)
+
+        for idx, unit in enumerate(units):
+            encoded = self._encoded.get(unit)
+            if encoded is None:
+                try:
+                    std_qty, std_unit = self.convert(1, unit)
+                    encoded = (std_qty, self.std_codes[std_unit])
+                except KeyError:
+                    encoded = (np.nan, -1)
+                self._encoded[unit] = encoded
+            factors[idx], codes[idx] = encoded
+
+        return factors, codes
+
+
+def _read_tables():
+    """(formatted unit rows, conversion rows) from both unit tables"""
+
+    formatted_units = db.session.query(FormattedUnit.unit_name,
+                                        FormattedUnit.formatted_name,
+                                        FormattedUnit.meas_type).order_by(
+                                            FormattedUnit.record_id).all()
+    conversions = db.session.query(UnitConversion.base_unit,
+                                    UnitConversion.meas_type,
+                                    UnitConversion.std_unit,
+                                    UnitConversion.mult_factor).order_by(
+                                        UnitConversion.record_id).all()
+
+    return ([tuple(row) for row in formatted_units], 
+            [tuple(row) for row in conversions])
+
+
+def _table_fingerprint(rows):
+    """Hash of the unit rows; changes on a reseed and on an upsert that
+    edits rows in place"""
+
+    return hashlib.sha256(repr(rows).encode('utf-8')).hexdigest()
+
+
+def _load_table(rows=None):
+    """Build a new conversion table from rows, reading both unit tables
+    once if not given"""
+
+    global _version
+
+    if rows is None:
+        rows = _read_tables()
+    _version += 1
+
+    return ConversionTable(*rows, version=_version, 
+                            fingerprint=_table_fingerprint(rows))
+
+
+def refresh_table():
+    """Rebuild the conversion table, e.g. after seed.py reloads units"""
+
+    global _table, _last_checked
+
+    with _lock:
+        _table = _load_table()
+        _last_checked = time.monotonic()
+
+    return _table
+
+
+def get_table():
+    """Return the loaded conversion table, loading it on first use"""
+
+    global _table, _last_checked
+
+    table = _table
+    now = time.monotonic()
+    if table is not None and now - _last_checked < REFRESH_INTERVAL:
+        return table
+
+    with _lock:
+        if _table is None:
+            _table = _load_table()
+
+        # another process may have reseeded or upserted the unit tables
+        elif now - _last_checked >= REFRESH_INTERVAL:
+            rows = _read_tables()
+            if _table_fingerprint(rows) != _table.fingerprint:
+                _table = _load_table(rows)
+
+        _last_checked = now
+
+        return _table
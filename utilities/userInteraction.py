@@ -1,17 +1,109 @@
-from model import db, DietPreference, ExcludedIngredient
+import threading, time
+from collections import defaultdict, namedtuple
+from model import db, User, DietPreference, ExcludedIngredient
+from utilities import metrics
 
+# saved preferences of one user; excluded is a tuple or None
+FoodPreferences = namedtuple('FoodPreferences', ['diet', 'health', 'excluded'])
 
+NO_PREFERENCES = FoodPreferences(None, None, None)
+
+# seconds cached preferences are served before their version is checked;
+# changes saved by another process show up within this long
+PREFERENCE_TTL = 30
+
+# user_id: (prefs_version, preferences, time checked); past PREFERENCE_TTL
+# an entry is used while its version matches the user's row, which every
+# process's updates bump
+_preference_cache = {}
+# invalidations per user in this process, to spot loads they overtook
+_invalidations = defaultdict(int)
+_preference_lock = threading.Lock()
+
+
+@metrics.timed('set_food_preferences')
 def set_food_preferences(session):
     """Setting saved diet and ingredient exclusions for registered users"""
     if 'user_id' in session:
-        diet, health = get_diet_preferences(session['user_id'])
-        exclusion_list = get_ingred_exclusions(session['user_id'])
-    else:
-        diet = None
-        health = None
-        exclusion_list = None
+        return get_food_preferences(session['user_id'])
+
+    return NO_PREFERENCES
+
+
+def get_food_preferences(user_id):
+    """Preferences of user, from the cache within PREFERENCE_TTL and then
+    while its version is current"""
+
+    now = time.monotonic()
+    with _preference_lock:
+        cached = _preference_cache.get(user_id)
+        invalidations = _invalidations[user_id]
+    if cached is not None:
+        version, preferences, checked = cached
+        if now - checked < PREFERENCE_TTL:
+            return preferences
+        if version == get_prefs_version(user_id):
+            with _preference_lock:
+                if _invalidations[user_id] == invalidations:
+                    _preference_cache[user_id] = (version, preferences, now)
+            return preferences
+
+    version, preferences = load_food_preferences(user_id)
+    with _preference_lock:
+        # an update made during the load may already be newer than this
+        if _invalidations[user_id] == invalidations:
+            _preference_cache[user_id] = (version, preferences, now)
 
-    return diet, health, exclusion_list
+    return preferences
+
+
+def get_prefs_version(user_id):
+    """Version of the user's saved preferences, None for unknown users"""
+
+    return db.session.query(User.prefs_version).filter_by(
+                                                    user_id=user_id).scalar()
+
+
+def load_food_preferences(user_id):
+    """Load the version, diet, health and exclusions of user in a single
+    query; returns (prefs_version, preferences)"""
+
+    user = User.query.options(
+                db.joinedload(User.diet_prefs).joinedload(
+                                                    DietPreference.diet_type),
+                db.joinedload(User.excluded_ingreds)).get(user_id)
+    if user is None:
+        return None, NO_PREFERENCES
+
+    health = None
+    diet = None
+    for preference in user.diet_prefs:
+        if preference.diet_type.edamam_class == 'Health':
+            health = preference.diet_type.diet_name
+        else:
+            diet = preference.diet_type.diet_name
+
+    excluded = tuple(exclusion.ingred_name 
+                                    for exclusion in user.excluded_ingreds)
+
+    return user.prefs_version, FoodPreferences(diet, health, excluded or None)
+
+
+def bump_prefs_version(user_id):
+    """Mark the user's cached preferences stale in every process; commit
+    with the change"""
+
+    User.query.filter_by(user_id=user_id).update(
+                    {User.prefs_version: User.prefs_version + 1}, 
+                    synchronize_session=False)
+
+
+def invalidate_food_preferences(user_id):
+    """Drop cached preferences of user after they change"""
+
+    with _preference_lock:
+        _preference_cache.pop(user_id, None)
+        _invalidations[user_id] += 1
 
 
 def update_diet_preference(user_id, preferences):
@@ -28,23 +120,17 @@ def update_diet_preference(user_id, preferences):
             db.session.add(new_preference_entry)
 
     # committing changes
+    bump_prefs_version(user_id)
     db.session.commit()
+    invalidate_food_preferences(user_id)
 
 
 def get_diet_preferences(user_id):
     """Get diet preferences from db"""
 
-    preferences = DietPreference.query.filter_by(user_id=user_id).all()
-    health = None
-    diet = None
+    preferences = get_food_preferences(user_id)
 
-    for preference in preferences:
-        if preference.diet_type.edamam_class == 'Health':
-            health = preference.diet_type.diet_name
-        else:
-            diet = preference.diet_type.diet_name
-
-    return diet, health
+    return preferences.diet, preferences.health
 
 
 def update_ingredient_exclusions(user_id, updates):
@@ -64,7 +150,9 @@ def update_ingredient_exclusions(user_id, updates):
             db.session.add(new_exclusion_entry)
 
     # committing changes
+    bump_prefs_version(user_id)
     db.session.commit()
+    invalidate_food_preferences(user_id)
 
     return None
 
@@ -72,12 +160,8 @@ def update_ingredient_exclusions(user_id, updates):
 def get_ingred_exclusions(user_id):
     """Get diet preferences from db"""
 
-    exclusions = ExcludedIngredient.query.filter_by(user_id=user_id).all()
-    if exclusions:
-        exclusion_list = []
-        for exclusion in exclusions:
-            exclusion_list.append(exclusion.ingred_name)
-
-        return exclusion_list
+    excluded = get_food_preferences(user_id).excluded
+    if excluded:
+        return list(excluded)
     else:
         return None
\ No newline at end of file
@@ -0,0 +1,88 @@
+"""Prefetch the most popular recent searches into the recipe and ingredient
+caches
+
+    python warm_cache.py [--top N] [--days D] [--parse-share S]
+
+Reads the query log, fetches the top N searches of the last D days
+through recipeTools.get_recipes and parses their ingredient lines. Parsing
+spends at most S of the Spoonacular calls left today. Run it from cron,
+e.g. hourly, so popular searches are answered from the caches."""
+
+import argparse, time
+from utilities import recipeTools, requestTracking, resilience, queryLog
+
+TOP_SEARCHES = 200
+WINDOW_DAYS = 7
+PARSE_SHARE = 0.2
+
+
+def warm_searches(searches):
+    """Fetch each search so the recipe cache and corpus hold it; return
+    [(search, recipes)]"""
+
+    print("Recipe searches")
+    start = time.perf_counter()
+
+    warmed = []
+    for search in searches:
+        recipes = recipeTools.get_recipes(search.query, search.diet,
+                                            search.health, search.num_recipes,
+                                            search.excluded, local_first=False)
+        warmed.append((search, recipes))
+
+    # stale entries were served and are being refreshed in the background
+    resilience.wait_for_refreshes()
+
+    print(f"  {len(warmed)} searches in {time.perf_counter() - start:.1f}s")
+
+    return warmed
+
+
+def preparse(warmed, share):
+    """Parse the ingredient lines ingredient searches check, spending at
+    most share of the API calls left today; return the calls spent"""
+
+    print("Ingredient lines")
+    store = requestTracking.get_store()
+    remaining = store.state()['qty_calls_remaining']
+    allowance = int(remaining * share)
+
+    searched = 0
+    spent = 0
+    for search, recipes in warmed:
+        if not search.ingredient:
+            continue
+        # the routes parse each ingredient separately, one call at most
+        for ingredient in search.query.split(','):
+            spent = remaining - store.state()['qty_calls_remaining']
+            if spent >= allowance:
+                print(f"  stopped after {searched} ingredients: "
+                        f"{spent} of {allowance} calls spent")
+                return spent
+            recipeTools.parse_relevant_ingred(ingredient, recipes)
+            searched += 1
+
+    spent = remaining - store.state()['qty_calls_remaining']
+    print(f"  {searched} ingredients, {spent} of {allowance} calls spent")
+
+    return spent
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--top', type=int, default=TOP_SEARCHES)
+    parser.add_argument('--days', type=float, default=WINDOW_DAYS)
+    parser.add_argument('--parse-share', type=float, default=PARSE_SHARE)
+    args = parser.parse_args()
+
+    since = time.time() - args.days*24*60*60
+    queryLog.query_log.prune(since)
+    searches = queryLog.query_log.top(args.top, since)
+
+    warmed = warm_searches(searches)
+    preparse(warmed, args.parse_share)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+"""WSGI entry point for production servers, see gunicorn.conf.py"""
+
+from model import connect_to_db
+from server import app
+from utilities import dietCatalog
+
+connect_to_db(app)
+
+# diet options are static seed data, read once at startup
+dietCatalog.get_catalog()